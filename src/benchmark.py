@@ -0,0 +1,446 @@
+"""Benchmark suite: times the scripts and the segmentation conversions on synthetic datasets of several sizes.
+
+Each benchmark runs in its own process, whose wall time and peak memory usage (maximum resident set size, of the
+biggest process when the script uses a pool of workers) are recorded. The results are appended to a json history file,
+along with the commit, so that the performance can be compared across commits (Linux only, the peak memory usage comes
+from `os.wait4`).
+
+Run with: python -m src.benchmark --scales small medium
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Sequence
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from src.utils.coco_json import CocoJsonWriter, iter_coco_entries
+from src.utils.misc import clean_print
+from src.utils.profiling import add_profiling_args, start_profiling
+from src.utils.segmentation_conversions import (
+    encoded_rle_to_rle,
+    encoded_rles_to_rles,
+    mask_to_rle,
+    masks_to_rles,
+    polygon_to_rle,
+    polygons_to_rles,
+    rle_to_encoded_rle,
+    rle_to_mask,
+    rle_to_polygon,
+    rles_to_encoded_rles,
+    rles_to_masks,
+    rles_to_polygons,
+)
+from src.utils.synthetic_coco import (
+    get_synthetic_categories,
+    get_synthetic_images,
+    iter_synthetic_annotations,
+    SyntheticConfig,
+    write_synthetic_images,
+    write_voc_annotations,
+)
+
+REPO_PATH = Path(__file__).resolve().parents[1]
+# Number of images and annotations of each scale.
+SCALES: dict[str, tuple[int, int]] = {
+    "small": (100, 1_000),
+    "medium": (1_000, 10_000),
+    "large": (10_000, 100_000),
+    "xlarge": (100_000, 1_000_000),
+}
+BENCHMARK_IMG_SIZES = ((320, 240), (240, 320), (256, 256))
+BENCHMARK_SEGMENTATION_MIX = (0.8, 0.1, 0.1)
+# Number of masks converted by each call of the batched conversion functions (the masks are grouped by size).
+FUNCTION_BATCH_SIZE = 256
+# Runs a command (argv[2:]) and writes its wall time, peak memory usage (in KB) and exit code to a file (argv[1]).
+_MEASURE_SCRIPT = """
+import os, sys, time
+start_time = time.perf_counter()
+pid = os.posix_spawn(sys.argv[2], sys.argv[2:], os.environ)
+_, status, rusage = os.wait4(pid, 0)
+with open(sys.argv[1], "w") as measure_file:
+    measure_file.write(f"{time.perf_counter() - start_time} {rusage.ru_maxrss} {os.waitstatus_to_exitcode(status)}")
+"""
+
+
+class EntryPointCase(NamedTuple):
+    """A script to benchmark."""
+
+    name: str
+    module: str
+    # Returns the arguments of the script from the dataset folder, the output folder and the dataset config.
+    get_args: Callable[[Path, Path, SyntheticConfig], list[str]]
+    inputs: tuple[str, ...] = ()  # Folders needed besides the annotations ("images" and/or "voc").
+
+
+ENTRY_POINT_CASES: tuple[EntryPointCase, ...] = (
+    EntryPointCase("build_coco_cache", "build_coco_cache", lambda data, out, config: [f"{data}/annotations.json"]),
+    EntryPointCase("coco_ids_to_int", "coco_ids_to_int",
+                   lambda data, out, config: [f"{data}/annotations.json", "--mapping_path", f"{out}/mapping.json"]),
+    EntryPointCase("coco_stats", "coco_stats",
+                   lambda data, out, config: [f"{data}/annotations.json", "-o", f"{out}/stats.json"]),
+    EntryPointCase("convert_VOC_to_coco", "convert_VOC_to_coco",
+                   lambda data, out, config: [f"{data}/voc", "--output_path", f"{out}/annotations.json"], ("voc",)),
+    *(EntryPointCase(f"convert_segmentation_type_{seg_format}", "convert_segmentation_type",
+                     lambda data, out, config, seg_format=seg_format: [f"{data}/annotations.json", "-f", seg_format,
+                                                                       "-o", f"{out}/annotations.json"])
+      for seg_format in ("polygon", "rle", "encoded_rle")),
+    EntryPointCase("dedupe_annotations", "dedupe_annotations",
+                   lambda data, out, config: [f"{data}/annotations.json", "-o", f"{out}/annotations.json"]),
+    EntryPointCase("find_near_duplicates", "find_near_duplicates",
+                   lambda data, out, config: [f"{data}/images", f"{data}/annotations.json", "-o",
+                                              f"{out}/near_duplicates.json", "--no_cache"], ("images",)),
+    EntryPointCase("flatten_data_structure", "flatten_data_structure",
+                   lambda data, out, config: [f"{data}/images", "-o", f"{out}/flattened"], ("images",)),
+    EntryPointCase("imgs_to_grayscale", "imgs_to_grayscale", lambda data, out, config: [f"{data}/images"], ("images",)),
+    EntryPointCase("merge_coco", "merge_coco",
+                   lambda data, out, config: [f"{data}/annotations.json", f"{data}/annotations.json", f"{out}/merged",
+                                              "--change_names"], ("images",)),
+    EntryPointCase("reindex_class_indices", "reindex_class_indices",
+                   lambda data, out, config: [f"{data}/annotations.json", "-o", f"{out}/annotations.json"]),
+    EntryPointCase("remove_imgs_without_annotations", "remove_imgs_without_annotations",
+                   lambda data, out, config: [f"{data}/annotations.json", "-o", f"{out}/annotations.json"]),
+    EntryPointCase("resize_coco", "resize_coco",
+                   lambda data, out, config: [f"{data}/images", f"{data}/annotations.json", f"{out}/resized", "128",
+                                              "96"], ("images",)),
+    EntryPointCase("split_train_val_coco", "split_train_val_coco",
+                   lambda data, out, config: [f"{data}/images", f"{data}/annotations.json", f"{out}/split"],
+                   ("images",)),
+    EntryPointCase("subsample_dataset", "subsample_dataset",
+                   lambda data, out, config: [f"{data}/annotations.json", "-i", f"{data}/images", "-o",
+                                              f"{out}/subsampled", "-m", str(config.nb_images // 2)], ("images",)),
+    EntryPointCase("visualize_coco_data", "visualize_coco_data",
+                   lambda data, out, config: [f"{data}/images", f"{data}/annotations.json", "-o", f"{out}/rendered",
+                                              "--show_bbox"], ("images",)),
+)
+
+
+class FunctionBatch(NamedTuple):
+    """The segmentations of a batch of annotations of images with the same size, in all the formats."""
+
+    height: int
+    width: int
+    polygons: list[list[list[float]]]
+    rles: list[npt.NDArray[np.uint32]]
+    encoded_rles: list[str]
+
+
+# Each function benchmark prepares its input from a batch (not timed), then the timed part processes that input.
+FUNCTION_CASES: dict[str, tuple[Callable[[FunctionBatch], Any], Callable[[FunctionBatch, Any], Any]]] = {
+    "polygons_to_rles": (lambda batch: batch.polygons,
+                         lambda batch, polygons: polygons_to_rles(polygons, batch.height, batch.width)),
+    "polygon_to_rle": (lambda batch: batch.polygons,
+                       lambda batch, polygons: [polygon_to_rle(polygon, batch.height, batch.width)
+                                                for polygon in polygons]),
+    "rles_to_polygons": (lambda batch: batch.rles,
+                         lambda batch, rles: rles_to_polygons(rles, batch.height, batch.width)),
+    "rle_to_polygon": (lambda batch: batch.rles,
+                       lambda batch, rles: [rle_to_polygon(rle, batch.height, batch.width) for rle in rles]),
+    "rles_to_encoded_rles": (lambda batch: batch.rles, lambda batch, rles: rles_to_encoded_rles(rles)),
+    "rle_to_encoded_rle": (lambda batch: batch.rles, lambda batch, rles: [rle_to_encoded_rle(rle) for rle in rles]),
+    "encoded_rles_to_rles": (lambda batch: batch.encoded_rles,
+                             lambda batch, encoded_rles: encoded_rles_to_rles(encoded_rles)),
+    "encoded_rle_to_rle": (lambda batch: batch.encoded_rles,
+                           lambda batch, encoded_rles: [encoded_rle_to_rle(encoded_rle)
+                                                        for encoded_rle in encoded_rles]),
+    "rles_to_masks": (lambda batch: batch.rles, lambda batch, rles: rles_to_masks(rles, batch.height, batch.width)),
+    "rle_to_mask": (lambda batch: batch.rles,
+                    lambda batch, rles: [rle_to_mask(rle, batch.height, batch.width) for rle in rles]),
+    "masks_to_rles": (lambda batch: rles_to_masks(batch.rles, batch.height, batch.width),
+                      lambda batch, masks: masks_to_rles(masks)),
+    "mask_to_rle": (lambda batch: rles_to_masks(batch.rles, batch.height, batch.width),
+                    lambda batch, masks: [mask_to_rle(mask) for mask in masks]),
+}
+
+
+def get_scale_config(scale: str, seed: int = 0) -> SyntheticConfig:
+    """Return the config of the synthetic dataset of a scale."""
+    nb_images, nb_annotations = SCALES[scale]
+    return SyntheticConfig(nb_images=nb_images, nb_annotations=nb_annotations, nb_categories=80,
+                           img_sizes=BENCHMARK_IMG_SIZES, segmentation_mix=BENCHMARK_SEGMENTATION_MIX, seed=seed)
+
+
+def generate_dataset(config: SyntheticConfig, output_path: Path, inputs: Sequence[str] = ()) -> None:
+    """Generate a synthetic dataset (annotations.json, and the "images" and "voc" folders if requested)."""
+    output_path.mkdir(parents=True, exist_ok=True)
+    images = get_synthetic_images(config)
+    categories = get_synthetic_categories(config)
+    with CocoJsonWriter(output_path / "annotations.json", compact=True) as writer:
+        writer.write_section("images", images)
+        writer.write_section("annotations", iter_synthetic_annotations(config, images))
+        writer.write_section("categories", categories)
+    if "images" in inputs:
+        write_synthetic_images(images, output_path / "images", seed=config.seed)
+    if "voc" in inputs:
+        annotations = [entry for _, entry in iter_coco_entries(output_path / "annotations.json",
+                                                               sections=("annotations",))]
+        write_voc_annotations(images, annotations, categories, output_path / "voc")
+
+
+def run_command(command: Sequence[str], log_path: Path, cwd: Path = REPO_PATH) -> tuple[float, float, int]:
+    """Run a command, with its output going to a log file.
+
+    The command is started by a minimal python process, which measures it: on Linux the peak memory usage of a
+    process includes the one of the process it was started from, which would otherwise be the benchmark process.
+
+    Args:
+        command: The command to run.
+        log_path: File where the standard output and error of the command are saved.
+        cwd: Working directory of the command.
+
+    Returns:
+        The wall time (in seconds), the peak memory usage (maximum resident set size in MB, of the biggest process
+        among the command and the sub-processes it waited for) and the exit code of the command.
+    """
+    measure_path = log_path.with_name(log_path.name + ".measure")
+    with open(log_path, "wb") as log_file:
+        subprocess.run([sys.executable, "-S", "-c", _MEASURE_SCRIPT, str(measure_path), *command], cwd=cwd,
+                       stdout=log_file, stderr=subprocess.STDOUT, check=False)
+    wall_time, max_rss, exit_code = measure_path.read_text(encoding="utf-8").split()
+    measure_path.unlink()
+    return float(wall_time), int(max_rss) / 1024, int(exit_code)
+
+
+def run_entry_point_case(case: EntryPointCase,
+                         config: SyntheticConfig,
+                         dataset_path: Path,
+                         case_path: Path) -> dict[str, Any]:
+    """Run a script on a copy of a dataset.
+
+    Args:
+        case: The script to run.
+        config: The config of the dataset.
+        dataset_path: The folder with the dataset (see `generate_dataset`).
+        case_path: Folder in which the inputs are copied (as some scripts modify them or leave caches next to them)
+                   and the outputs and log are saved. It is emptied beforehand.
+
+    Returns:
+        The wall time, peak memory usage and exit code of the script.
+    """
+    shutil.rmtree(case_path, ignore_errors=True)
+    (output_path := case_path / "output").mkdir(parents=True)
+    (data_path := case_path / "dataset").mkdir()
+    shutil.copyfile(dataset_path / "annotations.json", data_path / "annotations.json")
+    for folder in case.inputs:
+        shutil.copytree(dataset_path / folder, data_path / folder)
+    command = [sys.executable, "-m", f"src.{case.module}", *case.get_args(data_path, output_path, config)]
+    wall_time, max_rss, exit_code = run_command(command, case_path / "log.txt")
+    return {"wall_time": wall_time, "max_rss_mb": max_rss, "exit_code": exit_code}
+
+
+def load_function_batches(json_path: Path, batch_size: int = FUNCTION_BATCH_SIZE) -> list[FunctionBatch]:
+    """Load the polygon annotations of a dataset, grouped by image size, and convert them to the other formats."""
+    img_sizes: dict[int, tuple[int, int]] = {}
+    polygons_per_size: dict[tuple[int, int], list[list[list[float]]]] = {}
+    for section, entry in iter_coco_entries(json_path, sections=("images", "annotations")):
+        if section == "images":
+            img_sizes[entry["id"]] = entry["height"], entry["width"]
+        elif isinstance(entry["segmentation"], list) and entry["segmentation"]:
+            polygons_per_size.setdefault(img_sizes[entry["image_id"]], []).append(entry["segmentation"])
+
+    batches: list[FunctionBatch] = []
+    for (height, width), polygons in sorted(polygons_per_size.items()):
+        for batch_start in range(0, len(polygons), batch_size):
+            batch_polygons = polygons[batch_start:batch_start+batch_size]
+            rles = polygons_to_rles(batch_polygons, height, width)
+            batches.append(FunctionBatch(height, width, batch_polygons, rles, rles_to_encoded_rles(rles)))
+    return batches
+
+
+def run_function_benchmark(function_name: str, json_path: Path) -> dict[str, float]:
+    """Time a segmentation conversion function on all the polygon annotations of a dataset (in batches).
+
+    Returns:
+        The time spent in the function (in seconds) and the peak memory usage (in MB) before running it.
+    """
+    prepare, run = FUNCTION_CASES[function_name]
+    batches = load_function_batches(json_path)
+    setup_max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    wall_time = 0.
+    for batch in batches:
+        function_input = prepare(batch)
+        start_time = time.perf_counter()
+        run(batch, function_input)
+        wall_time += time.perf_counter() - start_time
+    return {"wall_time": wall_time, "setup_max_rss_mb": setup_max_rss}
+
+
+def get_git_info(repo_path: Path = REPO_PATH) -> tuple[Optional[str], bool]:
+    """Return the current commit (None outside of a git repository) and whether tracked files were modified."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_path, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_path,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, status.strip() != ""
+
+
+def load_history(history_path: Path) -> list[dict[str, Any]]:
+    """Load the previous benchmark runs (an empty list if there are none yet)."""
+    try:
+        with open(history_path, encoding="utf-8") as history_file:
+            return json.load(history_file)
+    except FileNotFoundError:
+        return []
+
+
+def append_to_history(history_path: Path, run: dict[str, Any]) -> None:
+    """Add a benchmark run at the end of the history file (the file is replaced atomically)."""
+    history = load_history(history_path)
+    history.append(run)
+    tmp_path = history_path.with_name(f".{history_path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as history_file:
+        json.dump(history, history_file, indent=2)
+    os.replace(tmp_path, history_path)
+
+
+def get_previous_results(history: Sequence[dict[str, Any]]) -> dict[tuple[str, str], dict[str, Any]]:
+    """Return the latest successful result of each (benchmark, scale) pair in the history, with its commit."""
+    previous_results: dict[tuple[str, str], dict[str, Any]] = {}
+    for run in history:
+        for result in run["results"]:
+            if result["exit_code"] == 0:
+                previous_results[result["benchmark"], result["scale"]] = {**result, "commit": run["commit"]}
+    return previous_results
+
+
+def format_results(results: Sequence[dict[str, Any]],
+                   previous_results: dict[tuple[str, str], dict[str, Any]]) -> str:
+    """Format the results as a table, with the relative change compared to the previous results."""
+    def change(value: float, previous_value: Optional[float]) -> str:
+        return f"{100 * (value / previous_value - 1):+.1f}%" if previous_value else ""
+
+    lines = [f"{'benchmark':<40} {'scale':<7} {'time (s)':>10} {'change':>8} {'peak RSS (MB)':>14} {'change':>8}"]
+    for result in results:
+        previous = previous_results.get((result["benchmark"], result["scale"]), {})
+        if result["exit_code"] != 0:
+            lines.append(f"{result['benchmark']:<40} {result['scale']:<7} failed with exit code {result['exit_code']}")
+            continue
+        lines.append(f"{result['benchmark']:<40} {result['scale']:<7} {result['wall_time']:>10.3f} "
+                     f"{change(result['wall_time'], previous.get('wall_time')):>8} {result['max_rss_mb']:>14.1f} "
+                     f"{change(result['max_rss_mb'], previous.get('max_rss_mb')):>8}")
+    return "\n".join(lines)
+
+
+def main():
+    benchmark_names = [case.name for case in ENTRY_POINT_CASES] + list(FUNCTION_CASES)
+    parser = argparse.ArgumentParser(description=("Benchmarks the scripts and the segmentation conversion functions on "
+                                                  "synthetic datasets of several sizes, and saves the wall times and "
+                                                  "peak memory usages in a history file."),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"],
+                        help=f"Sizes of the datasets (number of images, annotations): {SCALES}.")
+    parser.add_argument("--benchmarks", nargs="+", choices=benchmark_names, default=benchmark_names, metavar="NAME",
+                        help=f"Benchmarks to run, among: {', '.join(benchmark_names)}.")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of runs of each benchmark, the fastest time and highest memory usage are kept.")
+    parser.add_argument("--history_path", "--history-path", type=Path, default=Path("benchmark_history.json"),
+                        help="Json file to which the results are appended.")
+    parser.add_argument("--no_history", "--no-history", action="store_true", help="Do not save the results.")
+    parser.add_argument("--work_dir", "--work-dir", type=Path, default=None,
+                        help="Folder for the datasets and outputs (kept afterwards), defaults to a temporary folder.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic datasets.")
+    parser.add_argument("--run_function", nargs=2, default=None, help=argparse.SUPPRESS)  # Used by the child processes.
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    start_profiling(args)
+
+    if args.run_function is not None:
+        print(json.dumps(run_function_benchmark(args.run_function[0], Path(args.run_function[1]))))
+        return
+
+    scales: list[str] = args.scales
+    selected: set[str] = set(args.benchmarks)
+    nb_repeats: int = max(1, args.repeat)
+    history_path: Optional[Path] = None if args.no_history else args.history_path
+    work_dir: Path = args.work_dir if args.work_dir else Path(tempfile.mkdtemp(prefix="coco_utils_benchmark_"))
+    seed: int = args.seed
+
+    entry_point_cases = [case for case in ENTRY_POINT_CASES if case.name in selected]
+    function_names = [name for name in FUNCTION_CASES if name in selected]
+    inputs = sorted({folder for case in entry_point_cases for folder in case.inputs})
+    commit, dirty = get_git_info()
+    results: list[dict[str, Any]] = []
+
+    def add_result(name: str, scale: str, runs: Sequence[dict[str, Any]]) -> None:
+        result = {"benchmark": name, "scale": scale,
+                  "wall_time": min(run["wall_time"] for run in runs),
+                  "max_rss_mb": max(run["max_rss_mb"] for run in runs),
+                  "exit_code": next((run["exit_code"] for run in runs if run["exit_code"] != 0), 0)}
+        if "setup_max_rss_mb" in runs[0]:
+            result["setup_max_rss_mb"] = max(run["setup_max_rss_mb"] for run in runs)
+        results.append(result)
+
+    try:
+        for scale in scales:
+            config = get_scale_config(scale, seed)
+            dataset_path = work_dir / scale / "dataset"
+            clean_print(f"Generating the {scale} dataset ({config.nb_images} images, {config.nb_annotations} "
+                        "annotations)", end="\r")
+            generate_dataset(config, dataset_path, inputs)
+
+            for case in entry_point_cases:
+                runs: list[dict[str, Any]] = []
+                for i in range(nb_repeats):
+                    clean_print(f"[{scale}] {case.name} ({i+1}/{nb_repeats})", end="\r")
+                    case_path = work_dir / scale / case.name
+                    runs.append(run_entry_point_case(case, config, dataset_path, case_path))
+                    if runs[-1]["exit_code"] != 0:
+                        clean_print(f"{case.name} failed on the {scale} dataset, see {case_path / 'log.txt'}")
+                        break
+                    if args.work_dir is None:
+                        shutil.rmtree(case_path)
+                add_result(case.name, scale, runs)
+
+            for function_name in function_names:
+                runs = []
+                for i in range(nb_repeats):
+                    clean_print(f"[{scale}] {function_name} ({i+1}/{nb_repeats})", end="\r")
+                    log_path = work_dir / scale / f"{function_name}.log"
+                    command = [sys.executable, "-m", "src.benchmark", "--run_function", function_name,
+                               str(dataset_path / "annotations.json")]
+                    _, max_rss, exit_code = run_command(command, log_path)
+                    run = {"wall_time": 0., "max_rss_mb": max_rss, "exit_code": exit_code}
+                    if exit_code != 0:
+                        clean_print(f"{function_name} failed on the {scale} dataset, see {log_path}")
+                        runs.append(run)
+                        break
+                    runs.append({**run, **json.loads(log_path.read_text(encoding="utf-8").splitlines()[-1])})
+                add_result(function_name, scale, runs)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    previous_results = get_previous_results(load_history(history_path)) if history_path is not None else {}
+    clean_print(format_results(results, previous_results))
+    if history_path is not None:
+        append_to_history(history_path, {
+            "commit": commit,
+            "dirty": dirty,
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "nb_cpus": os.cpu_count(),
+            "seed": seed,
+            "scales": {scale: SCALES[scale] for scale in scales},
+            "results": results,
+        })
+        print(f"Appended the results to {history_path}")
+
+
+if __name__ == "__main__":
+    main()
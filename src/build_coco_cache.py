@@ -0,0 +1,36 @@
+"""Script to build the columnar cache of COCO annotations files.
+
+The cache is otherwise built automatically the first time it is needed, this allows doing it ahead of time.
+Run with: python -m src.build_coco_cache <path to json file> [<path to json file> ...]
+"""
+import argparse
+from pathlib import Path
+
+from src.utils.coco_cache import build_coco_cache, is_cache_valid
+from src.utils.profiling import add_profiling_args, stage, start_profiling
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the columnar cache (.npy sidecar) of COCO annotations files.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("json_paths", nargs="+", type=Path, help="Paths to COCO annotations files.")
+    parser.add_argument("--force", "-f", action="store_true", help="Rebuild the caches even if they are up to date.")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    json_paths: list[Path] = args.json_paths
+    force: bool = args.force
+
+    start_profiling(args)
+    for json_path in json_paths:
+        if not force and is_cache_valid(json_path):
+            print(f"The cache of {json_path} is already up to date.")
+            continue
+        print(f"Building the cache of {json_path}")
+        with stage("build_cache"):
+            cache_path = build_coco_cache(json_path)
+        print(f"Saved the cache to {cache_path}")
+
+
+if __name__ == "__main__":
+    main()
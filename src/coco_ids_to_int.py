@@ -1,66 +1,169 @@
 import argparse
 import json
 import shutil
+from collections.abc import Hashable, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Literal, NamedTuple, Optional
 
 from src.types.coco_types import Annotation, Image
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import save_coco_json
+from src.utils.manifest import file_hash
+from src.utils.misc import clean_print
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
 
+TMergeMode = Literal["none", "file_name", "hash"]
+MERGE_MODES = ("none", "file_name", "hash")
 
-def is_duplicate(list_to_check: list[Image] | list[Annotation], key: str, elt_id: str) -> bool:
-    """Checks if the given id is already in the list."""
-    for entry in list_to_check:
-        if entry[key] == elt_id:
-            return True
-    return False
+
+class NormalizedDataset(NamedTuple):
+    """Entries with new int ids, and the mappings from the old ids to the new ones."""
+
+    images: list[Image]
+    annotations: list[Annotation]
+    image_id_map: dict[Any, int]
+    annotation_id_map: dict[Any, int]
+    nb_orphan_annotations: int
+
+
+def hash_images(images: Sequence[Image], images_path: Path, nb_threads: int = 8) -> list[Optional[str]]:
+    """Return the hash of the content of each image file (None for the missing files).
+
+    The hashing is done by a pool of threads (hashlib releases the GIL while hashing).
+
+    Args:
+        images: The image entries.
+        images_path: Path to the directory with the images.
+        nb_threads: Number of threads reading and hashing the files.
+
+    Returns:
+        The hash of each image.
+    """
+    def hash_image(image: Image) -> Optional[str]:
+        try:
+            return file_hash(images_path / image["file_name"])
+        except FileNotFoundError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, nb_threads)) as executor:
+        return list(executor.map(hash_image, images))
+
+
+def normalize_ids(images: Sequence[Image],
+                  annotations: Sequence[Annotation],
+                  image_keys: Optional[Sequence[Optional[Hashable]]] = None) -> NormalizedDataset:
+    """Remove the entries with duplicate ids, and give consecutive int ids to the remaining ones, in a single pass.
+
+    Args:
+        images: The image entries.
+        annotations: The annotation entries.
+        image_keys: If given, the images with the same (not None) key are considered as the same image: only the first
+                    one is kept and the annotations of the other ones are moved to it.
+
+    Returns:
+        The kept entries (modified in place) and the mappings from the old ids to the new ones. An image merged into
+        another one is mapped to the id of that other one. The annotations of unknown images are dropped.
+    """
+    new_images: list[Image] = []
+    image_id_map: dict[Any, int] = {}
+    id_by_key: dict[Hashable, int] = {}
+    for i, image in enumerate(images):
+        if image["id"] in image_id_map:
+            continue
+        key = image_keys[i] if image_keys is not None else None
+        if key is not None and key in id_by_key:
+            image_id_map[image["id"]] = id_by_key[key]
+            continue
+        image_id_map[image["id"]] = len(new_images)
+        if key is not None:
+            id_by_key[key] = len(new_images)
+        image["id"] = len(new_images)
+        new_images.append(image)
+
+    new_annotations: list[Annotation] = []
+    annotation_id_map: dict[Any, int] = {}
+    nb_orphan_annotations = 0
+    for annotation in annotations:
+        if annotation["id"] in annotation_id_map:
+            continue
+        if (image_id := image_id_map.get(annotation["image_id"])) is None:
+            nb_orphan_annotations += 1
+            continue
+        annotation_id_map[annotation["id"]] = len(new_annotations)
+        annotation["id"], annotation["image_id"] = len(new_annotations), image_id
+        new_annotations.append(annotation)
+
+    return NormalizedDataset(new_images, new_annotations, image_id_map, annotation_id_map, nb_orphan_annotations)
 
 
 def main():
     parser = argparse.ArgumentParser(description=("Changes image ids in a coco dataset from strings to ints."
-                                                  "Also removes duplicate entries."))
+                                                  "Also removes duplicate entries."),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("annotations", type=Path, help="Path to COCO annotations file.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    parser.add_argument("--merge_images", "--merge-images", choices=MERGE_MODES, default="none",
+                        help="Consider the images with the same file_name, or the same file content, as a single "
+                             "image and merge their annotations (identical annotations are kept, see "
+                             "dedupe_annotations to remove them).")
+    parser.add_argument("--images_path", "--images-path", type=Path, default=None,
+                        help="Path to the directory with the images, needed to merge the images by content.")
+    parser.add_argument("--mapping_path", "--mapping-path", type=Path, default=None,
+                        help="Where to save the old id -> new id mappings, defaults to id_mapping.json next to the "
+                             "annotations.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
+    annotations_path: Path = args.annotations
+    compact: bool = args.compact
+    merge_mode: TMergeMode = args.merge_images
+    images_path: Optional[Path] = args.images_path
+    mapping_path: Path = args.mapping_path if args.mapping_path else annotations_path.parent / "id_mapping.json"
+
+    start_profiling(args)
+    if merge_mode == "hash" and images_path is None:
+        parser.error("--images_path is required to merge the images by content.")
+
     # Load the dataset
-    with open(args.annotations, encoding="utf-8") as annotations:
-        coco_dataset = json.load(annotations)
-    images = coco_dataset["images"]
-    annotations = coco_dataset["annotations"]
-    categories = coco_dataset["categories"]
+    dataset = CocoDataset.from_json(annotations_path)
 
-    # Could try to play around with sets and pops, but there's no time
-    no_duplicate_annotations: list[Annotation] = []
-    no_duplicate_images: list[Image] = []
+    image_keys: Optional[list[Optional[Hashable]]] = None
+    if merge_mode == "file_name":
+        image_keys = [image["file_name"] for image in dataset.images]
+    elif merge_mode == "hash":
+        assert images_path is not None
+        with stage("image_io"):
+            image_keys = hash_images(dataset.images, images_path)  # type: ignore
+        count("images_hashed", len(image_keys))
+        if nb_missing := sum(key is None for key in image_keys):
+            print(f"Warning: {nb_missing} image files were not found, they will not be merged.")
 
-    # Remove duplicates
-    for annotation in annotations:
-        if not is_duplicate(no_duplicate_annotations, "id", annotation["id"]):
-            no_duplicate_annotations.append(annotation)
-    for image in images:
-        if not is_duplicate(no_duplicate_images, "id", image["id"]):
-            no_duplicate_images.append(image)
-
-    # Change image ids to ints and create a conversion table that does old_id -> new_id
-    image_id_conversion_table = {}
-    for i, img_entry in enumerate(no_duplicate_images):
-        image_id_conversion_table[img_entry["id"]] = i
-        img_entry["id"] = i
-
-    for i, annotation_entry in enumerate(no_duplicate_annotations):
-        annotation_entry["id"] = i
-        annotation_entry["image_id"] = image_id_conversion_table[annotation_entry["image_id"]]
+    with stage("transform"):
+        normalized = normalize_ids(dataset.images, dataset.annotations, image_keys)
+    count("annotations_processed", len(dataset.annotations))
+    print(f"Kept {len(normalized.images)}/{len(dataset.images)} images and "
+          f"{len(normalized.annotations)}/{len(dataset.annotations)} annotations.")
+    if normalized.nb_orphan_annotations:
+        print(f"Warning: dropped {normalized.nb_orphan_annotations} annotations whose image does not exist.")
 
     # Save the corrected annotations
     corrected_dataset = {
-        "images": no_duplicate_images,
-        "annotations": no_duplicate_annotations,
-        "categories": categories
+        "images": normalized.images,
+        "annotations": normalized.annotations,
+        "categories": dataset.categories
     }
-    shutil.move(args.annotations, args.annotations.parent / "original_ids_annotations.json")
-    with open(args.annotations.parent / "annotations.json", "w", encoding="utf-8") as json_file:
-        json.dump(corrected_dataset, json_file, indent=4)
+    shutil.move(annotations_path, annotations_path.parent / "original_ids_annotations.json")
+    save_coco_json(annotations_path.parent / "annotations.json", corrected_dataset, compact=compact)
+
+    # Lists of [old id, new id] pairs, since json would turn int keys into strings.
+    with stage("write_json"), open(mapping_path, "w", encoding="utf-8") as mapping_file:
+        json.dump({"images": list(normalized.image_id_map.items()),
+                   "annotations": list(normalized.annotation_id_map.items())}, mapping_file)
+    print(f"Saved the id mappings to {mapping_path}")
 
-    msg = "Finished processing dataset."
-    print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)))
+    clean_print("Finished processing dataset.")
 
 
 if __name__ == "__main__":
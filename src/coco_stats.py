@@ -0,0 +1,292 @@
+"""Script to compute statistics on a COCO dataset (instances per category, box sizes, image resolutions, etc).
+
+The file is read in a single streaming pass. The values needed from each entry are buffered, and the histograms are
+updated with numpy every `CHUNK_SIZE` entries, so the memory usage only grows with the number of images and categories.
+
+Run with: python -m src.coco_stats <path to json file> -o stats.json
+"""
+import argparse
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from src.types.coco_types import Annotation, Category, Image
+from src.utils.coco_json import iter_coco_entries
+from src.utils.misc import clean_print
+from src.utils.profiling import add_profiling_args, stage, start_profiling
+
+# Number of entries buffered before updating the statistics.
+CHUNK_SIZE = 2**16
+SEGMENTATION_FORMATS = ("polygon", "rle", "encoded_rle", "none")
+# Histogram bins, the last bin of each histogram also holds the values above its upper edge.
+BBOX_SIZE_BINS = np.asarray([0, 8, 16, 32, 64, 96, 128, 256, 512, 1024])  # sqrt(width * height)
+ASPECT_RATIO_BINS = np.asarray([0, 1/8, 1/4, 1/3, 1/2, 2/3, 1, 3/2, 2, 3, 4, 8])  # width / height
+INSTANCES_PER_IMAGE_BINS = np.asarray([0, 1, 2, 3, 6, 11, 21, 51, 101])
+MEGAPIXELS_BINS = np.asarray([0, 0.1, 0.3, 0.5, 1, 2, 4, 8, 16])
+# Area ranges used by the COCO evaluation.
+COCO_AREA_RANGES = {"small": (0, 32**2), "medium": (32**2, 96**2), "large": (96**2, np.inf)}
+NB_TOP_RESOLUTIONS = 10
+
+
+def _histogram(values: npt.NDArray[Any], bins: npt.NDArray[Any]) -> npt.NDArray[np.int64]:
+    """Count the values in each bin ([bins[i], bins[i+1]), the last bin is open ended, values below bins[0] ignored)."""
+    bin_idx = np.searchsorted(bins, values, side="right") - 1
+    return np.bincount(bin_idx[bin_idx >= 0], minlength=len(bins))
+
+
+def _add_counts(counts: npt.NDArray[Any], new_counts: npt.NDArray[Any]) -> npt.NDArray[Any]:
+    """Add counts indexed by (image or category) index, growing the array if needed."""
+    if len(new_counts) > len(counts):
+        counts = np.concatenate((counts, np.zeros(len(new_counts) - len(counts), dtype=counts.dtype)))
+    counts[:len(new_counts)] += new_counts
+    return counts
+
+
+def _bin_labels(bins: npt.NDArray[Any]) -> list[str]:
+    """Return a label for each bin of a histogram."""
+    labels = [f"[{low:.3g}, {high:.3g})" for low, high in zip(bins[:-1], bins[1:])]
+    return [*labels, f">= {bins[-1]:.3g}"]
+
+
+class CocoStats:
+    """Accumulates the statistics of a COCO dataset, one entry at a time."""
+
+    def __init__(self):
+        # Hash indexes mapping the image / category ids to a contiguous index.
+        self.img_index: dict[Any, int] = {}
+        self.cat_index: dict[Any, int] = {}
+        self.cat_names: dict[Any, str] = {}
+        self._annotation_rows: list[tuple[int, int, float, float, float, int, int]] = []
+        self._image_rows: list[tuple[int, int, int]] = []
+
+        self.nb_annotations = 0
+        self.nb_images = 0
+        self.anns_per_image = np.zeros(0, dtype=np.int64)
+        self.has_image_entry = np.zeros(0, dtype=np.int64)
+        self.anns_per_category = np.zeros(0, dtype=np.int64)
+        self.crowd_per_category = np.zeros(0, dtype=np.int64)
+        self.area_per_category = np.zeros(0, dtype=np.float64)
+        self.segmentation_formats = np.zeros(len(SEGMENTATION_FORMATS), dtype=np.int64)
+        self.nb_crowd = 0
+        self.nb_degenerate_bboxes = 0
+        self.bbox_sizes = np.zeros(len(BBOX_SIZE_BINS), dtype=np.int64)
+        self.aspect_ratios = np.zeros(len(ASPECT_RATIO_BINS), dtype=np.int64)
+        self.area_ranges = np.zeros(len(COCO_AREA_RANGES), dtype=np.int64)
+        self.bbox_width_sum = self.bbox_height_sum = 0.
+        self.megapixels = np.zeros(len(MEGAPIXELS_BINS), dtype=np.int64)
+        self.resolutions: Counter[tuple[int, int]] = Counter()
+
+    def add_annotation(self, annotation: Annotation) -> None:
+        """Add an annotation to the statistics."""
+        segmentation = annotation.get("segmentation")
+        if isinstance(segmentation, list):
+            seg_format = 0 if segmentation else 3
+        elif isinstance(segmentation, dict):
+            seg_format = 1 if isinstance(segmentation.get("counts"), list) else 2
+        else:
+            seg_format = 3
+        _, _, width, height = annotation.get("bbox", (0, 0, 0, 0))
+        self._annotation_rows.append((self.img_index.setdefault(annotation["image_id"], len(self.img_index)),
+                                      self.cat_index.setdefault(annotation["category_id"], len(self.cat_index)),
+                                      width, height, annotation.get("area", 0), annotation.get("iscrowd", 0),
+                                      seg_format))
+        if len(self._annotation_rows) == CHUNK_SIZE:
+            self._flush_annotations()
+
+    def add_image(self, image: Image) -> None:
+        """Add an image to the statistics."""
+        self._image_rows.append((self.img_index.setdefault(image["id"], len(self.img_index)),
+                                 image["width"], image["height"]))
+        if len(self._image_rows) == CHUNK_SIZE:
+            self._flush_images()
+
+    def add_category(self, category: Category) -> None:
+        """Add a category to the statistics."""
+        self.cat_index.setdefault(category["id"], len(self.cat_index))
+        self.cat_names[category["id"]] = category["name"]
+
+    def _flush_annotations(self) -> None:
+        """Update the statistics with the buffered annotations."""
+        if not self._annotation_rows:
+            return
+        img_idx, cat_idx, widths, heights, areas, iscrowd, seg_formats = (
+            np.asarray(column) for column in zip(*self._annotation_rows))
+        self._annotation_rows = []
+        iscrowd = iscrowd.astype(np.bool_)
+        self.nb_annotations += len(img_idx)
+        self.nb_crowd += int(iscrowd.sum())
+        self.anns_per_image = _add_counts(self.anns_per_image, np.bincount(img_idx))
+        self.anns_per_category = _add_counts(self.anns_per_category, np.bincount(cat_idx))
+        self.crowd_per_category = _add_counts(self.crowd_per_category, np.bincount(cat_idx[iscrowd]))
+        self.area_per_category = _add_counts(self.area_per_category, np.bincount(cat_idx, weights=areas))
+        self.segmentation_formats += np.bincount(seg_formats, minlength=len(SEGMENTATION_FORMATS))
+
+        is_valid = (widths > 0) & (heights > 0)
+        self.nb_degenerate_bboxes += int((~is_valid).sum())
+        widths, heights = widths[is_valid].astype(np.float64), heights[is_valid].astype(np.float64)
+        self.bbox_width_sum += float(widths.sum())
+        self.bbox_height_sum += float(heights.sum())
+        self.bbox_sizes += _histogram(np.sqrt(widths * heights), BBOX_SIZE_BINS)
+        self.aspect_ratios += _histogram(widths / heights, ASPECT_RATIO_BINS)
+        self.area_ranges += _histogram(areas, np.asarray([low for low, _ in COCO_AREA_RANGES.values()]))
+
+    def _flush_images(self) -> None:
+        """Update the statistics with the buffered images."""
+        if not self._image_rows:
+            return
+        img_idx, widths, heights = (np.asarray(column, dtype=np.int64) for column in zip(*self._image_rows))
+        self._image_rows = []
+        self.nb_images += len(img_idx)
+        self.has_image_entry = _add_counts(self.has_image_entry, np.bincount(img_idx))
+        self.megapixels += _histogram(widths * heights / 1e6, MEGAPIXELS_BINS)
+        resolutions, counts = np.unique(np.stack((widths, heights), axis=1), axis=0, return_counts=True)
+        self.resolutions.update(dict(zip(map(tuple, resolutions.tolist()), counts.tolist())))
+
+    def summary(self) -> dict[str, Any]:
+        """Return the statistics of the dataset (as a json serializable dict)."""
+        self._flush_annotations()
+        self._flush_images()
+        nb_indexed_images = len(self.img_index)
+        anns_per_image = _add_counts(np.zeros(nb_indexed_images, dtype=np.int64), self.anns_per_image)
+        has_image_entry = _add_counts(np.zeros(nb_indexed_images, dtype=np.int64), self.has_image_entry) > 0
+        nb_categories = len(self.cat_index)
+        anns_per_category = _add_counts(np.zeros(nb_categories, dtype=np.int64), self.anns_per_category)
+        crowd_per_category = _add_counts(np.zeros(nb_categories, dtype=np.int64), self.crowd_per_category)
+        area_per_category = _add_counts(np.zeros(nb_categories, dtype=np.float64), self.area_per_category)
+        nb_valid_bboxes = max(self.nb_annotations - self.nb_degenerate_bboxes, 1)
+
+        return {
+            "nb_images": self.nb_images,
+            "nb_annotations": self.nb_annotations,
+            "nb_categories": len(self.cat_names),
+            "nb_images_without_annotations": int((has_image_entry & (anns_per_image == 0)).sum()),
+            "nb_annotations_without_image": int(anns_per_image[~has_image_entry].sum()),
+            "iscrowd_ratio": self.nb_crowd / max(self.nb_annotations, 1),
+            "segmentation_formats": dict(zip(SEGMENTATION_FORMATS, self.segmentation_formats.tolist())),
+            "categories": [{"id": cat_id,
+                            "name": self.cat_names.get(cat_id),
+                            "nb_instances": int(anns_per_category[idx]),
+                            "nb_crowd": int(crowd_per_category[idx]),
+                            "mean_area": float(area_per_category[idx] / max(anns_per_category[idx], 1))}
+                           for cat_id, idx in self.cat_index.items()],
+            "instances_per_image": {
+                "mean": float(anns_per_image[has_image_entry].mean()) if has_image_entry.any() else 0.,
+                "max": int(anns_per_image.max(initial=0)),
+                "histogram": dict(zip(_bin_labels(INSTANCES_PER_IMAGE_BINS),
+                                      _histogram(anns_per_image[has_image_entry], INSTANCES_PER_IMAGE_BINS).tolist())),
+            },
+            "bboxes": {
+                "mean_width": self.bbox_width_sum / nb_valid_bboxes,
+                "mean_height": self.bbox_height_sum / nb_valid_bboxes,
+                "nb_degenerate": self.nb_degenerate_bboxes,
+                "size_histogram": dict(zip(_bin_labels(BBOX_SIZE_BINS), self.bbox_sizes.tolist())),
+                "aspect_ratio_histogram": dict(zip(_bin_labels(ASPECT_RATIO_BINS), self.aspect_ratios.tolist())),
+            },
+            "coco_area_ranges": dict(zip(COCO_AREA_RANGES, self.area_ranges.tolist())),
+            "image_resolutions": {
+                "most_common": [{"width": width, "height": height, "nb_images": count}
+                                for (width, height), count in self.resolutions.most_common(NB_TOP_RESOLUTIONS)],
+                "megapixels_histogram": dict(zip(_bin_labels(MEGAPIXELS_BINS), self.megapixels.tolist())),
+            },
+        }
+
+
+def compute_stats(json_path: Path) -> dict[str, Any]:
+    """Compute the statistics of a COCO annotations file, in a single streaming pass.
+
+    Args:
+        json_path: Path to the json file with the coco annotations.
+
+    Returns:
+        The statistics (see `CocoStats.summary`).
+    """
+    stats = CocoStats()
+    add_entry = {"images": stats.add_image, "annotations": stats.add_annotation, "categories": stats.add_category}
+    for i, (section, entry) in enumerate(iter_coco_entries(json_path), start=1):
+        add_entry[section](entry)
+        if i % 100_000 == 0:
+            clean_print(f"Processed {i} entries", end="\r")
+    return stats.summary()
+
+
+def format_stats(stats: dict[str, Any]) -> str:
+    """Format the statistics as a plain text summary."""
+    def format_histogram(histogram: dict[str, int]) -> list[str]:
+        total = max(sum(histogram.values()), 1)
+        return [f"    {label:>16}: {count:>10} ({100 * count / total:5.1f}%)" for label, count in histogram.items()]
+
+    lines = [f"Images: {stats['nb_images']}",
+             f"Annotations: {stats['nb_annotations']}",
+             f"Categories: {stats['nb_categories']}",
+             f"Images without annotations: {stats['nb_images_without_annotations']}",
+             f"Annotations without image: {stats['nb_annotations_without_image']}",
+             f"Crowd annotations: {100 * stats['iscrowd_ratio']:.2f}%",
+             "Segmentation formats: " + ", ".join(f"{seg_format}: {count}"
+                                                  for seg_format, count in stats["segmentation_formats"].items()),
+             "",
+             "Instances per category:"]
+    name_width = max((len(str(category["name"])) for category in stats["categories"]), default=0)
+    for category in sorted(stats["categories"], key=lambda category: -category["nb_instances"]):
+        lines.append(f"    {category['id']:>5} {str(category['name']):<{name_width}}: {category['nb_instances']:>10} "
+                     f"(crowd: {category['nb_crowd']}, mean area: {category['mean_area']:.1f})")
+    instances_per_image = stats["instances_per_image"]
+    lines += ["",
+              f"Instances per image (mean: {instances_per_image['mean']:.2f}, max: {instances_per_image['max']}):",
+              *format_histogram(instances_per_image["histogram"]),
+              "",
+              f"Box sizes, sqrt(width * height) (mean width: {stats['bboxes']['mean_width']:.1f}, mean height: "
+              f"{stats['bboxes']['mean_height']:.1f}, degenerate boxes: {stats['bboxes']['nb_degenerate']}):",
+              *format_histogram(stats["bboxes"]["size_histogram"]),
+              "",
+              "Box aspect ratios (width / height):",
+              *format_histogram(stats["bboxes"]["aspect_ratio_histogram"]),
+              "",
+              "COCO area ranges:",
+              *format_histogram(stats["coco_area_ranges"]),
+              "",
+              "Image resolutions (megapixels):",
+              *format_histogram(stats["image_resolutions"]["megapixels_histogram"]),
+              "Most common resolutions: " + ", ".join(f"{resolution['width']}x{resolution['height']} "
+                                                      f"({resolution['nb_images']})"
+                                                      for resolution in stats["image_resolutions"]["most_common"])]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=("Compute statistics on a COCO dataset (instances per category, box "
+                                                  "sizes and aspect ratios, instances per image, image resolutions, "
+                                                  "etc). The file is streamed, so it does not need to fit in memory."),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("json_path", type=Path, help="Path to COCO annotations file.")
+    parser.add_argument("--output_path", "-o", type=Path, default=None,
+                        help="If given, save the statistics to this json file.")
+    parser.add_argument("--text_output_path", "-t", type=Path, default=None,
+                        help="If given, also save the plain text summary to this file.")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    json_path: Path = args.json_path
+    output_path: Optional[Path] = args.output_path
+    text_output_path: Optional[Path] = args.text_output_path
+
+    start_profiling(args)
+    with stage("transform"):
+        stats = compute_stats(json_path)
+    summary = format_stats(stats)
+    clean_print(summary)
+
+    if output_path is not None:
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            json.dump(stats, output_file, indent=2)
+        print(f"Saved the statistics to '{output_path}'")
+    if text_output_path is not None:
+        text_output_path.write_text(summary + "\n", encoding="utf-8")
+        print(f"Saved the summary to '{text_output_path}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,28 @@
 # pyright: reportOptionalMemberAccess=false
 # pyright: reportGeneralTypeIssues=false
 import argparse
-import json
-import shutil
 import xml.etree.ElementTree as ET  # noqa: N817
+from collections.abc import Iterator, Sequence
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Union
+from typing import Literal, NamedTuple, Union
+
+import numpy as np
+import numpy.typing as npt
 
 from src.types.coco_types import Annotation, Category, Image
+from src.utils.coco_json import CocoJsonWriter
+from src.utils.misc import clean_print, get_nb_processes
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+
+TDifficultMode = Literal["skip", "crowd", "attribute"]
+DIFFICULT_MODES = ("skip", "crowd", "attribute")
+# Number of xml files parsed by a worker in one task.
+CHUNK_SIZE = 1000
 
 
 def parse_voc2007_annotation(xml_path: Union[str, Path]
-                             ) -> tuple[str, int, int, list[tuple[str, tuple[int, int, int, int]]]]:
+                             ) -> tuple[str, int, int, list[tuple[str, tuple[float, float, float, float], bool]]]:
     """Takes a path to an xml file and parses it to return the relevant information.
 
     Args:
@@ -19,50 +30,131 @@ def parse_voc2007_annotation(xml_path: Union[str, Path]
 
     Returns:
         Filename of the image, width and height of the image, list of the objects in the image.
-        Each object consists of a string (the class) and a list of 4 ints (xmin, ymin, xmax, ymax)
+        Each object consists of a string (the class), a tuple of 4 floats (xmin, ymin, xmax, ymax) and whether the
+        object is marked as difficult.
     """
     root: ET.Element = ET.parse(xml_path).getroot()
 
-    img_name = root.find("filename").text
-
+    img_name = root.findtext("filename")
     size: ET.Element = root.find("size")
-    width, height = int(size.find("width").text), int(size.find("height").text)
+    width, height = int(size.findtext("width")), int(size.findtext("height"))
 
-    objects: ET.Element = root.findall("object")
+    labels: list[tuple[str, tuple[float, float, float, float], bool]] = []
+    for item in root.iterfind("object"):
+        bndbox = item.find("bndbox")
+        bbox = (float(bndbox.findtext("xmin")), float(bndbox.findtext("ymin")),
+                float(bndbox.findtext("xmax")), float(bndbox.findtext("ymax")))
+        labels.append((item.findtext("name"), bbox, item.findtext("difficult", "0").strip() not in ("0", "")))
 
-    labels: list[tuple[str, tuple[int, int, int, int]]] = []
-    for item in objects:
-        difficult = int(item.find("difficult").text)
-        if difficult:
-            continue
+    return img_name, width, height, labels
 
-        cls = item.find("name").text
-        bbox = ((int(item.find("bndbox").find("xmin").text)),
-                (int(item.find("bndbox").find("ymin").text)),
-                (int(item.find("bndbox").find("xmax").text)),
-                (int(item.find("bndbox").find("ymax").text)))
-        labels.append((cls, bbox))
 
-    return img_name, width, height, labels
+class VocChunk(NamedTuple):
+    """The parsed annotations of several xml files, in arrays to be cheap to send between processes."""
+
+    file_names: list[str]
+    img_sizes: npt.NDArray[np.int64]  # (N, 2) width and height of each image.
+    class_names: list[str]  # The classes present in the chunk.
+    obj_img_idx: npt.NDArray[np.int64]  # (M,) index (in the chunk) of the image of each object.
+    obj_class_idx: npt.NDArray[np.int64]  # (M,) index in class_names of the class of each object.
+    bboxes: npt.NDArray[np.float64]  # (M, 4) xmin, ymin, xmax, ymax of each object.
+    difficult: npt.NDArray[np.bool_]  # (M,) whether each object is marked as difficult.
 
 
-def get_all_classes(xmls_path: list[Path]) -> list[str]:
-    """Takes a list of PascalVOC format xmls, and return a list of all the classes.
+def parse_voc_chunk(xml_paths: Sequence[Path]) -> VocChunk:
+    """Parse several xml files, each one being parsed only once.
 
     Args:
-        xml_paths (list): List with all the xml paths
+        xml_paths: The paths of the xml files to parse.
 
     Returns:
-        List with all the classes
+        The annotations of the files.
     """
-    classes: set[str] = set()
-    for xml_path in xmls_path:
-        root: ET.Element = ET.parse(xml_path).getroot()
-        objects: ET.Element = root.findall("object")
-        for item in objects:
-            classes.add(item.find("name").text)
+    file_names: list[str] = []
+    img_sizes: list[tuple[int, int]] = []
+    class_idx: dict[str, int] = {}
+    obj_img_idx: list[int] = []
+    obj_class_idx: list[int] = []
+    bboxes: list[tuple[float, float, float, float]] = []
+    difficult: list[bool] = []
+    for img_idx, xml_path in enumerate(xml_paths):
+        file_name, width, height, objects = parse_voc2007_annotation(xml_path)
+        file_names.append(file_name)
+        img_sizes.append((width, height))
+        for cls_name, bbox, is_difficult in objects:
+            obj_img_idx.append(img_idx)
+            obj_class_idx.append(class_idx.setdefault(cls_name, len(class_idx)))
+            bboxes.append(bbox)
+            difficult.append(is_difficult)
+    return VocChunk(file_names, np.asarray(img_sizes, dtype=np.int64).reshape(-1, 2), list(class_idx),
+                    np.asarray(obj_img_idx, dtype=np.int64), np.asarray(obj_class_idx, dtype=np.int64),
+                    np.asarray(bboxes, dtype=np.float64).reshape(-1, 4), np.asarray(difficult, dtype=bool))
+
+
+def get_categories(chunks: Sequence[VocChunk]) -> list[Category]:
+    """Return the categories of all the classes present in the chunks, with ids given in the classes' sorted order."""
+    class_names = sorted({cls_name for chunk in chunks for cls_name in chunk.class_names})
+    return [{"id": cls_id, "name": cls_name, "supercategory": cls_name} for cls_id, cls_name in enumerate(class_names)]
+
+
+def iter_coco_images(chunks: Sequence[VocChunk]) -> Iterator[Image]:
+    """Yield the COCO image entries of the parsed xml files, the ids being the indices of the files."""
+    img_id = 0
+    for chunk in chunks:
+        for file_name, (width, height) in zip(chunk.file_names, chunk.img_sizes.tolist()):
+            yield {"id": img_id, "width": width, "height": height, "file_name": file_name}
+            img_id += 1
+
+
+def iter_coco_annotations(chunks: Sequence[VocChunk],
+                          categories: Sequence[Category],
+                          difficult_mode: TDifficultMode = "crowd") -> Iterator[Annotation]:
+    """Yield the COCO annotation entries of the objects of the parsed xml files.
 
-    return list(classes)
+    Args:
+        chunks: The parsed xml files.
+        categories: The categories (see `get_categories`).
+        difficult_mode: What to do with the objects marked as difficult:
+                          - skip: drop them.
+                          - crowd: keep them with iscrowd set to 1 (ignored by the COCO evaluation, like difficult
+                                   objects in the VOC one).
+                          - attribute: keep them as normal objects, with a "difficult" field (0 or 1) added to all
+                                       the annotations.
+
+    Yields:
+        The annotations.
+    """
+    cat_ids = {category["name"]: category["id"] for category in categories}
+    # Keep integer coordinates (the usual case) as ints in the json.
+    integral = all(np.array_equal(chunk.bboxes, np.floor(chunk.bboxes)) for chunk in chunks)
+    bb_id = 0  # Each bounding box as a unique ID
+    img_offset = 0
+    for chunk in chunks:
+        keep = ~chunk.difficult if difficult_mode == "skip" else np.ones(len(chunk.difficult), dtype=bool)
+        chunk_cat_ids = np.asarray([cat_ids[cls_name] for cls_name in chunk.class_names], dtype=np.int64)
+        xywh = chunk.bboxes[keep].copy()
+        xywh[:, 2:] -= xywh[:, :2]
+        areas = xywh[:, 2] * xywh[:, 3]
+        if integral:
+            xywh, areas = xywh.astype(np.int64), areas.astype(np.int64)
+        for img_idx, cat_id, bbox, area, difficult in zip((chunk.obj_img_idx[keep] + img_offset).tolist(),
+                                                          chunk_cat_ids[chunk.obj_class_idx[keep]].tolist(),
+                                                          xywh.tolist(), areas.tolist(),
+                                                          chunk.difficult[keep].tolist()):
+            annotation: Annotation = {
+                "id": bb_id,
+                "image_id": img_idx,
+                "category_id": cat_id,
+                "segmentation": [],
+                "area": area,
+                "bbox": bbox,  # Top left x, top left y, width, height
+                "iscrowd": int(difficult and difficult_mode == "crowd"),
+            }
+            if difficult_mode == "attribute":
+                annotation["difficult"] = int(difficult)  # type: ignore
+            yield annotation
+            bb_id += 1
+        img_offset += len(chunk.file_names)
 
 
 def main():
@@ -74,74 +166,42 @@ def main():
                         "have the same name.")
     parser.add_argument("--output_path", "--o", type=Path, default=None,
                         help="Path for the resulting json, defaults to data_path.parent / 'coco_annotations.json'")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    parser.add_argument("--difficult", choices=DIFFICULT_MODES, default="crowd",
+                        help="What to do with the objects marked as difficult: drop them, keep them as crowd "
+                             "annotations (ignored by the COCO evaluation), or keep them with a 'difficult' field.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     data_path: Path = args.data_path
+    compact: bool = args.compact
+    difficult_mode: TDifficultMode = args.difficult
+    output_path: Path = args.output_path if args.output_path else args.data_path.parent / "coco_annotations.json"
 
-    images: list[Image] = []
-    annotations: list[Annotation] = []
-    categories: list[Category] = []
-
-    xml_paths = list(data_path.rglob("*.xml"))
-
-    classes = get_all_classes(xml_paths)
-    cls_name_to_id: dict[str, int] = {}
-    for cls_id, cls_name in enumerate(classes):
-        categories.append({
-            "id": cls_id,
-            "name": cls_name,
-            "supercategory": cls_name
-        })
-        cls_name_to_id[cls_name] = cls_id
-
-    bb_id = 0  # Each bounding box as a unique ID
-    nb_imgs = len(xml_paths)
-    for i, xml_path in enumerate(xml_paths, start=0):
-        msg = f"Processing image: {xml_path.name} ({i+1}/{nb_imgs})"
-        print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)), end="\r", flush=True)
-
-        filename, width, height, objects = parse_voc2007_annotation(xml_path)
-
-        sample_image: Image = {
-            "id": i,
-            "width": width,
-            "height": height,
-            "file_name": filename
-        }
-        images.append(sample_image)
-
-        # Add the segmentation for that layer
-        for (cls_name, bbox) in objects:
-            width = bbox[2]-bbox[0]
-            height = bbox[3]-bbox[1]
+    start_profiling(args)
 
-            annotation: Annotation = {
-                "id": bb_id,
-                "image_id": i,
-                "category_id": cls_name_to_id[cls_name],
-                "segmentation": [],
-                "area": width * height,
-                "bbox": [bbox[0],  # Top left x position
-                         bbox[1],   # Top left y position
-                         width,  # Width
-                         height],  # Height
-                "iscrowd": 0
-            }
-            bb_id += 1
-            annotations.append(annotation)
+    # Sorted to give the same ids whatever the order in which the filesystem lists the files.
+    xml_paths = sorted(data_path.rglob("*.xml"))
+    path_chunks = [xml_paths[i:i+CHUNK_SIZE] for i in range(0, len(xml_paths), CHUNK_SIZE)]
 
-    coco_dataset = {
-        "images": images,
-        "annotations": annotations,
-        "categories": categories
-    }
+    chunks: list[VocChunk] = []
+    nb_parsed = 0
+    with stage("load_xml"), Pool(processes=get_nb_processes()) as pool:
+        for chunk in pool.imap(parse_voc_chunk, path_chunks):
+            chunks.append(chunk)
+            nb_parsed += len(chunk.file_names)
+            clean_print(f"Parsed {nb_parsed}/{len(xml_paths)} xml files", end="\r")
 
-    output_path: Path = args.output_path if args.output_path else args.data_path.parent / "coco_annotations.json"
+    count("xml_files_parsed", nb_parsed)
+    categories = get_categories(chunks)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as json_file:
-        json.dump(coco_dataset, json_file, indent=4)
+    with stage("write_json"), CocoJsonWriter(output_path, compact=compact) as writer:
+        writer.write_section("images", iter_coco_images(chunks))
+        writer.write_section("annotations", iter_coco_annotations(chunks, categories, difficult_mode))
+        writer.write_section("categories", categories)
 
-    print(f"Saved the coco annotations to {output_path}")
+    clean_print(f"Saved the coco annotations to {output_path}")
 
 
 if __name__ == "__main__":
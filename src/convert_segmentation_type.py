@@ -6,15 +6,169 @@ There are 3 ways of representing a segmentation for a coco dataset:
 - Encoded RLE
 
 Run with: python -m src.convert_segmentation_type <path to json file>
+Use the --streaming option for files that do not fit in memory.
 """
 import argparse
-import json
+from collections import deque
+from collections.abc import Iterable, Iterator
+from multiprocessing.pool import AsyncResult, Pool
 from pathlib import Path
-from typing import Literal
+from typing import Any, Literal, Optional
 
 import src.utils.segmentation_conversions as cvt
-from src.types.coco_types import Annotation, Category, Image
-from src.utils.misc import clean_print
+from src.types.coco_types import Annotation, EncodedRLE, RLE, TPolygon_segmentation
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import CocoJsonWriter, iter_coco_entries, save_coco_json
+from src.utils.misc import clean_print, get_nb_processes
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+
+TSegFormat = Literal["polygon", "rle", "encoded_rle"]
+# Number of annotations sent at once to a worker process.
+BATCH_SIZE = 1000
+
+
+def get_segmentation_format(segmentation: Any) -> TSegFormat:
+    """Return the format of a segmentation (polygon, rle or encoded_rle)."""
+    if isinstance(segmentation, list):
+        return "polygon"
+    return "rle" if isinstance(segmentation["counts"], list) else "encoded_rle"
+
+
+def convert_annotations(annotations: list[Annotation],
+                        img_sizes: list[Optional[tuple[int, int]]],
+                        sef_format: TSegFormat,
+                        epsilon: float = 0.) -> list[Annotation]:
+    """Convert the segmentations of a batch of annotations (inplace) to the given format.
+
+    All the annotations of the batch that need the same conversion are converted together.
+
+    Args:
+        annotations: The annotations to convert.
+        img_sizes: The (height, width) of the image of each annotation, needed to rasterize polygons.
+        sef_format: The destination format.
+        epsilon: When converting to polygons, the tolerance (in pixels) used to simplify them (0 to keep the exact
+                 contours).
+
+    Returns:
+        The converted annotations.
+    """
+    for annotation in annotations:
+        assert "segmentation" in annotation, f"No segmentation found for annotation {annotation}"
+    formats = [get_segmentation_format(annotation["segmentation"]) for annotation in annotations]
+    if sef_format == "polygon":
+        # (Encoded) RLE -> Polygon
+        rle_idx = [i for i, seg_format in enumerate(formats) if seg_format != "polygon"]
+        rle_segmentations: list[RLE | EncodedRLE] = [annotations[i]["segmentation"] for i in rle_idx]  # type: ignore
+        encoded_idx = [j for j, i in enumerate(rle_idx) if formats[i] == "encoded_rle"]
+        decoded_counts = cvt.encoded_rles_to_rles([rle_segmentations[j]["counts"] for j in encoded_idx])  # type: ignore
+        rles: list[Any] = [segmentation["counts"] for segmentation in rle_segmentations]
+        for j, counts in zip(encoded_idx, decoded_counts):
+            rles[j] = counts
+        heights = [segmentation["size"][0] for segmentation in rle_segmentations]
+        widths = [segmentation["size"][1] for segmentation in rle_segmentations]
+        for i, polygons in zip(rle_idx, cvt.rles_to_polygons(rles, heights, widths, epsilon)):
+            annotations[i]["segmentation"] = polygons
+        return annotations
+
+    # Polygon -> RLE
+    polygon_idx = [i for i, seg_format in enumerate(formats) if seg_format == "polygon"]
+    if polygon_idx:
+        sizes: list[tuple[int, int]] = []
+        for i in polygon_idx:
+            if (img_size := img_sizes[i]) is None:
+                raise ValueError(f"Could not find the image of annotation {annotations[i]['id']}, "
+                                 "its size is needed to rasterize the polygons.")
+            sizes.append(img_size)
+        heights, widths = zip(*sizes)
+        segmentations: list[TPolygon_segmentation] = [annotations[i]["segmentation"]  # type: ignore
+                                                      for i in polygon_idx]
+        for i, rle, (height, width) in zip(polygon_idx, cvt.polygons_to_rles(segmentations, heights, widths), sizes):
+            annotations[i]["segmentation"] = {"size": [height, width], "counts": rle}  # type: ignore
+            formats[i] = "rle"
+
+    # RLE <-> Encoded RLE
+    source_format = "rle" if sef_format == "encoded_rle" else "encoded_rle"
+    convert_fn = cvt.rles_to_encoded_rles if sef_format == "encoded_rle" else cvt.encoded_rles_to_rles
+    to_convert_idx = [i for i, seg_format in enumerate(formats) if seg_format == source_format]
+    converted_counts = convert_fn([annotations[i]["segmentation"]["counts"]  # type: ignore
+                                   for i in to_convert_idx])
+    for i, counts in zip(to_convert_idx, converted_counts):
+        annotations[i]["segmentation"]["counts"] = counts  # type: ignore
+    return annotations
+
+
+def convert_annotation(annotation: Annotation,
+                       sef_format: TSegFormat,
+                       img_size: Optional[tuple[int, int]] = None,
+                       epsilon: float = 0.) -> Annotation:
+    """Convert the segmentation of an annotation (inplace) to the given format.
+
+    Args:
+        annotation: The annotation to convert.
+        sef_format: The destination format.
+        img_size: The (height, width) of the image of the annotation, needed to rasterize polygons.
+        epsilon: When converting to polygons, the tolerance (in pixels) used to simplify them.
+
+    Returns:
+        The converted annotation.
+    """
+    return convert_annotations([annotation], [img_size], sef_format, epsilon)[0]
+
+
+def _convert_worker(args: tuple[list[Annotation], list[Optional[tuple[int, int]]], TSegFormat, float]
+                    ) -> list[Annotation]:
+    return convert_annotations(*args)
+
+
+def convert_entries(entries: Iterable[tuple[str, Any]],
+                    img_sizes: dict[int, tuple[int, int]],
+                    sef_format: TSegFormat,
+                    pool: Pool,
+                    max_pending_batches: int,
+                    epsilon: float = 0.) -> Iterator[tuple[str, Any]]:
+    """Convert the annotations among the entries of a COCO file, by batches in a process pool.
+
+    The entries are returned in the same order as they came in. Only a bounded number of batches are being processed
+    at a given time, so that the entries can be streamed from and to a file.
+
+    Args:
+        entries: The (section, entry) tuples, like the ones from `iter_coco_entries`.
+        img_sizes: Maps the image ids to the (height, width) of the images.
+        sef_format: The destination format.
+        pool: The pool in which to convert the annotations.
+        max_pending_batches: Maximum number of batches sent to the pool whose results have not been returned yet.
+        epsilon: When converting to polygons, the tolerance (in pixels) used to simplify them.
+
+    Yields:
+        The (section, entry) tuples, with the annotations converted.
+    """
+    pending_batches: deque[AsyncResult[list[Annotation]]] = deque()
+    batch: list[Annotation] = []
+
+    def submit_batch() -> None:
+        nonlocal batch
+        if batch:
+            batch_img_sizes = [img_sizes.get(annotation["image_id"]) for annotation in batch]
+            pending_batches.append(pool.apply_async(_convert_worker, ((batch, batch_img_sizes, sef_format, epsilon),)))
+            batch = []
+
+    for section, entry in entries:
+        if section == "annotations":
+            batch.append(entry)
+            if len(batch) == BATCH_SIZE:
+                submit_batch()
+            while len(pending_batches) > max_pending_batches:
+                yield from (("annotations", annotation) for annotation in pending_batches.popleft().get())
+            continue
+        # Entries of another section come after all the annotations being converted.
+        submit_batch()
+        while pending_batches:
+            yield from (("annotations", annotation) for annotation in pending_batches.popleft().get())
+        yield section, entry
+
+    submit_batch()
+    while pending_batches:
+        yield from (("annotations", annotation) for annotation in pending_batches.popleft().get())
 
 
 def main():
@@ -25,54 +179,73 @@ def main():
                         help="The destination format.")
     parser.add_argument("--output_path", "-o", type=Path, default=None,
                         help="Path for to where the edited json file will be saved. Defaults to inplace editing.")
+    parser.add_argument("--streaming", "-s", action="store_true",
+                        help="Process the entries one at a time instead of loading the whole file in memory.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    parser.add_argument("--epsilon", "-e", type=float, default=0.,
+                        help="When converting to polygons, maximum distance (in pixels) between the contours of the "
+                             "masks and the simplified polygons. 0 keeps all the corners of the pixel edges (the "
+                             "polygons then give back the masks, with their holes filled).")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     json_path: Path = args.json_path
-    sef_format: Literal["polygon", "rle", "encoded_rle"] = args.format
+    sef_format: TSegFormat = args.format
     output_path: Path = args.output_path if args.output_path is not None else json_path
+    streaming: bool = args.streaming
+    compact: bool = args.compact
+    epsilon: float = args.epsilon
+
+    start_profiling(args)
+    nb_processes = get_nb_processes()
+    if streaming:
+        # First pass to get the image sizes (needed to rasterize polygons), second pass to convert the annotations.
+        img_sizes = {image["id"]: (image["height"], image["width"])
+                     for _, image in iter_coco_entries(json_path, sections=("images",))}
+        print(f"Streaming the annotations from '{json_path}' to '{output_path}', converting them to {sef_format}.")
+        nb_annotations = 0
+        with stage("transform"), Pool(processes=nb_processes) as pool, \
+                CocoJsonWriter(output_path, compact=compact) as writer:
+            for section, entry in convert_entries(iter_coco_entries(json_path), img_sizes, sef_format, pool,
+                                                  max_pending_batches=2 * nb_processes, epsilon=epsilon):
+                if section == "annotations":
+                    nb_annotations += 1
+                    if nb_annotations % BATCH_SIZE == 0:
+                        clean_print(f"Processed {nb_annotations} annotations", end="\r")
+                writer.write_entry(section, entry)
+        count("annotations_processed", nb_annotations)
+        clean_print(f"Finished processing the dataset ({nb_annotations} annotations).")
+        return
 
     # Load the dataset
-    with open(json_path, encoding="utf-8") as annotations_file:
-        coco_dataset = json.load(annotations_file)
-    images: list[Image] = coco_dataset["images"]
-    annotations: list[Annotation] = coco_dataset["annotations"]
-    categories: list[Category] = coco_dataset["categories"]
+    dataset = CocoDataset.from_json(json_path)
+    images, annotations, categories = dataset.images, dataset.annotations, dataset.categories
+    img_sizes = {image["id"]: (image["height"], image["width"]) for image in images}
 
     nb_annotations = len(annotations)
     print(f"Loaded a json file containing {nb_annotations} annotations. Converting them to {sef_format} format.")
-    for i, annotation in enumerate(annotations):
-        clean_print(f"Processing entry: ({i+1}/{nb_annotations})", end="\r" if i+1 != nb_annotations else "\n")
-        assert "segmentation" in annotation, f"No segmentation found for annotation {annotation}"
-        segmentation = annotation["segmentation"]
-        if isinstance(segmentation, list):
-            if sef_format == "rle":
-                raise NotImplementedError("RLE -> Encoded RLE is not implemented yet.")
-            elif sef_format == "encoded_rle":
-                raise NotImplementedError("RLE -> Encoded RLE is not implemented yet.")
-            raise NotImplementedError("Polygon segmentation is not implemented yet.")
-        else:
-            if isinstance(segmentation["counts"], list):
-                if sef_format == "polygon":
-                    raise NotImplementedError("RLE -> Polygon is not implemented yet.")
-                elif sef_format == "encoded_rle":
-                    raise NotImplementedError("RLE -> Encoded RLE is not implemented yet.")
-            else:
-                if sef_format == "polygon":
-                    raise NotImplementedError("Encoded RLE -> Polygon is not implemented yet.")
-                elif sef_format == "rle":
-                    rle = cvt.encoded_rle_to_rle(segmentation["counts"]).tolist()
-                    annotations[i]["segmentation"]["counts"] = rle  # type: ignore
+    converted_annotations: list[Annotation] = []
+    with stage("transform"), Pool(processes=nb_processes) as pool:
+        for _, annotation in convert_entries((("annotations", annotation) for annotation in annotations), img_sizes,
+                                             sef_format, pool, max_pending_batches=2 * nb_processes,
+                                             epsilon=epsilon):
+            converted_annotations.append(annotation)
+            if len(converted_annotations) % BATCH_SIZE == 0 or len(converted_annotations) == nb_annotations:
+                clean_print(f"Processing entry: ({len(converted_annotations)}/{nb_annotations})",
+                            end="\r" if len(converted_annotations) != nb_annotations else "\n")
+
+    count("annotations_processed", len(converted_annotations))
 
     # Save the altered annotations
     edited_dataset = {
         "images": images,
-        "annotations": annotations,
+        "annotations": converted_annotations,
         "categories": categories
     }
 
     print(f"Saving the edited json to: '{output_path}'")
-    with open(output_path, "w", encoding="utf-8") as json_file:
-        json.dump(edited_dataset, json_file, indent=4)
+    save_coco_json(output_path, edited_dataset, compact=compact)
 
     print("Finished processing the dataset.")
 
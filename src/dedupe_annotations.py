@@ -0,0 +1,186 @@
+"""Script to find (and remove) duplicate annotations: boxes of the same category that overlap a lot on the same image.
+
+Run with: python -m src.dedupe_annotations <path to json file> --iou_threshold 0.9
+"""
+import argparse
+import json
+from collections.abc import Iterator
+from itertools import chain
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from src.types.coco_types import Annotation
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import save_coco_json
+from src.utils.misc import clean_print
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+
+# Maximum number of candidate pairs whose IoU is computed at once.
+MAX_CANDIDATES_PER_CHUNK = 2**22
+
+
+def get_boxes_and_groups(annotations: list[Annotation]) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.int64]]:
+    """Gather the boxes of the annotations, and the group in which each annotation should be compared to the others.
+
+    The annotations are grouped by image, category and iscrowd, using a hash index (single pass over the annotations).
+
+    Args:
+        annotations: The annotations.
+
+    Returns:
+        (N, 4) The boxes (x_min, y_min, x_max, y_max) and (N,) the group of each annotation.
+    """
+    group_ids: dict[tuple[int, int, int], int] = {}
+    groups = np.fromiter((group_ids.setdefault((annotation["image_id"], annotation["category_id"],
+                                                annotation.get("iscrowd", 0)), len(group_ids))
+                          for annotation in annotations), dtype=np.int64, count=len(annotations))
+    boxes = np.fromiter(chain.from_iterable(annotation["bbox"] for annotation in annotations), dtype=np.float64,
+                        count=4 * len(annotations)).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes, groups
+
+
+def boxes_iou(boxes_1: npt.NDArray[np.float64], boxes_2: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """Compute the IoU between the boxes (x_min, y_min, x_max, y_max) of `boxes_1` and the ones of `boxes_2`."""
+    inter_widths = np.minimum(boxes_1[:, 2], boxes_2[:, 2]) - np.maximum(boxes_1[:, 0], boxes_2[:, 0])
+    inter_heights = np.minimum(boxes_1[:, 3], boxes_2[:, 3]) - np.maximum(boxes_1[:, 1], boxes_2[:, 1])
+    intersections = np.clip(inter_widths, 0, None) * np.clip(inter_heights, 0, None)
+    areas_1 = (boxes_1[:, 2] - boxes_1[:, 0]) * (boxes_1[:, 3] - boxes_1[:, 1])
+    areas_2 = (boxes_2[:, 2] - boxes_2[:, 0]) * (boxes_2[:, 3] - boxes_2[:, 1])
+    unions = areas_1 + areas_2 - intersections
+    return np.divide(intersections, unions, out=np.zeros_like(unions), where=unions > 0)
+
+
+def iter_overlapping_pairs(boxes: npt.NDArray[np.float64],
+                           groups: npt.NDArray[np.int64],
+                           iou_threshold: float
+                           ) -> Iterator[tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.float64]]]:
+    """Find the pairs of boxes of the same group whose IoU is at least the threshold.
+
+    The boxes are sorted by group and then by x_min. The candidates of a box are then the next boxes of its group with
+    an x_min below its x_max (sort and sweep), which are found for all the boxes at once with a single searchsorted.
+    The IoUs of the candidates are computed by chunks, to bound the memory used on crowded images.
+
+    Args:
+        boxes: (N, 4) The boxes (x_min, y_min, x_max, y_max).
+        groups: (N,) The group of each box. Only boxes of the same group are compared.
+        iou_threshold: The minimum IoU for a pair to be returned.
+
+    Yields:
+        For a chunk of candidates, the indices of the first and second boxes of the pairs (the first one being the
+        one with the lower index) and their IoU.
+    """
+    nb_boxes = len(boxes)
+    if nb_boxes == 0:
+        return
+    order = np.lexsort((boxes[:, 0], groups))
+    sorted_boxes, sorted_groups = boxes[order], groups[order]
+
+    # Offset the x coordinates by group, so that the sweep does not cross the boundaries of the groups.
+    x_origin = sorted_boxes[:, 0].min()
+    group_span = sorted_boxes[:, 2].max() - x_origin + 1
+    keys = sorted_groups * group_span + (sorted_boxes[:, 0] - x_origin)
+    sweep_ends = np.searchsorted(keys, sorted_groups * group_span + (sorted_boxes[:, 2] - x_origin), side="left")
+    nb_candidates = np.maximum(sweep_ends - np.arange(1, nb_boxes + 1), 0)
+
+    cumulative_candidates = np.concatenate(([0], np.cumsum(nb_candidates)))
+    chunk_start = 0
+    while chunk_start < nb_boxes:
+        chunk_end = int(np.searchsorted(cumulative_candidates,
+                                        cumulative_candidates[chunk_start] + MAX_CANDIDATES_PER_CHUNK, side="right"))
+        chunk_end = min(max(chunk_end - 1, chunk_start + 1), nb_boxes)
+        chunk_nb_candidates = nb_candidates[chunk_start:chunk_end]
+        first_idx = np.repeat(np.arange(chunk_start, chunk_end), chunk_nb_candidates)
+        candidate_offsets = np.cumsum(chunk_nb_candidates) - chunk_nb_candidates
+        second_idx = (first_idx + 1 + np.arange(len(first_idx))
+                      - np.repeat(candidate_offsets, chunk_nb_candidates))
+        ious = boxes_iou(sorted_boxes[first_idx], sorted_boxes[second_idx])
+        is_duplicate = ious >= iou_threshold
+        first_idx, second_idx = order[first_idx[is_duplicate]], order[second_idx[is_duplicate]]
+        yield np.minimum(first_idx, second_idx), np.maximum(first_idx, second_idx), ious[is_duplicate]
+        chunk_start = chunk_end
+
+
+def find_duplicates(annotations: list[Annotation],
+                    iou_threshold: float
+                    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+    """Find the pairs of annotations of the same image and category whose boxes have an IoU above the threshold.
+
+    Args:
+        annotations: The annotations.
+        iou_threshold: The minimum IoU for two boxes to be considered duplicates.
+
+    Returns:
+        The indices of the first and second annotations of each pair (first < second, sorted) and their IoU.
+    """
+    boxes, groups = get_boxes_and_groups(annotations)
+    chunks = list(iter_overlapping_pairs(boxes, groups, iou_threshold))
+    if not chunks:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    first_idx, second_idx, ious = (np.concatenate(arrays) for arrays in zip(*chunks))
+    pair_order = np.lexsort((second_idx, first_idx))
+    return first_idx[pair_order], second_idx[pair_order], ious[pair_order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=("Find the annotations of the same image and category whose boxes "
+                                                  "overlap more than a threshold, and remove the duplicates (an "
+                                                  "annotation is removed if it duplicates an earlier one)."),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("json_path", type=Path, help="Path to COCO annotations file.")
+    parser.add_argument("--output_path", "-o", type=Path, default=None,
+                        help="Path for to where the edited json file will be saved. Defaults to inplace editing.")
+    parser.add_argument("--iou_threshold", "-t", type=float, default=0.9,
+                        help="Minimum IoU between two boxes for them to be considered duplicates.")
+    parser.add_argument("--report_path", "-r", type=Path, default=None,
+                        help="If given, save the duplicate pairs (annotation ids and IoU) to this json file.")
+    parser.add_argument("--dry_run", action="store_true", help="Only report the duplicates, do not remove them.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    json_path: Path = args.json_path
+    output_path: Path = args.output_path if args.output_path is not None else json_path
+    iou_threshold: float = args.iou_threshold
+    report_path: Optional[Path] = args.report_path
+    dry_run: bool = args.dry_run
+    compact: bool = args.compact
+
+    start_profiling(args)
+    dataset = CocoDataset.from_json(json_path)
+    annotations = dataset.annotations
+    print(f"Loaded a json file containing {len(annotations)} annotations. Looking for duplicates.")
+    with stage("transform"):
+        first_idx, second_idx, ious = find_duplicates(annotations, iou_threshold)
+    count("annotations_processed", len(annotations))
+    is_duplicate = np.zeros(len(annotations), dtype=np.bool_)
+    is_duplicate[second_idx] = True
+    print(f"Found {len(ious)} pairs of boxes with an IoU of at least {iou_threshold}, "
+          f"{is_duplicate.sum()} annotations are duplicates.")
+
+    if report_path is not None:
+        report = [{"image_id": annotations[first]["image_id"],
+                   "category_id": annotations[first]["category_id"],
+                   "annotation_ids": [annotations[first]["id"], annotations[second]["id"]],
+                   "iou": round(iou, 4)}
+                  for first, second, iou in zip(first_idx.tolist(), second_idx.tolist(), ious.tolist())]
+        with open(report_path, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=None if compact else 2)
+        print(f"Saved the duplicate pairs to '{report_path}'")
+
+    if dry_run:
+        return
+
+    dataset.annotations = [annotation for annotation, duplicate in zip(annotations, is_duplicate.tolist())
+                           if not duplicate]
+    clean_print(f"Saving the {len(dataset.annotations)} remaining annotations to: '{output_path}'")
+    save_coco_json(output_path, dataset.to_dict(), compact=compact)
+    print("Finished processing the dataset.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Find the images of a dataset that are near duplicates of each other (for example close frames of a video)."""
+import argparse
+import json
+import os
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Optional
+
+import cv2
+
+from src.types.coco_types import Image
+from src.utils.coco_json import iter_coco_entries
+from src.utils.misc import clean_print, get_nb_processes
+from src.utils.perceptual_hash import dhash, find_near_duplicates, HASH_TYPES, phash, PHASH_IMG_SIZE, THashType
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+
+JPEG_SUFFIXES = (".jpg", ".jpeg", ".jpe", ".jfif")
+# Reduced grayscale decoding flags, from the largest reduction factor to the smallest one.
+_REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                       (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                       (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+CACHE_VERSION = 1
+
+
+def get_imread_flag(img_path: Path, width: int, height: int) -> int:
+    """Return the flag to read an image in grayscale at the lowest resolution from which the hashes can be computed.
+
+    JPEGs can be decoded directly at 1/2, 1/4 or 1/8 of their resolution, other formats are decoded at full
+    resolution (OpenCV would decode them fully before reducing them anyway).
+    """
+    if img_path.suffix.lower() in JPEG_SUFFIXES:
+        max_reduction = min(width, height) / PHASH_IMG_SIZE
+        for reduction, flag in _REDUCED_READ_FLAGS:
+            if max_reduction >= reduction:
+                return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def hash_worker(args: tuple[Path, int, int]) -> Optional[tuple[int, int]]:
+    """Compute the dHash and pHash of an image.
+
+    Args:
+        args: Tuple containing the following:
+              - img_path: path of the image
+              - width: width of the image
+              - height: height of the image
+
+    Returns:
+        The dHash and pHash of the image, or None if it could not be read.
+    """
+    img_path, width, height = args
+    img = cv2.imread(str(img_path), get_imread_flag(img_path, width, height))
+    if img is None:
+        return None
+    return dhash(img), phash(img)
+
+
+def load_hash_cache(cache_path: Path) -> dict[str, list[int]]:
+    """Load the cached hashes, indexed by image path, each entry being [mtime_ns, size, dhash, phash]."""
+    try:
+        with open(cache_path, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache["entries"] if cache.get("version") == CACHE_VERSION else {}
+
+
+def compute_hashes(images: list[Image],
+                   data_path: Path,
+                   cache_path: Optional[Path] = None) -> list[Optional[tuple[int, int]]]:
+    """Compute the (dHash, pHash) of the images in parallel, reusing the cached ones of the unmodified files.
+
+    Args:
+        images: The image entries.
+        data_path: Path to the directory with the images.
+        cache_path: Path of the sidecar file caching the hashes (keyed by path, modification time and size). It is
+                    updated with the new hashes. No cache is used if None.
+
+    Returns:
+        The hashes of each image (None for the missing or unreadable images).
+    """
+    cache = load_hash_cache(cache_path) if cache_path is not None else {}
+    hashes: list[Optional[tuple[int, int]]] = [None] * len(images)
+    new_cache: dict[str, list[int]] = {}
+    to_compute: list[tuple[int, str, os.stat_result]] = []
+    for i, image in enumerate(images):
+        img_path = os.path.abspath(data_path / image["file_name"])
+        try:
+            img_stat = os.stat(img_path)
+        except FileNotFoundError:
+            continue
+        entry = cache.get(img_path)
+        if entry is not None and entry[:2] == [img_stat.st_mtime_ns, img_stat.st_size]:
+            hashes[i] = entry[2], entry[3]
+            new_cache[img_path] = entry
+        else:
+            to_compute.append((i, img_path, img_stat))
+    count("hash_cache_hits", len(new_cache))
+    count("images_decoded", len(to_compute))
+
+    if to_compute:
+        mp_args = [(Path(img_path), images[i]["width"], images[i]["height"]) for i, img_path, _ in to_compute]
+        with Pool(processes=get_nb_processes()) as pool:
+            for nb_done, ((i, img_path, img_stat), img_hashes) in enumerate(
+                    zip(to_compute, pool.imap(hash_worker, mp_args, chunksize=64)), start=1):
+                if img_hashes is not None:
+                    hashes[i] = img_hashes
+                    new_cache[img_path] = [img_stat.st_mtime_ns, img_stat.st_size, *img_hashes]
+                if nb_done % 64 == 0 or nb_done == len(to_compute):
+                    clean_print(f"Hashed {nb_done}/{len(to_compute)} images", end="\r")
+
+    if cache_path is not None:
+        tmp_path = cache_path.with_name(f".{cache_path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"version": CACHE_VERSION, "entries": new_cache}, cache_file)
+        os.replace(tmp_path, cache_path)
+    return hashes
+
+
+def get_duplicate_clusters(images: list[Image],
+                           hashes: list[Optional[tuple[int, int]]],
+                           hash_type: THashType = "dhash",
+                           max_distance: int = 4) -> list[list[str]]:
+    """Group the images whose hashes are within the given Hamming distance (transitively).
+
+    Args:
+        images: The image entries.
+        hashes: The (dHash, pHash) of each image (the images without hashes are ignored).
+        hash_type: Which hash to use.
+        max_distance: The maximum Hamming distance between the hashes of two near duplicate images.
+
+    Returns:
+        The file names of the images of each cluster, the biggest clusters first.
+    """
+    hashed_idx = [i for i, img_hashes in enumerate(hashes) if img_hashes is not None]
+    hash_idx = HASH_TYPES.index(hash_type)
+    clusters = find_near_duplicates([hashes[i][hash_idx] for i in hashed_idx], max_distance)  # type: ignore
+    clusters.sort(key=len, reverse=True)
+    return [[images[hashed_idx[i]]["file_name"] for i in cluster] for cluster in clusters]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=("Finds the near duplicate images of a dataset (for example close "
+                                                  "frames of a video), using perceptual hashes."),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("data_path", type=Path, help="Path to the directory with the images.")
+    parser.add_argument("annotations", type=Path, help="Path to COCO annotations file.")
+    parser.add_argument("--output_path", "-o", type=Path, default=None,
+                        help="Where to save the clusters, defaults to near_duplicates.json next to the annotations.")
+    parser.add_argument("--hash_type", "--hash-type", choices=HASH_TYPES, default="dhash",
+                        help="Perceptual hash to use: difference hash (gradients) or DCT hash (more robust to "
+                             "brightness and small edits).")
+    parser.add_argument("--max_distance", "--max-distance", "-d", type=int, default=4,
+                        help="Maximum Hamming distance (out of 64 bits) between the hashes of near duplicate images.")
+    parser.add_argument("--cache_path", "--cache-path", type=Path, default=None,
+                        help="Sidecar file caching the hashes, defaults to <annotations>.phash_cache.json.")
+    parser.add_argument("--no_cache", "--no-cache", action="store_true", help="Do not use (nor write) the cache.")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    data_path: Path = args.data_path
+    annotations_path: Path = args.annotations
+    output_path: Path = args.output_path if args.output_path else annotations_path.parent / "near_duplicates.json"
+    hash_type: THashType = args.hash_type
+    max_distance: int = args.max_distance
+    default_cache_path = annotations_path.with_name(annotations_path.name + ".phash_cache.json")
+    cache_path: Optional[Path] = None if args.no_cache else (args.cache_path if args.cache_path else default_cache_path)
+
+    start_profiling(args)
+    with stage("load_json"):
+        images: list[Image] = [image for _, image in iter_coco_entries(annotations_path, sections=("images",))]
+    with stage("image_io"):
+        hashes = compute_hashes(images, data_path, cache_path)
+    if nb_missing := sum(img_hashes is None for img_hashes in hashes):
+        print(f"Warning: {nb_missing} images could not be read, they are ignored.")
+
+    with stage("transform"):
+        clusters = get_duplicate_clusters(images, hashes, hash_type, max_distance)
+    output: dict[str, Any] = {"hash_type": hash_type, "max_distance": max_distance, "clusters": clusters}
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump(output, output_file, indent=4)
+    clean_print(f"Found {len(clusters)} clusters of near duplicates, with {sum(map(len, clusters))} images in total. "
+                f"Saved them to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
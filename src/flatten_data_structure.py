@@ -1,9 +1,163 @@
 """Old script that needs to be adapted on a per dataset basis."""
 import argparse
-import random
-import shutil
+import json
+import os
 import xml.etree.ElementTree as ET  # noqa: N817
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
+
+from src.utils.coco_json import CocoJsonWriter, iter_coco_entries
+from src.utils.file_transfer import is_up_to_date, LINK_MODES, materialize_files, TLinkMode
+from src.utils.misc import clean_print
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".bmp")
+
+
+def scan_dataset(data_path: Path, exts: Sequence[str] = IMAGE_EXTENSIONS) -> tuple[list[Path], set[str]]:
+    """Walk the dataset folder once, listing the images and the xml files.
+
+    Args:
+        data_path: Path to the dataset.
+        exts: Extensions of the image files.
+
+    Returns:
+        The paths of the images (in a deterministic order), and the set of the paths of the xml files (as strings,
+        which are much faster to build and look up than Path objects).
+    """
+    img_paths: list[Path] = []
+    xml_paths: set[str] = set()
+    dirs_to_scan = [str(data_path)]
+    while dirs_to_scan:
+        with os.scandir(dirs_to_scan.pop()) as entries:
+            sorted_entries = sorted(entries, key=lambda entry: entry.name)
+        sub_dirs: list[str] = []
+        for entry in sorted_entries:
+            if entry.is_dir():
+                sub_dirs.append(entry.path)
+            elif (suffix := os.path.splitext(entry.name)[1]) in exts:
+                img_paths.append(Path(entry.path))
+            elif suffix == ".xml":
+                xml_paths.add(entry.path)
+        dirs_to_scan.extend(reversed(sub_dirs))
+    return img_paths, xml_paths
+
+
+def find_xml(img_path: Path, xml_paths: set[str]) -> Optional[Path]:
+    """Return the xml label of an image (either next to the image or in an adjacent "labels" folder), if any."""
+    dir_path, file_name = os.path.split(img_path)
+    xml_name = os.path.splitext(file_name)[0] + ".xml"
+    if (xml_path := os.path.join(dir_path, xml_name)) in xml_paths:
+        return Path(xml_path)
+    if (xml_path := os.path.join(os.path.dirname(dir_path), "labels", xml_name)) in xml_paths:
+        return Path(xml_path)
+    return None
+
+
+def get_existing_outputs(img_paths: Sequence[Path],
+                         data_path: Path,
+                         output_dir: Path,
+                         previous_names: dict[str, str],
+                         by_stem: bool = False) -> list[Optional[str]]:
+    """Find the images that a previous run already put in the output folder, so that they keep their name.
+
+    An image is considered already there if the file with its previous name (from the rename map of the previous run),
+    or with its own name, has the same size and modification time.
+
+    Args:
+        img_paths: The paths of the images.
+        data_path: Path to the dataset (the keys of previous_names are relative to it).
+        output_dir: The folder where the images are put.
+        previous_names: The rename map saved by the previous run.
+        by_stem: If True, names with only a different extension are considered as the same (see `get_output_names`).
+
+    Returns:
+        For each image, the name of its up to date copy in the output folder (None if there is none).
+    """
+    existing_names: list[Optional[str]] = []
+    claimed_names: set[str] = set()
+    for img_path in img_paths:
+        existing_name: Optional[str] = None
+        for name in (previous_names.get(img_path.relative_to(data_path).as_posix()), img_path.name):
+            if (name is not None and (key := os.path.splitext(name)[0] if by_stem else name) not in claimed_names
+                    and is_up_to_date(img_path, output_dir / name)):
+                claimed_names.add(key)
+                existing_name = name
+                break
+        existing_names.append(existing_name)
+    return existing_names
+
+
+def get_output_names(img_paths: Sequence[Path], taken_names: set[str], by_stem: bool = False) -> list[str]:
+    """Give each image a unique name in the output folder.
+
+    Names that are already taken get a "_1", "_2", etc suffix added to their stem, the first free one being used.
+
+    Args:
+        img_paths: The paths of the images.
+        taken_names: The names already in use in the output folder (updated with the new names).
+        by_stem: If True, also consider names with only a different extension as colliding (as they would have the
+                 same label file).
+
+    Returns:
+        The output name of each image.
+    """
+    next_suffix: dict[str, int] = {}
+    output_names: list[str] = []
+    for img_path in img_paths:
+        stem, suffix = img_path.stem, img_path.suffix
+        name = img_path.name
+        while (stem if by_stem else name) in taken_names:
+            index = next_suffix.get(img_path.stem, 1)
+            next_suffix[img_path.stem] = index + 1
+            stem = f"{img_path.stem}_{index}"
+            name = stem + suffix
+        taken_names.add(stem if by_stem else name)
+        output_names.append(name)
+    return output_names
+
+
+def rewrite_xml(xml_path: Path, output_path: Path, file_name: str, remove_source: bool = False) -> None:
+    """Save a copy of an xml label with a different image filename.
+
+    Args:
+        xml_path: The xml label to rewrite.
+        output_path: Where to save the new xml.
+        file_name: The new name of the image.
+        remove_source: If True, delete the original xml afterwards.
+    """
+    tree = ET.parse(xml_path)
+    tree.getroot().find("filename").text = file_name  # type: ignore
+    with open(output_path, "wb") as f:
+        tree.write(f)
+    if remove_source:
+        xml_path.unlink()
+
+
+def rename_coco_images(json_path: Path, output_path: Path, rename_map: dict[str, str], compact: bool = False) -> int:
+    """Update the file names of the images of a COCO dataset, in one streaming pass.
+
+    Args:
+        json_path: The COCO annotations file.
+        output_path: Where to save the updated annotations.
+        rename_map: New file name of each image, indexed by the original one.
+        compact: If True, write the json without indentation.
+
+    Returns:
+        The number of images whose file name is not in the rename map (they are kept unchanged).
+    """
+    nb_unmapped = 0
+    with CocoJsonWriter(output_path, compact=compact) as writer:
+        for section, entry in iter_coco_entries(json_path):
+            if section == "images":
+                if (new_name := rename_map.get(entry["file_name"])) is not None:
+                    entry = {**entry, "file_name": new_name}
+                else:
+                    nb_unmapped += 1
+            writer.write_entry(section, entry)
+    return nb_unmapped
 
 
 def main():
@@ -12,73 +166,94 @@ def main():
     parser.add_argument("data_path", type=Path, help="Path to the dataset")
     parser.add_argument("--labels_too", "-l", action="store_true", help="Puts any xml/jsons found in a 'label' folder")
     parser.add_argument("--move", "-m", action="store_true", help="Move files instead of copying them")
+    parser.add_argument("--link_mode", "--link-mode", choices=LINK_MODES, default="copy",
+                        help="How to put the files in the output folder when not moving them. hardlink, symlink and "
+                             "reflink avoid duplicating the data (hardlink and reflink fall back to a copy).")
+    parser.add_argument("--nb_threads", type=int, default=8, help="Number of threads used to copy/link the files.")
     parser.add_argument("--output_path", "-o", type=Path, default=None,
                         help="Path for the resulting json, defaults to data_path.parent / 'flattened_dataset'")
+    parser.add_argument("--annotations", "-a", type=Path, nargs="*", default=[],
+                        help="COCO annotation files (with file names relative to data_path) whose file names should "
+                             "be updated. The updated files are saved in the output folder.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the updated jsons without indentation (smaller, and faster to write and load).")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     data_path: Path = args.data_path
     labels_too: bool = args.labels_too
     move: bool = args.move
-    img_output_path: Path = args.output_path if args.output_path else args.data_path.parent / "flattened_dataset"
+    output_path: Path = args.output_path if args.output_path else args.data_path.parent / "flattened_dataset"
+    link_mode: TLinkMode = "move" if move else args.link_mode
+    nb_threads: int = args.nb_threads
+    annotations_paths: list[Path] = args.annotations
+    compact: bool = args.compact
 
-    moving_fn = shutil.move if move else shutil.copy  # Shortcut to avoid ifs later
+    start_profiling(args)
 
     # Output paths are a bit different if also moving the labels
     if labels_too:
-        labels_output_path = img_output_path / "labels"
+        labels_output_path = output_path / "labels"
         labels_output_path.mkdir(parents=True, exist_ok=True)
-        img_output_path = img_output_path / "imgs"
+        img_output_path = output_path / "imgs"
     else:
         labels_output_path = None
+        img_output_path = output_path
     img_output_path.mkdir(parents=True, exist_ok=True)
 
-    exts = (".png", ".jpg", ".bmp")
-    img_paths = [path for path in data_path.rglob("*") if path.suffix in exts]
-    nb_imgs = len(img_paths)
-    for i, img_path in enumerate(img_paths, start=1):
-        msg = f"Processing image: {img_path.name} ({i}/{nb_imgs})"
-        print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)), end="\r", flush=True)
-
-        file_output_path = img_output_path / img_path.name
-        xml_modified = False
-        xml_path: Path | None = None
-
-        # Check if xml exists (either next to the image or in an adjacent "labels" folder)
-        if labels_too:
-            if img_path.with_suffix(".xml").exists():
-                xml_path = img_path.with_suffix(".xml")
-            elif (img_path.parent.parent / "labels" / (img_path.stem + ".xml")).exists():
-                xml_path = img_path.parent.parent / "labels" / (img_path.stem + ".xml")
-
-        if file_output_path.exists():
-            # There is already an image and xml label file with that name. Rename and the move.
-            if xml_path is not None:
-                xml_modified = True
-                tree = ET.parse(xml_path)
-
-                while file_output_path.exists():
-                    file_output_path = file_output_path.with_stem(file_output_path.stem + f"_{random.randint(0, 1000)}")
-                    xml_path = xml_path.with_stem(file_output_path.stem)
-
-                root: ET.Element = tree.getroot()
-                root.find("filename").text = file_output_path.name  # type: ignore
-
-            # There is already an image with that name.
-            # But no xml (maybe a coco file somewhere else, but then it's already too late)
-            else:
-                print(f"\nFile {file_output_path} already exists. Skipping. "
-                      "You might want to look into that, as the coco file is probably 'wrong'.")
-                continue
-
-        moving_fn(img_path, file_output_path)
-        if labels_output_path is not None and xml_path:
-            if not xml_modified:
-                moving_fn(xml_path, labels_output_path / xml_path.name)
+    rename_map_path = output_path / "rename_map.json"
+    previous_names: dict[str, str] = {}
+    if rename_map_path.exists():
+        with open(rename_map_path, "r", encoding="utf-8") as rename_map_file:
+            previous_names = json.load(rename_map_file)
+
+    with stage("scan"):
+        img_paths, xml_paths = scan_dataset(data_path)
+        # The images put in the output folder by a previous run keep their name, the other files already there are
+        # collisions, like images with the same name in different folders.
+        existing_names = get_existing_outputs(img_paths, data_path, img_output_path, previous_names, by_stem=labels_too)
+        with os.scandir(img_output_path) as entries:
+            taken_names = {os.path.splitext(entry.name)[0] if labels_too else entry.name for entry in entries}
+    count("images_found", len(img_paths))
+    new_names = iter(get_output_names([img_path for img_path, name in zip(img_paths, existing_names) if name is None],
+                                      taken_names, by_stem=labels_too))
+    output_names = [name if name is not None else next(new_names) for name in existing_names]
+
+    path_pairs: list[tuple[Path, Path]] = []
+    xml_rewrites: list[tuple[Path, Path, str, bool]] = []
+    rename_map: dict[str, str] = {}
+    nb_renamed = 0
+    for img_path, output_name in zip(img_paths, output_names):
+        path_pairs.append((img_path, img_output_path / output_name))
+        rename_map[img_path.relative_to(data_path).as_posix()] = output_name
+        nb_renamed += output_name != img_path.name
+        if labels_output_path is not None and (xml_path := find_xml(img_path, xml_paths)) is not None:
+            xml_output_path = labels_output_path / (Path(output_name).stem + ".xml")
+            if output_name == img_path.name:
+                path_pairs.append((xml_path, xml_output_path))
             else:
-                with open(labels_output_path / xml_path.name, "wb") as f:
-                    tree.write(f)  # type: ignore
+                xml_rewrites.append((xml_path, xml_output_path, output_name, move))
+
+    clean_print(f"Found {len(img_paths)} images ({nb_renamed} renamed to avoid name collisions). "
+                f"Putting {len(path_pairs)} files in {output_path} ({link_mode})")
+    # The new names are free, so only the files already put there by a previous run can be skipped.
+    _, nb_skipped = materialize_files(path_pairs, mode=link_mode, nb_workers=nb_threads)
+    if nb_skipped:
+        print(f"Skipped {nb_skipped} files already in the output folder.")
+    with stage("rewrite_labels"), ThreadPoolExecutor(max_workers=max(1, nb_threads)) as executor:
+        list(executor.map(lambda rewrite: rewrite_xml(*rewrite), xml_rewrites))
+    count("labels_rewritten", len(xml_rewrites))
+
+    with open(rename_map_path, "w", encoding="utf-8") as rename_map_file:
+        json.dump(rename_map, rename_map_file, indent=4)
+    print(f"Saved the new name of each image to {rename_map_path}")
 
-    print("\nFinished!")
+    for json_path in annotations_paths:
+        with stage("transform"):
+            nb_unmapped = rename_coco_images(json_path, output_path / json_path.name, rename_map, compact=compact)
+        print(f"Updated the file names of {json_path} in {output_path / json_path.name}"
+              + (f" ({nb_unmapped} images not found in the dataset)" if nb_unmapped else ""))
+    print("Finished!")
 
 
 if __name__ == "__main__":
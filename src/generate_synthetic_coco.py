@@ -0,0 +1,104 @@
+"""Script to generate a synthetic COCO dataset, to test or benchmark the other scripts.
+
+The same arguments always give the same dataset.
+Run with: python -m src.generate_synthetic_coco <output folder> --nb_images 1000 --nb_annotations 10000 --write_images
+"""
+import argparse
+from pathlib import Path
+
+from src.utils.coco_json import CocoJsonWriter, iter_coco_entries
+from src.utils.misc import clean_print
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+from src.utils.synthetic_coco import (
+    check_config,
+    get_synthetic_categories,
+    get_synthetic_images,
+    iter_synthetic_annotations,
+    SyntheticConfig,
+    write_synthetic_images,
+    write_voc_annotations,
+)
+
+
+def parse_img_size(img_size: str) -> tuple[int, int]:
+    """Parse a "<width>x<height>" image size."""
+    try:
+        width, height = map(int, img_size.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid image size '{img_size}', expected <width>x<height>") from None
+    return width, height
+
+
+def main():
+    parser = argparse.ArgumentParser(description=("Generates a deterministic synthetic COCO dataset (random polygons, "
+                                                  "optionally stored as RLEs), and optionally tiny images for it."),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("output_path", type=Path,
+                        help="Folder where the annotations.json (and the images folder) will be saved.")
+    parser.add_argument("--nb_images", "--nb-images", type=int, default=1000, help="Number of images.")
+    parser.add_argument("--nb_annotations", "--nb-annotations", type=int, default=10000,
+                        help="Number of annotations, spread randomly over the images.")
+    parser.add_argument("--nb_categories", "--nb-categories", type=int, default=80, help="Number of categories.")
+    parser.add_argument("--img_sizes", "--img-sizes", type=parse_img_size, nargs="+", default=[(640, 480)],
+                        help="Sizes (<width>x<height>) of the images, each image gets one of them at random.")
+    parser.add_argument("--segmentation_mix", "--segmentation-mix", type=float, nargs=3, default=(1., 0., 0.),
+                        metavar=("POLYGON", "RLE", "ENCODED_RLE"),
+                        help="Relative frequencies of the segmentation types.")
+    parser.add_argument("--nb_vertices", "--nb-vertices", type=int, default=8,
+                        help="Number of vertices of the polygons.")
+    parser.add_argument("--image_extension", "--image-extension", choices=(".jpg", ".png"), default=".jpg",
+                        help="Extension (and format) of the images.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the dataset.")
+    parser.add_argument("--write_images", "--write-images", action="store_true",
+                        help="Also write the images (smooth random colors), in an 'images' folder. Use small image "
+                             "sizes to keep them tiny.")
+    parser.add_argument("--write_voc", "--write-voc", action="store_true",
+                        help="Also save the boxes as PascalVOC xml files, in a 'voc' folder.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    output_path: Path = args.output_path
+    config = SyntheticConfig(nb_images=args.nb_images,
+                             nb_annotations=args.nb_annotations,
+                             nb_categories=args.nb_categories,
+                             img_sizes=tuple(args.img_sizes),
+                             segmentation_mix=tuple(args.segmentation_mix),
+                             nb_vertices=args.nb_vertices,
+                             image_extension=args.image_extension,
+                             seed=args.seed)
+    write_images: bool = args.write_images
+    write_voc: bool = args.write_voc
+    compact: bool = args.compact
+
+    start_profiling(args)
+    try:
+        check_config(config)
+    except ValueError as error:
+        parser.error(str(error))
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    json_path = output_path / "annotations.json"
+    images = get_synthetic_images(config)
+    categories = get_synthetic_categories(config)
+    with stage("generate"), CocoJsonWriter(json_path, compact=compact) as writer:
+        writer.write_section("images", images)
+        writer.write_section("annotations", iter_synthetic_annotations(config, images))
+        writer.write_section("categories", categories)
+    clean_print(f"Saved {config.nb_images} images and {config.nb_annotations} annotations to {json_path}")
+
+    if write_images:
+        with stage("image_io"):
+            write_synthetic_images(images, output_path / "images", seed=config.seed)
+        count("images_encoded", len(images))
+        print(f"Wrote the images to {output_path / 'images'}")
+    if write_voc:
+        with stage("write_voc"):
+            annotations = [annotation for _, annotation in iter_coco_entries(json_path, sections=("annotations",))]
+            write_voc_annotations(images, annotations, categories, output_path / "voc")
+        print(f"Saved the PascalVOC annotations to {output_path / 'voc'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,191 @@
 import argparse
-import os
 import shutil
+from collections import Counter
 from multiprocessing import Pool
 from pathlib import Path
+from typing import Optional
 
 import cv2
 import numpy as np
+import numpy.typing as npt
 
+from src.utils.coco_json import iter_coco_entries
+from src.utils.file_transfer import atomic_output_path
+from src.utils.image_headers import ImageInfo, parse_image_header
+from src.utils.manifest import data_hash, encode_params, make_record, Manifest, ManifestRecord
+from src.utils.misc import get_nb_processes
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
 
-def worker(args: tuple[Path]):
+# What happened to each image.
+SINGLE_CHANNEL = "single channel"
+ALREADY_GRAY = "already gray"
+CONVERTED = "converted"
+UNREADABLE = "unreadable"
+
+
+def is_gray(img: npt.NDArray[np.generic], tolerance: int) -> bool:
+    """Check whether the channels of an image are all equal (up to the given tolerance)."""
+    if img.ndim == 2 or img.shape[2] == 1:
+        return True
+    blue, green, red = cv2.split(img)[:3]
+    return max(cv2.norm(blue, green, cv2.NORM_INF), cv2.norm(green, red, cv2.NORM_INF)) <= tolerance
+
+
+def get_imwrite_params(img_info: Optional[ImageInfo]) -> list[int]:
+    """Return the encoding parameters with which to save an image to keep its original settings."""
+    if img_info is not None and img_info.jpeg_quality is not None:
+        return [cv2.IMWRITE_JPEG_QUALITY, img_info.jpeg_quality]
+    if img_info is not None and img_info.png_compression is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, img_info.png_compression]
+    return []
+
+
+def worker(args: tuple[Path, str, int, bool, bool]) -> tuple[str, Optional[ManifestRecord]]:
     """Worker in charge of converting an image into a 3 channels grayscale.
 
+    The images that are single channel (according to their header) or whose channels are already equal are left as
+    they are. For JPEGs, the channels are compared on the image decoded at 1/8 of its resolution (each pixel is then
+    the average of a block), which is several times faster than a full decode, and the images to convert are decoded
+    directly in grayscale (without decoding the chroma).
+    The converted images are replaced atomically (an interrupted run never leaves a partially written image), keeping
+    their JPEG quality or PNG compression level and bit depth.
+
     Args:
-        args: Path of the image to process.
+        args: Tuple containing the following:
+              - img_path: path of the image to process
+              - params: the parameters of the operation, as recorded in the manifest
+              - tolerance: maximum difference between the channels of an image considered as already gray
+              - full_check: if True, confirm that the JPEGs that look gray at 1/8 of their resolution are gray at full
+                            resolution (small colored areas can be averaged out in the reduced image)
+              - dry_run: if True, only check what would be done
+
+    Returns:
+        What happened to the image (SINGLE_CHANNEL, ALREADY_GRAY, CONVERTED or UNREADABLE), and its manifest record
+        (None in dry run mode or if the image could not be read).
     """
-    img_path, = args
-    img = cv2.imread(str(img_path), cv2.IMREAD_GRAYSCALE)
-    img = np.expand_dims(img, -1)
-    img = np.concatenate((img, img, img), axis=-1)
-    cv2.imwrite(str(img_path), img)
+    img_path, params, tolerance, full_check, dry_run = args
+    img_stat = img_path.stat()
+    data = img_path.read_bytes()
+    img_info = parse_image_header(data)
+
+    if img_info is not None and img_info.nb_color_channels == 1:
+        status = SINGLE_CHANNEL
+    else:
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        reduced = img_info is not None and img_info.format == "jpeg"
+        img = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_COLOR_8 if reduced else cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH)
+        if img is None:
+            return UNREADABLE, None
+        if reduced and full_check and is_gray(img, tolerance):
+            img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            reduced = False
+        if is_gray(img, tolerance):
+            status = ALREADY_GRAY
+        else:
+            status = CONVERTED
+            if not dry_run:
+                gray_img = (cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE) if reduced
+                            else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+                with atomic_output_path(img_path) as tmp_path:
+                    if not cv2.imwrite(str(tmp_path), cv2.cvtColor(gray_img, cv2.COLOR_GRAY2BGR),
+                                       get_imwrite_params(img_info)):
+                        raise ValueError(f"Could not write image {img_path}")
+
+    if dry_run:
+        return status, None
+    return status, make_record(img_path, img_path, params, img_stat, data_hash(data))
 
 
 def main():
     parser = argparse.ArgumentParser(description=("Converts all images in a folder to grayscale (but still 3 channels)."
-                                                  " Note: the transformation is done in place."))
+                                                  " Note: the transformation is done in place."),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("dir_path", type=Path, help="Path to the folder with the images.")
+    images_filter = parser.add_mutually_exclusive_group()
+    images_filter.add_argument("--file_list", "--file-list", type=Path, default=None,
+                               help="Only process the images listed in this text file (one path relative to the "
+                                    "image folder per line).")
+    images_filter.add_argument("--annotations", type=Path, default=None,
+                               help="Only process the images referenced by this COCO annotations file.")
+    parser.add_argument("--tolerance", type=int, default=2,
+                        help="Images whose channels differ by at most this value are considered already gray.")
+    parser.add_argument("--full_check", "--full-check", action="store_true",
+                        help="Check the channels of the JPEGs at full resolution instead of 1/8 of it (slower, but "
+                             "does not miss small colored areas).")
+    parser.add_argument("--dry_run", "--dry-run", action="store_true",
+                        help="Only print how many images would be converted.")
+    parser.add_argument("--manifest_path", "--manifest-path", type=Path, default=None,
+                        help="Manifest recording the processed images, used to skip the images already converted. "
+                             "Defaults to .grayscale_manifest.sqlite in the image folder.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume an interrupted run: trust the manifest and skip the images it records as done, "
+                             "without checking the files.")
+    parser.add_argument("--force", action="store_true", help="Process all the images, even the already converted ones.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
-    exts = [".jpg", ".png"]
-    image_paths = [(p, ) for p in args.dir_path.rglob("*") if p.suffix in exts]
-    nb_imgs = len(image_paths)
+    dir_path: Path = args.dir_path
+    file_list_path: Optional[Path] = args.file_list
+    annotations_path: Optional[Path] = args.annotations
+    tolerance: int = args.tolerance
+    full_check: bool = args.full_check
+    dry_run: bool = args.dry_run
+    manifest_path: Path = (args.manifest_path if args.manifest_path is not None
+                           else dir_path / ".grayscale_manifest.sqlite")
+    resume: bool = args.resume
+    force: bool = args.force
+
+    start_profiling(args)
+    if file_list_path is not None:
+        file_names = [line.strip() for line in file_list_path.read_text().splitlines() if line.strip()]
+    elif annotations_path is not None:
+        file_names = [image["file_name"] for _, image in iter_coco_entries(annotations_path, sections=("images",))]
+    else:
+        file_names = None
+    if file_names is not None:
+        listed_paths = [dir_path / file_name for file_name in dict.fromkeys(file_names)]
+        image_paths = [p for p in listed_paths if p.is_file()]
+        if nb_missing := len(listed_paths) - len(image_paths):
+            print(f"Warning: {nb_missing} of the listed images were not found.")
+    else:
+        exts = [".jpg", ".png"]
+        # Hidden files are skipped, they could be temporary files left by a killed run.
+        image_paths = [p for p in dir_path.rglob("*") if p.suffix in exts and not p.name.startswith(".")]
+
+    params = encode_params({"operation": "grayscale", "tolerance": tolerance, "full_check": full_check})
+    statuses: Counter[str] = Counter()
+    manifest = Manifest(manifest_path) if not dry_run else None
+    try:
+        if manifest is not None and not force:
+            up_to_date = manifest.filter_up_to_date([(p, p) for p in image_paths], params, check_files=not resume)
+            nb_found = len(image_paths)
+            image_paths = [p for p, is_done in zip(image_paths, up_to_date) if not is_done]
+            if nb_skipped := nb_found - len(image_paths):
+                print(f"Skipping {nb_skipped} images that are already processed.")
+        nb_imgs = len(image_paths)
 
-    nb_images_processed = 0
-    nb_processes = int(cpu_count * 0.8) if (cpu_count := os.cpu_count() is not None) else 1
-    with Pool(processes=nb_processes) as pool:
-        for _result in pool.imap(worker, image_paths, chunksize=10):
-            nb_images_processed += 1
-            msg = f"Processing status: ({nb_images_processed}/{nb_imgs})"
-            print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)), end="\r", flush=True)
+        nb_images_processed = 0
+        mp_args = [(p, params, tolerance, full_check, dry_run) for p in image_paths]
+        with stage("image_io"), Pool(processes=get_nb_processes()) as pool:
+            for status, record in pool.imap(worker, mp_args, chunksize=10):
+                statuses[status] += 1
+                if manifest is not None and record is not None:
+                    manifest.add(record)
+                nb_images_processed += 1
+                msg = f"Processing status: ({nb_images_processed}/{nb_imgs})"
+                print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)),
+                      end="\r", flush=True)
+    finally:
+        if manifest is not None:
+            manifest.close()
 
-    msg = "Finished processing images."
+    count("images_processed", nb_images_processed)
+    count("images_converted", statuses[CONVERTED])
+    msg = "Finished checking images." if dry_run else "Finished processing images."
     print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)))
+    for status in (SINGLE_CHANNEL, ALREADY_GRAY, CONVERTED, UNREADABLE):
+        label = "to convert" if dry_run and status == CONVERTED else status
+        print(f"    {label}: {statuses[status]}")
 
 
 if __name__ == "__main__":
@@ -1,74 +1,162 @@
 import argparse
-import json
-import shutil
+from multiprocessing import Pool
 from pathlib import Path
 
 from src.types.coco_types import Annotation, Category, Image
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import save_coco_json
+from src.utils.file_transfer import LINK_MODES, materialize_files, TLinkMode
+from src.utils.misc import clean_print, get_nb_processes
+from src.utils.profiling import add_profiling_args, stage, start_profiling
+
+
+def load_dataset(annotation_path: Path) -> tuple[list[Image], list[Annotation], list[Category]]:
+    """Worker in charge of loading an annotations file.
+
+    Args:
+        annotation_path: Path to the COCO annotations file.
+
+    Returns:
+        The images, annotations and categories of the file.
+    """
+    dataset = CocoDataset.from_json(annotation_path)
+    return dataset.images, dataset.annotations, dataset.categories
+
+
+def reconcile_categories(merged_categories: list[Category],
+                         cat_ids_by_name: dict[str, int],
+                         categories: list[Category]) -> dict[int, int]:
+    """Add the categories of a dataset to the merged ones, matching them by name.
+
+    A new category keeps its id if it is still free, otherwise it gets the next free id.
+
+    Args:
+        merged_categories: The categories of the merged dataset, new categories will be appended to it.
+        cat_ids_by_name: Maps the names of the merged categories to their id, updated with the new categories.
+        categories: The categories of the dataset being merged.
+
+    Returns:
+        A conversion table that does old_id -> new_id for the categories of the dataset being merged.
+    """
+    cat_id_conversion_table: dict[int, int] = {}
+    for category in categories:
+        if category["name"] not in cat_ids_by_name:
+            used_ids = cat_ids_by_name.values()
+            new_cat_id = category["id"] if category["id"] not in used_ids else max(used_ids) + 1
+            merged_categories.append({**category, "id": new_cat_id})
+            cat_ids_by_name[category["name"]] = new_cat_id
+        cat_id_conversion_table[category["id"]] = cat_ids_by_name[category["name"]]
+    return cat_id_conversion_table
+
+
+def merge_annotations(merged_annotations: list[Annotation],
+                      annotations: list[Annotation],
+                      img_id_conversion_table: dict[int, int],
+                      cat_id_conversion_table: dict[int, int]) -> tuple[int, int]:
+    """Add the annotations of a dataset to the merged ones, with new ids and the new ids of their image and category.
+
+    The annotations whose image or category is not in the conversion tables (i.e. not declared in their file) are
+    dropped, as there is no way to know what they should refer to in the merged dataset.
+
+    Args:
+        merged_annotations: The annotations of the merged dataset, the new annotations will be appended to it.
+        annotations: The annotations of the dataset being merged (edited in place).
+        img_id_conversion_table: Table that does old_id -> new_id for the images of the dataset being merged.
+        cat_id_conversion_table: Table that does old_id -> new_id for the categories of the dataset being merged.
+
+    Returns:
+        The number of annotations dropped because of their image, and because of their category.
+    """
+    nb_orphan_annotations = nb_unknown_category = 0
+    for annotation in annotations:
+        if (new_img_id := img_id_conversion_table.get(annotation["image_id"])) is None:
+            nb_orphan_annotations += 1
+            continue
+        if (new_cat_id := cat_id_conversion_table.get(annotation["category_id"])) is None:
+            nb_unknown_category += 1
+            continue
+        annotation["image_id"] = new_img_id
+        annotation["category_id"] = new_cat_id
+        annotation["id"] = len(merged_annotations)
+        merged_annotations.append(annotation)
+    return nb_orphan_annotations, nb_unknown_category
 
 
 def main():
     parser = argparse.ArgumentParser(description=("Merges several coco label files into one."
                                                   "If also renaming the files, it is assumed the images are in an "
                                                   "'images' folder next to the annotations file. The images will "
-                                                  "be copied to the output dir"),
+                                                  "be copied to the output dir. Categories are matched by name."),
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("annotations_paths", nargs="+", type=Path, help="Paths to COCO annotations files to merge.")
     parser.add_argument("output_path", type=Path, help="Path for to where the merged dataset will be stored.")
     parser.add_argument("--change_names", "-c", action="store_true",
                         help="Change image names by prefixing the dataset name.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    parser.add_argument("--link_mode", "--link-mode", choices=LINK_MODES, default="copy",
+                        help="How to put the images in the output folder. hardlink, symlink and reflink avoid "
+                             "duplicating the data (hardlink and reflink fall back to a copy when not supported).")
+    parser.add_argument("--nb_threads", type=int, default=8, help="Number of threads used to copy/link the images.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     annotations_paths: list[Path] = args.annotations_paths
     change_names: bool = args.change_names
     output_path: Path = args.output_path
+    compact: bool = args.compact
+    link_mode: TLinkMode = args.link_mode
+    nb_threads: int = args.nb_threads
 
+    start_profiling(args)
+    for annotation_path in annotations_paths:
+        assert (annotation_path.parent / "images").exists(), f"No images found for annotations {annotation_path}"
     output_path.mkdir(parents=True, exist_ok=True)
     (output_img_path := output_path / "images").mkdir(parents=True, exist_ok=False)
 
     merged_images: list[Image] = []
     merged_annotations: list[Annotation] = []
     merged_categories: list[Category] = []
-    new_img_id = 0
-    new_annotation_id = 0
-    for i, annotation_path in enumerate(annotations_paths):
-        print(f"Processing file {annotation_path}")
-        with open(annotation_path, "r", encoding="utf-8") as annotations_file:
-            coco_dataset = json.load(annotations_file)
-        images: list[Image] = coco_dataset["images"]
-        annotations: list[Annotation] = coco_dataset["annotations"]
-        categories: list[Category] = coco_dataset["categories"]
-        nb_imgs = len(images)
-
-        assert (annotation_path.parent / "images").exists, f"No images found for annotations {annotation_path}"
-        for img_entry in images:
-            msg = f"Processing entry: {img_entry['file_name']} ({i}/{nb_imgs})"
-            print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)),
-                  end="\r" if i != nb_imgs else "\n", flush=True)
-
-            filename = img_entry["file_name"]
-            if change_names:
-                filename = f"{annotation_path.parent.name}_" + filename
-
-            shutil.copy(annotation_path.parent / "images" / img_entry["file_name"], output_img_path / filename)
-            img_entry["file_name"] = filename
-
-            # Update the annotation ids (so that they still link to the same image despite the id change)
-            img_annotations = [annotation for annotation in annotations
-                               if annotation["image_id"] == img_entry["id"]]
-            for annotation in img_annotations:
-                annotation["image_id"] = new_img_id
-                annotation["id"] = new_annotation_id
-                new_annotation_id += 1
-
-            img_entry["id"] = new_img_id
-            new_img_id += 1
-
-        merged_images.extend(images)
-        merged_annotations.extend(annotations)
-        if i == 0:
-            merged_categories = categories
-        else:
-            assert merged_categories == categories, "Categories should be the same in every annotations file."
+    cat_ids_by_name: dict[str, int] = {}
+    img_path_pairs: list[tuple[Path, Path]] = []
+    nb_files = len(annotations_paths)
+    # The files are parsed in parallel, and merged in order as soon as they are loaded.
+    with Pool(processes=min(get_nb_processes(), nb_files)) as pool:
+        loaded_datasets = pool.imap(load_dataset, annotations_paths)
+        for i, annotation_path in enumerate(annotations_paths, start=1):
+            with stage("load_json"):
+                images, annotations, categories = next(loaded_datasets)
+            clean_print(f"Merging file {annotation_path} ({i}/{nb_files})")
+
+            with stage("transform"):
+                cat_id_conversion_table = reconcile_categories(merged_categories, cat_ids_by_name, categories)
+                if any(old_id != new_id for old_id, new_id in cat_id_conversion_table.items()):
+                    print(f"Remapping the category ids of {annotation_path}: {cat_id_conversion_table}")
+
+                # Change the image ids, using a conversion table that does old_id -> new_id
+                img_id_conversion_table: dict[int, int] = {}
+                for img_entry in images:
+                    filename = img_entry["file_name"]
+                    if change_names:
+                        filename = f"{annotation_path.parent.name}_" + filename
+                    img_path_pairs.append((annotation_path.parent / "images" / img_entry["file_name"],
+                                           output_img_path / filename))
+                    img_entry["file_name"] = filename
+
+                    img_id_conversion_table[img_entry["id"]] = len(merged_images)
+                    img_entry["id"] = len(merged_images)
+                    merged_images.append(img_entry)
+
+                # Update the annotations (so that they still link to the same image despite the id change)
+                nb_orphan_annotations, nb_unknown_category = merge_annotations(merged_annotations, annotations,
+                                                                               img_id_conversion_table,
+                                                                               cat_id_conversion_table)
+                if nb_orphan_annotations:
+                    print(f"Dropped {nb_orphan_annotations} annotations of {annotation_path} whose image does not "
+                          "exist.")
+                if nb_unknown_category:
+                    print(f"Dropped {nb_unknown_category} annotations of {annotation_path} whose category is not "
+                          "declared in the file.")
 
     merged_dataset = {
         "images": merged_images,
@@ -76,11 +164,12 @@ def main():
         "categories": merged_categories
     }
 
-    with open(output_path / "annotations.json", "w", encoding="utf-8") as json_file:
-        json.dump(merged_dataset, json_file, indent=4)
+    save_coco_json(output_path / "annotations.json", merged_dataset, compact=compact)
 
-    msg = "Finished processing dataset."
-    print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)))
+    clean_print(f"Putting the {len(img_path_pairs)} images in {output_img_path} ({link_mode})")
+    materialize_files(img_path_pairs, mode=link_mode, nb_workers=nb_threads)
+
+    clean_print(f"Finished processing dataset ({len(merged_images)} images, {len(merged_annotations)} annotations).")
 
 
 if __name__ == "__main__":
@@ -1,12 +1,29 @@
 """Script to reindex the category indices in a coco annotation file.
 
 Run with: python -m src.reindex_class_indices <path to json file>
+Use the --streaming option for files that do not fit in memory.
 """
 import argparse
-import json
+from collections.abc import Iterable
 from pathlib import Path
 
-from src.types.coco_types import Annotation, Category, Image
+from src.types.coco_types import Category
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import CocoJsonWriter, iter_coco_entries, save_coco_json
+from src.utils.profiling import add_profiling_args, stage, start_profiling
+
+
+def get_id_conversion_dict(categories: Iterable[Category], start_idx: int) -> dict[int, int]:
+    """Create a conversion table that does old_id -> new_id.
+
+    Args:
+        categories: The categories of the dataset, in the order in which the new indices should be given.
+        start_idx: Where the new indices will start.
+
+    Returns:
+        The conversion table.
+    """
+    return {cat["id"]: i for i, cat in enumerate(categories, start=start_idx)}
 
 
 def main():
@@ -16,31 +33,51 @@ def main():
     parser.add_argument("--start_idx", "-s", type=int, default=0, help="Where the new indices will start.")
     parser.add_argument("--output_path", "-o", type=Path, default=None,
                         help="Path for to where the edited json file will be saved. Defaults to input file.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Process the entries one at a time instead of loading the whole file in memory.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     json_path: Path = args.json_path
     start_idx: int = args.start_idx
     output_path: Path = args.output_path if args.output_path is not None else json_path
+    streaming: bool = args.streaming
+    compact: bool = args.compact
+
+    start_profiling(args)
+    if streaming:
+        # First pass to get the categories, since they can be anywhere in the file. Second pass to edit the ids.
+        categories = (entry for _, entry in iter_coco_entries(json_path, sections=("categories",)))
+        id_conversion_dict = get_id_conversion_dict(categories, start_idx)
+        print(f"Changing the class indices using the following mapping: {id_conversion_dict}")
+        print(f"Streaming the edited json to {output_path}")
+        with stage("transform"), CocoJsonWriter(output_path, compact=compact) as writer:
+            for section, entry in iter_coco_entries(json_path):
+                if section == "categories":
+                    entry["id"] = id_conversion_dict[entry["id"]]
+                elif section == "annotations":
+                    entry["category_id"] = id_conversion_dict[entry["category_id"]]
+                writer.write_entry(section, entry)
+        print("Finished processing the dataset.")
+        return
 
     # Load the dataset
-    with open(json_path, encoding="utf-8") as annotations_file:
-        coco_dataset = json.load(annotations_file)
-    images: list[Image] = coco_dataset["images"]
-    annotations: list[Annotation] = coco_dataset["annotations"]
-    categories: list[Category] = coco_dataset["categories"]
+    dataset = CocoDataset.from_json(json_path)
+    images, annotations, categories = dataset.images, dataset.annotations, dataset.categories
 
     print(f"Found the following classes: {categories}")
 
-    # Create a conversion table that does old_id -> new_id
-    id_conversion_dict: dict[int, int] = {}
-    for i, cat in enumerate(categories, start=start_idx):
-        id_conversion_dict[cat["id"]] = i
-        categories[i]["id"] = i
+    id_conversion_dict = get_id_conversion_dict(categories, start_idx)
+    for cat in categories:
+        cat["id"] = id_conversion_dict[cat["id"]]
 
     print(f"Changing the class indices using the following mapping: {id_conversion_dict}")
 
-    for i, ann in enumerate(annotations):
-        annotations[i]["category_id"] = id_conversion_dict[ann["category_id"]]
+    with stage("transform"):
+        for i, ann in enumerate(annotations):
+            annotations[i]["category_id"] = id_conversion_dict[ann["category_id"]]
 
     # Save the altered annotations
     edited_dataset = {
@@ -52,8 +89,7 @@ def main():
     print(f"Saving the edited json to {output_path}")
     # import shutil
     # shutil.move(json_path, json_path.parent / "original_ids_annotations.json")
-    with open(output_path, "w", encoding="utf-8") as json_file:
-        json.dump(edited_dataset, json_file, indent=4)
+    save_coco_json(output_path, edited_dataset, compact=compact)
 
     print("Finished processing the dataset.")
 
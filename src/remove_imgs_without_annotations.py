@@ -3,12 +3,14 @@
 Use with 'python -m src.remove_imgs_without_annotations <path to json annotation file>'
 """
 import argparse
-import json
 from pathlib import Path
 from typing import Optional
 
-from src.types.coco_types import Annotation, Category, Image
+from src.types.coco_types import Image
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import save_coco_json
 from src.utils.misc import clean_print
+from src.utils.profiling import add_profiling_args, stage, start_profiling
 
 
 def main():
@@ -20,46 +22,47 @@ def main():
     parser.add_argument("--data_path", "-d", type=Path, default=None,
                         help=("Path to the directory with the images."
                               "If given, the images without annotations will be deleted."))
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     json_path: Path = args.json_path
     output_path: Path = args.output_path if args.output_path is not None else json_path
     data_path: Optional[Path] = args.data_path
+    compact: bool = args.compact
 
-    with open(json_path, "r", encoding="utf-8") as annotations_file:
-        coco_dataset = json.load(annotations_file)
-
-    images: list[Image] = coco_dataset["images"]
-    annotations: list[Annotation] = coco_dataset["annotations"]
-    categories: list[Category] = coco_dataset["categories"]
+    start_profiling(args)
+    dataset = CocoDataset.from_json(json_path)
+    images = dataset.images
 
     kept_images: list[Image] = []
     nb_imgs = len(images)
     nb_deleted_entries = 0
     print(f"Loaded a json file containing {nb_imgs} image entries. Filtering out the ones without annotation.")
-    for i, img_entry in enumerate(images, start=1):
-        clean_print(f"Processing entry: ({i+1}/{nb_imgs})", end="\r" if i+1 != nb_imgs else "\n")
+    with stage("transform"):
+        for i, img_entry in enumerate(images, start=1):
+            clean_print(f"Processing entry: ({i+1}/{nb_imgs})", end="\r" if i+1 != nb_imgs else "\n")
 
-        if len([ann for ann in annotations if ann["image_id"] == img_entry["id"]]) != 0:
-            kept_images.append(img_entry)
-        else:
-            print(f"\nRemoving the annotation entry for {img_entry['file_name']}.")
-            nb_deleted_entries += 1
-            if data_path is not None:
-                img_path = data_path / img_entry["file_name"]
-                print(f"Deleting the corresponding image: {img_path}.")
-                img_path.unlink()
+            if len(dataset.get_img_annotations(img_entry["id"])) != 0:
+                kept_images.append(img_entry)
+            else:
+                print(f"\nRemoving the annotation entry for {img_entry['file_name']}.")
+                nb_deleted_entries += 1
+                if data_path is not None:
+                    img_path = data_path / img_entry["file_name"]
+                    print(f"Deleting the corresponding image: {img_path}.")
+                    img_path.unlink()
 
     # Save the filtered annotations.
     edited_dataset = {
         "images": kept_images,
-        "annotations": annotations,
-        "categories": categories
+        "annotations": dataset.annotations,
+        "categories": dataset.categories
     }
 
     print(f"Saving the edited json to: '{output_path}'")
-    with open(output_path, "w", encoding="utf-8") as json_file:
-        json.dump(edited_dataset, json_file, indent=4)
+    save_coco_json(output_path, edited_dataset, compact=compact)
 
     print(f"Finished processing the dataset, remove {nb_deleted_entries} entries")
 
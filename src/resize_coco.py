@@ -1,78 +1,211 @@
 import argparse
-import json
-import os
 import shutil
+from collections.abc import Sequence
 from multiprocessing import Pool
 from pathlib import Path
+from typing import Any
 
 import cv2
 import numpy as np
+import numpy.typing as npt
 
-from src.types.coco_types import Annotation, Category, Image
+from src.types.coco_types import Annotation, Image
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import save_coco_json
+from src.utils.file_transfer import atomic_output_path, LINK_MODES, materialize_file, TLinkMode
+from src.utils.manifest import encode_params, file_hash, make_record, Manifest, ManifestRecord
+from src.utils.misc import get_nb_processes, paused_gc
+from src.utils.polygons import annotations_areas, flatten_polygons, scale_polygons, unflatten_polygons
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+from src.utils.segmentation_conversions import encoded_rles_to_rles, masks_to_rles, rles_to_encoded_rles, rles_to_masks
 
 
-def worker(args: tuple[Image, Path, Path, int, int]):
+JPEG_SUFFIXES = (".jpg", ".jpeg", ".jpe", ".jfif")
+# Reduced decoding flags, from the largest reduction factor to the smallest one.
+_REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                       (4, cv2.IMREAD_REDUCED_COLOR_4),
+                       (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def get_imread_flag(img_path: Path, width: int, height: int, new_width: int, new_height: int) -> int:
+    """Return the flag with which to read an image that will be resized.
+
+    JPEGs can be decoded directly at 1/2, 1/4 or 1/8 of their resolution (the scaling is done in the DCT domain), which
+    is much faster than decoding all the pixels. The largest reduction that still gives an image at least as big as
+    the target size is used, the final resize is then done on that smaller image.
+    For other formats OpenCV would decode the full image and then resize it with a lower quality interpolation, so the
+    full image is read.
+
+    Args:
+        img_path: Path to the image.
+        width: Width of the image.
+        height: Height of the image.
+        new_width: Width to which the image will be resized.
+        new_height: Height to which the image will be resized.
+
+    Returns:
+        The flag to give to cv2.imread.
+    """
+    if img_path.suffix.lower() in JPEG_SUFFIXES:
+        max_reduction = min(width / new_width, height / new_height)
+        for reduction, flag in _REDUCED_READ_FLAGS:
+            if max_reduction >= reduction:
+                return flag
+    return cv2.IMREAD_COLOR
+
+
+def get_imwrite_params(img_path: Path, jpeg_quality: int, png_compression: int) -> list[int]:
+    """Return the encoding parameters to use when saving the given image."""
+    suffix = img_path.suffix.lower()
+    if suffix in JPEG_SUFFIXES:
+        return [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+    if suffix == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    return []
+
+
+def worker(args: tuple[Image, Path, Path, int, int, TLinkMode, int, int, str]) -> ManifestRecord:
     """Worker in charge of resizing an image.
 
+    Images already at the target size are not decoded, they are linked or copied to the output folder.
+    Resized images are written atomically, an interrupted run never leaves a partially written image.
+
     Args:
         args: Tuple containing the following:
-              - image: the image to process
+              - image: the image to process (with its original size)
               - data_path: path to the image directory
               - output_path: path to the output directory
               - new_width: width to which resize the image
               - new_height: height to which resize the image
-    """
-    image, data_path, output_path, new_width, new_height = args
+              - link_mode: how to put the images that are already at the target size in the output folder
+              - jpeg_quality: quality with which to save JPEGs (0 to 100)
+              - png_compression: compression level with which to save PNGs (0 to 9)
+              - params: the parameters of the operation, as recorded in the manifest
 
-    img = cv2.imread(str(data_path / image["file_name"]))
-    resized_img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    Returns:
+        The manifest record of the processed image.
+    """
+    image, data_path, output_path, new_width, new_height, link_mode, jpeg_quality, png_compression, params = args
 
+    img_path = data_path / image["file_name"]
     out_img_path: Path = output_path / "images" / image["file_name"]
     out_img_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(out_img_path), resized_img)
+    img_stat = img_path.stat()
 
+    if (image["width"], image["height"]) == (new_width, new_height):
+        materialize_file(img_path, out_img_path, mode=link_mode)
+        return make_record(img_path, out_img_path, params, img_stat)
 
-def polygon_area(x: list[float], y: list[float]) -> float:
-    """Returns the area of a polygon.
+    img = cv2.imread(str(img_path), get_imread_flag(img_path, image["width"], image["height"], new_width, new_height))
+    if img is None:
+        raise ValueError(f"Could not read image {img_path}")
+    # Hash the input now that it is in the page cache, in case it gets modified while the output is written.
+    img_hash = file_hash(img_path)
+    resized_img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    with atomic_output_path(out_img_path) as tmp_path:
+        if not cv2.imwrite(str(tmp_path), resized_img, get_imwrite_params(out_img_path, jpeg_quality, png_compression)):
+            raise ValueError(f"Could not write image {out_img_path}")
+    return make_record(img_path, out_img_path, params, img_stat, img_hash)
 
-    Taken from: https://stackoverflow.com/questions/24467972/calculate-area-of-polygon-given-x-y-coordinates
 
-    Args:
-        x (list): List of with x coordinates of the vertices
-        y (list): List of with y coordinates of the vertices
+def nearest_indices(size: int, new_size: int) -> npt.NDArray[np.int64]:
+    """Return the source index of each pixel of an axis resized with a nearest neighbor interpolation.
 
-    Exemple:
-        If the polygon is defined by a list of [x1, y1, ...., x_n, y_n] coordinates, then split it like this:
-        x = [239.97, 222.04, 199.84, 213.5, 259.62, 274.13, 277.55, 249.37, 237.41, 242.54, 228.87]
-        y = [260.24, 270.49, 253.41, 227.79, 200.46, 202.17, 210.71, 253.41, 264.51, 261.95, 271.34]
+    The indices are computed like OpenCV does for cv2.INTER_NEAREST, to get the same results as cv2.resize.
 
-        then:
-            >>> PolyArea(x, y)
-            2765.1486500000005
+    Args:
+        size: The original size of the axis.
+        new_size: The size of the resized axis.
 
     Returns:
-        (float): The area of the polygon
+        The index in the original axis of each of the new_size pixels.
     """
-    return 0.5*np.abs(np.dot(x, np.roll(y, 1))-np.dot(y, np.roll(x, 1)))
+    return np.minimum(np.floor(np.arange(new_size) * (1 / (new_size / size))).astype(np.int64), size - 1)
+
 
+def resize_rles(rles: Sequence[npt.NDArray[np.uint32] | list[int]],
+                height: int,
+                width: int,
+                new_height: int,
+                new_width: int) -> list[list[int]]:
+    """Resize the masks of several RLEs (with the same size), using a nearest neighbor interpolation.
 
-def get_img_from_id(images: list[Image], img_id: int) -> Image:
-    """Returns the image with the given id.
+    The masks are decoded in batches and resized together by selecting the rows and columns of the pixels kept.
 
     Args:
-        images: A list of image entries.
-        img_id: The id of the image that should be returned.
+        rles: The RLEs to resize.
+        height: The height of the masks.
+        width: The width of the masks.
+        new_height: The height to which the masks will be resized.
+        new_width: The width to which the masks will be resized.
 
     Returns:
-        The image entry.
+        The RLEs of the resized masks.
+    """
+    rows, cols = nearest_indices(height, new_height), nearest_indices(width, new_width)
+    # Keep the memory usage of a batch reasonable (~64MB).
+    batch_size = max(1, 2**26 // max(1, height * width, new_height * new_width))
+    resized_rles: list[list[int]] = []
+    for batch_start in range(0, len(rles), batch_size):
+        masks = rles_to_masks(rles[batch_start:batch_start+batch_size], height, width)
+        # The masks are in column-major order, np.take keeps it (unlike chained fancy indexing) for masks_to_rles.
+        resized_masks = np.take(np.take(masks.transpose(0, 2, 1), cols, axis=1), rows, axis=2).transpose(0, 2, 1)
+        resized_rles.extend(masks_to_rles(resized_masks))
+    return resized_rles
+
+
+def resize_annotations(annotations: list[Annotation],
+                       scales: npt.NDArray[np.float64],
+                       new_width: int,
+                       new_height: int) -> list[Annotation]:
+    """Rescale the segmentations, areas and bounding boxes of annotations.
+
+    All the polygons of all the annotations are scaled at once, RLE and encoded RLE masks are resized by batches.
 
-    Raises:
-        ValueError is the given idea does not correspond to an image.
+    Args:
+        annotations: The annotations to resize.
+        scales: (N, 2) The x and y scale factors of each annotation (new size / original size of its image).
+        new_width: Width of the resized images.
+        new_height: Height of the resized images.
+
+    Returns:
+        The resized annotations (new dictionaries, the input ones are not modified).
     """
-    for image in images:
-        if image["id"] == img_id:
-            return image
-    raise ValueError(f"No image with id {img_id} is present in the dataset.")
+    with paused_gc():
+        areas = np.zeros(len(annotations), dtype=np.float64)
+        bboxes = np.asarray([annotation["bbox"] for annotation in annotations], dtype=np.float64).reshape(-1, 4)
+        bboxes *= np.tile(scales, 2)
+        segmentations: list[Any] = [None] * len(annotations)
+
+        polygon_idx = [i for i, annotation in enumerate(annotations) if isinstance(annotation["segmentation"], list)]
+        if polygon_idx:
+            flat_polygons = flatten_polygons([annotations[i]["segmentation"] for i in polygon_idx])  # type: ignore
+            flat_polygons = scale_polygons(flat_polygons, scales[polygon_idx])
+            areas[polygon_idx] = annotations_areas(flat_polygons)
+            for i, segmentation in zip(polygon_idx, unflatten_polygons(flat_polygons)):
+                segmentations[i] = segmentation
+
+        # Decode all the encoded RLEs at once, then resize the masks grouped by size.
+        rle_idx = [i for i, annotation in enumerate(annotations) if not isinstance(annotation["segmentation"], list)]
+        rles: dict[int, Any] = {i: annotations[i]["segmentation"]["counts"] for i in rle_idx}  # type: ignore
+        encoded_idx = {i for i in rle_idx if isinstance(rles[i], (str, bytes))}
+        rles.update(zip(encoded_idx, encoded_rles_to_rles([rles[i] for i in encoded_idx])))
+        idx_by_size: dict[tuple[int, int], list[int]] = {}
+        for i in rle_idx:
+            idx_by_size.setdefault(tuple(annotations[i]["segmentation"]["size"]), []).append(i)  # type: ignore
+        for (height, width), idx in idx_by_size.items():
+            resized_rles = dict(zip(idx, resize_rles([rles[i] for i in idx], height, width, new_height, new_width)))
+            group_encoded_idx = [i for i in idx if i in encoded_idx]
+            resized_encoded_rles = dict(zip(group_encoded_idx,
+                                            rles_to_encoded_rles([resized_rles[i] for i in group_encoded_idx])))
+            for i in idx:
+                areas[i] = sum(resized_rles[i][1::2])
+                segmentations[i] = {"size": [new_height, new_width],
+                                    "counts": resized_encoded_rles[i] if i in encoded_idx else resized_rles[i]}
+
+        return [{**annotation, "segmentation": segmentation, "area": area, "bbox": bbox}  # type: ignore
+                for annotation, segmentation, area, bbox in zip(annotations, segmentations, areas.tolist(),
+                                                                bboxes.tolist())]
 
 
 def main():
@@ -82,77 +215,87 @@ def main():
     parser.add_argument("annotations", type=Path, help="Path to COCO annotations file.")
     parser.add_argument("output_path", type=Path, help="Where to store the resized dataset.")
     parser.add_argument("size", nargs=2, type=int, help="Size to which the images will be resized.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    parser.add_argument("--jpeg_quality", "--jpeg-quality", type=int, default=95, choices=range(101), metavar="[0-100]",
+                        help="Quality of the saved JPEGs, lower values give smaller files.")
+    parser.add_argument("--png_compression", "--png-compression", type=int, default=1, choices=range(10),
+                        metavar="[0-9]", help="Compression level of the saved PNGs, higher values give smaller files "
+                                              "but take longer to encode.")
+    parser.add_argument("--link_mode", "--link-mode", choices=LINK_MODES, default="copy",
+                        help="How to put the images that are already at the target size in the output folder.")
+    parser.add_argument("--manifest_path", "--manifest-path", type=Path, default=None,
+                        help="Manifest recording the processed images, used to skip the images whose output is up to "
+                             "date. Defaults to manifest.sqlite in the output folder.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume an interrupted run: trust the manifest and skip the images it records as done "
+                             "with the same parameters, without checking the input and output files.")
+    parser.add_argument("--force", action="store_true", help="Process all the images, even the up to date ones.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     data_path: Path = args.data_path
     output_path: Path = args.output_path
     size: tuple[int, int] = args.size
+    compact: bool = args.compact
+    jpeg_quality: int = args.jpeg_quality
+    png_compression: int = args.png_compression
+    link_mode: TLinkMode = args.link_mode
+    manifest_path: Path = args.manifest_path if args.manifest_path is not None else output_path / "manifest.sqlite"
+    resume: bool = args.resume
+    force: bool = args.force
 
     new_width, new_height = size
+    start_profiling(args)
 
     # Load the dataset
-    with open(args.annotations, "r", encoding="utf-8") as annotations_file:
-        coco_dataset = json.load(annotations_file)
-    images: list[Image] = coco_dataset["images"]
-    annotations: list[Annotation] = coco_dataset["annotations"]
-    categories: list[Category] = coco_dataset["categories"]
-
-    resized_images: list[Image] = []
-    resized_annotations: list[Annotation] = []
-
-    for annotation in annotations:
-        image = get_img_from_id(images, annotation["image_id"])
-        width, height = image["width"], image["height"]
-
-        resized_image: Image = {
-            "id": image["id"],
-            "width": new_width,
-            "height": new_height,
-            "file_name": image["file_name"]
-        }
-        resized_images.append(resized_image)
-
-        width_ratio, height_ratio = width / new_width, height / new_height
-        if not isinstance(annotation["segmentation"], list):
-            raise TypeError("This script only supports polygon type segmentation.")
-        new_segmentation = [v / width_ratio if i % 2 == 0 else v / height_ratio
-                            for i, v in enumerate(annotation["segmentation"][0])]
-        new_area = polygon_area([v for i, v in enumerate(new_segmentation) if i % 2 == 0],
-                                [v for i, v in enumerate(new_segmentation) if i % 2 == 1])
-        new_bbox = [annotation["bbox"][0] / width_ratio,
-                    annotation["bbox"][1] / height_ratio,
-                    annotation["bbox"][2] / width_ratio,
-                    annotation["bbox"][3] / height_ratio]
-        annotation: Annotation = {
-            "id": annotation["id"],
-            "image_id": annotation["image_id"],
-            "category_id": annotation["category_id"],
-            "segmentation": [new_segmentation],
-            "area": new_area,
-            "bbox": new_bbox,
-            "iscrowd": annotation["iscrowd"]
-        }
-        resized_annotations.append(annotation)
-
-    nb_imgs = len(resized_images)
-    mp_args = [(image, data_path, output_path, new_width, new_height) for image in resized_images]
-    nb_images_processed = 0
-    nb_processes = int(cpu_count * 0.8) if (cpu_count := os.cpu_count() is not None) else 1
-    with Pool(processes=nb_processes) as pool:
-        for _ in pool.imap(worker, mp_args, chunksize=10):
-            nb_images_processed += 1
-            msg = f"Processing status: ({nb_images_processed}/{nb_imgs})"
-            print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)), end="\r", flush=True)
+    dataset = CocoDataset.from_json(args.annotations)
+
+    # Each image entry is resized once, including the images without annotations.
+    resized_images: list[Image] = [{**image, "width": new_width, "height": new_height} for image in dataset.images]
+    img_sizes = np.asarray([(image["width"], image["height"])
+                            for image in map(dataset.get_img, (annotation["image_id"]
+                                                               for annotation in dataset.annotations))],
+                           dtype=np.float64).reshape(-1, 2)
+    with stage("transform"):
+        resized_annotations = resize_annotations(dataset.annotations,
+                                                 np.asarray([new_width, new_height]) / img_sizes, new_width, new_height)
+    count("annotations_processed", len(resized_annotations))
+
+    params = encode_params({"operation": "resize", "width": new_width, "height": new_height, "link_mode": link_mode,
+                            "jpeg_quality": jpeg_quality, "png_compression": png_compression})
+    with Manifest(manifest_path) as manifest:
+        images_to_process = dataset.images
+        if not force:
+            up_to_date = manifest.filter_up_to_date([(data_path / image["file_name"],
+                                                      output_path / "images" / image["file_name"])
+                                                     for image in dataset.images], params, check_files=not resume)
+            images_to_process = [image for image, is_done in zip(dataset.images, up_to_date) if not is_done]
+            if nb_skipped := len(dataset.images) - len(images_to_process):
+                print(f"Skipping {nb_skipped} images that are already up to date.")
+
+        nb_imgs = len(images_to_process)
+        mp_args = [(image, data_path, output_path, new_width, new_height, link_mode, jpeg_quality, png_compression,
+                    params) for image in images_to_process]
+        nb_images_processed = 0
+        with stage("image_io"), Pool(processes=get_nb_processes()) as pool:
+            for record in pool.imap(worker, mp_args, chunksize=10):
+                manifest.add(record)
+                nb_images_processed += 1
+                msg = f"Processing status: ({nb_images_processed}/{nb_imgs})"
+                print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)),
+                      end="\r", flush=True)
+
+    count("images_processed", nb_images_processed)
 
     # Save the resized annotations
     resized_dataset = {
         "images": resized_images,
         "annotations": resized_annotations,
-        "categories": categories
+        "categories": dataset.categories
     }
     output_path.mkdir(parents=True, exist_ok=True)
-    with open(output_path / "annotations.json", "w", encoding="utf-8") as json_file:
-        json.dump(resized_dataset, json_file, indent=4)
+    save_coco_json(output_path / "annotations.json", resized_dataset, compact=compact)
 
     msg = "Finished resizing dataset."
     print(msg + " " * (shutil.get_terminal_size(fallback=(156, 38)).columns - len(msg)))
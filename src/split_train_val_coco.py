@@ -1,12 +1,38 @@
 import argparse
 import json
-import shutil
 from pathlib import Path
 from typing import Optional
 
 import numpy as np
 
-from src.types.coco_types import Annotation, Category, Image
+from src.types.coco_types import Annotation, Image
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import save_coco_json
+from src.utils.file_transfer import LINK_MODES, materialize_files, TLinkMode
+from src.utils.profiling import add_profiling_args, stage, start_profiling
+
+
+def get_split_units(images: list[Image], clusters: Optional[list[list[str]]] = None) -> list[list[int]]:
+    """Group the images that have to end up in the same split.
+
+    Args:
+        images: The image entries.
+        clusters: Lists of file names of images that should be in the same split (for example near duplicates).
+
+    Returns:
+        The indices of the images of each group, the images that are not in a cluster being alone in their group.
+    """
+    cluster_idx = {file_name: i for i, cluster in enumerate(clusters or []) for file_name in cluster}
+    units: list[list[int]] = []
+    unit_by_cluster: dict[int, list[int]] = {}
+    for i, image in enumerate(images):
+        if (cluster := cluster_idx.get(image["file_name"])) is None:
+            units.append([i])
+        elif cluster in unit_by_cluster:
+            unit_by_cluster[cluster].append(i)
+        else:
+            units.append(unit_by_cluster.setdefault(cluster, [i]))
+    return units
 
 
 def main():
@@ -18,6 +44,16 @@ def main():
     parser.add_argument("--spec_file", "-sf", type=Path, default=None,
                         help="Path to a text file that specifies which images to use for val (one name per line)")
     parser.add_argument("--split", "-s", type=float, default=0.85, help="Train split ratio")
+    parser.add_argument("--duplicate_clusters", "--duplicate-clusters", type=Path, default=None,
+                        help="Json with clusters of near duplicate images (see find_near_duplicates), the images of a "
+                             "cluster are all put in the same split.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    parser.add_argument("--link_mode", "--link-mode", choices=LINK_MODES, default="copy",
+                        help="How to put the images in the output folder. hardlink, symlink and reflink avoid "
+                             "duplicating the data (hardlink and reflink fall back to a copy when not supported).")
+    parser.add_argument("--nb_threads", type=int, default=8, help="Number of threads used to copy/link the images.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     data_path: Path = args.data_path
@@ -25,27 +61,44 @@ def main():
     output_path: Path = args.output_path
     spec_file_path: Optional[Path] = args.spec_file
     split: float = args.split
+    clusters_path: Optional[Path] = args.duplicate_clusters
+    compact: bool = args.compact
+    link_mode: TLinkMode = args.link_mode
+    nb_threads: int = args.nb_threads
+
+    start_profiling(args)
 
     # Load the dataset
-    with open(annotations_path, encoding="utf-8") as annotations_file:
-        coco_dataset = json.load(annotations_file)
-    images = np.asarray(coco_dataset["images"])
-    annotations: list[Annotation] = coco_dataset["annotations"]
-    categories: list[Category] = coco_dataset["categories"]
+    dataset = CocoDataset.from_json(annotations_path)
+    images = np.asarray(dataset.images)
+    annotations, categories = dataset.annotations, dataset.categories
+    clusters: Optional[list[list[str]]] = None
+    if clusters_path is not None:
+        with open(clusters_path, "r", encoding="utf-8") as clusters_file:
+            clusters = json.load(clusters_file)["clusters"]
 
     if spec_file_path is None:
         number_of_images = len(images)
-        indexes = np.arange(number_of_images)
-        np.random.shuffle(indexes)
-
-        # Split val / train
-        train_images: list[Image] = list(images[indexes[:int(number_of_images*split)]])
-        val_images: list[Image] = list(images[indexes[int(number_of_images*split):]])
+        units = get_split_units(dataset.images, clusters)
+        np.random.shuffle(units)  # type: ignore
+
+        # Split val / train, the groups of images are added to the training set until it is big enough.
+        nb_train_images = int(number_of_images*split)
+        train_indexes: list[int] = []
+        val_indexes: list[int] = []
+        for unit in units:
+            (train_indexes if len(train_indexes) < nb_train_images else val_indexes).extend(unit)
+        train_images: list[Image] = list(images[train_indexes])
+        val_images: list[Image] = list(images[val_indexes])
     else:
-        val_img_names = []
+        val_img_names: set[str] = set()
         with open(spec_file_path, "r", encoding="utf-8") as spec_file:
             for line in spec_file:
-                val_img_names.append(line.strip())
+                val_img_names.add(line.strip())
+        # The near duplicates of the validation images also go to the validation set.
+        for cluster in clusters or []:
+            if not val_img_names.isdisjoint(cluster):
+                val_img_names.update(cluster)
 
         train_images = []
         val_images = []
@@ -55,15 +108,16 @@ def main():
             else:
                 train_images.append(image)
 
-    train_image_ids = [image["id"] for image in train_images]
+    train_image_ids = {image["id"] for image in train_images}
     train_annotations: list[Annotation] = []
     val_annotations: list[Annotation] = []
 
-    for annotation in annotations:
-        if annotation["image_id"] in train_image_ids:
-            train_annotations.append(annotation)
-        else:
-            val_annotations.append(annotation)
+    with stage("transform"):
+        for annotation in annotations:
+            if annotation["image_id"] in train_image_ids:
+                train_annotations.append(annotation)
+            else:
+                val_annotations.append(annotation)
 
     # Save new training annotations
     train_dataset = {
@@ -73,8 +127,7 @@ def main():
     }
     train_output_path: Path = output_path / "train"
     train_output_path.mkdir(parents=True, exist_ok=True)
-    with open(train_output_path / "annotations.json", "w", encoding="utf-8") as json_file:
-        json.dump(train_dataset, json_file, indent=4)
+    save_coco_json(train_output_path / "annotations.json", train_dataset, compact=compact)
 
     # Save new validation annotations
     val_dataset = {
@@ -84,22 +137,17 @@ def main():
     }
     val_output_path: Path = output_path / "validation"
     val_output_path.mkdir(parents=True, exist_ok=True)
-    with open(val_output_path / "annotations.json", "w", encoding="utf-8") as json_file:
-        json.dump(val_dataset, json_file, indent=4)
+    save_coco_json(val_output_path / "annotations.json", val_dataset, compact=compact)
 
     print(f"Saved {len(train_images)} entries to {train_output_path} and {len(val_images)} to {val_output_path}")
 
     print("Now moving images. . .", end="\r")
-    for image in train_images:
-        in_img_path: Path = data_path / image["file_name"]
-        out_img_path: Path = train_output_path / "images"
-        out_img_path.mkdir(exist_ok=True)
-        shutil.copy(in_img_path, out_img_path)
-    for image in val_images:
-        in_img_path: Path = data_path / image["file_name"]
-        out_img_path: Path = val_output_path / "images"
-        out_img_path.mkdir(exist_ok=True)
-        shutil.copy(in_img_path, out_img_path)
+    subsets = ((train_images, train_output_path), (val_images, val_output_path))
+    img_path_pairs = [(data_path / image["file_name"], output_dir / "images" / Path(image["file_name"]).name)
+                      for images_subset, output_dir in subsets
+                      for image in images_subset]
+    nb_transferred, nb_skipped = materialize_files(img_path_pairs, mode=link_mode, nb_workers=nb_threads)
+    print(f"Put {nb_transferred} images in the output folders ({link_mode}), {nb_skipped} were already there.")
 
     print("Finished splitting dataset.")
 
@@ -1,9 +1,10 @@
 import argparse
-import json
-import shutil
 from pathlib import Path
 
-from src.types.coco_types import Annotation, Category, Image
+from src.utils.coco_dataset import CocoDataset
+from src.utils.coco_json import save_coco_json
+from src.utils.file_transfer import LINK_MODES, materialize_files, TLinkMode
+from src.utils.profiling import add_profiling_args, stage, start_profiling
 
 
 def main():
@@ -16,33 +17,42 @@ def main():
                         help="Where to store the new dataset, defaults to annotations_path/../smaller_dataset")
     parser.add_argument("--max_id", "-m", type=int, default=None, help="Images with id above max_id will be removed.")
     parser.add_argument("--keep_ids", "-k", nargs="+", type=int, default=None, help="Ids to be kept.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Save the json without indentation (smaller, and faster to write and load).")
+    parser.add_argument("--link_mode", "--link-mode", choices=LINK_MODES, default="copy",
+                        help="How to put the images in the output folder. hardlink, symlink and reflink avoid "
+                             "duplicating the data (hardlink and reflink fall back to a copy when not supported).")
+    parser.add_argument("--nb_threads", type=int, default=8, help="Number of threads used to copy/link the images.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     annotations_path: Path = args.annotations_path
     images_path: Path = args.images_folder_path if args.images_folder_path else annotations_path.parent / "images"
     output_path: Path = args.output_path if args.output_path else annotations_path.parent / "smaller_dataset"
     max_id: int | None = args.max_id
-    ids_to_keep: list[int] | None = args.keep_ids
+    ids_to_keep: set[int] | None = set(args.keep_ids) if args.keep_ids is not None else None
+    compact: bool = args.compact
+    link_mode: TLinkMode = args.link_mode
+    nb_threads: int = args.nb_threads
 
     assert max_id is not None or ids_to_keep is not None, "One of --max_id and --keep_ids must be used."
+    start_profiling(args)
 
     output_path.mkdir(parents=True, exist_ok=True)
 
     # Load the dataset
-    with open(annotations_path, encoding="utf-8") as annotations_file:
-        coco_dataset = json.load(annotations_file)
-    images: list[Image] = coco_dataset["images"]
-    annotations: list[Annotation] = coco_dataset["annotations"]
-    categories: list[Category] = coco_dataset["categories"]
+    dataset = CocoDataset.from_json(annotations_path)
+    images, annotations, categories = dataset.images, dataset.annotations, dataset.categories
 
-    new_annotations = [annotation
-                       for annotation in annotations
-                       if (max_id is not None and annotation["image_id"] < max_id)
-                       or (ids_to_keep is not None and annotation["image_id"] in ids_to_keep)]
-    new_images = [image
-                  for image in images
-                  if (max_id is not None and image["id"] < max_id)
-                  or (ids_to_keep is not None and image["id"] in ids_to_keep)]
+    with stage("transform"):
+        new_annotations = [annotation
+                           for annotation in annotations
+                           if (max_id is not None and annotation["image_id"] < max_id)
+                           or (ids_to_keep is not None and annotation["image_id"] in ids_to_keep)]
+        new_images = [image
+                      for image in images
+                      if (max_id is not None and image["id"] < max_id)
+                      or (ids_to_keep is not None and image["id"] in ids_to_keep)]
 
     # Save new newing annotations
     new_dataset = {
@@ -50,17 +60,15 @@ def main():
         "annotations": new_annotations,
         "categories": categories
     }
-    with open(output_path / "annotations.json", "w", encoding="utf-8") as json_file:
-        json.dump(new_dataset, json_file, indent=4)
+    save_coco_json(output_path / "annotations.json", new_dataset, compact=compact)
 
     print(f"Saved {len(new_images)} entries to {output_path}")
 
     print("Now copying images. . .", end="\r")
-    for image in new_images:
-        in_img_path: Path = images_path / image["file_name"]
-        out_img_path: Path = output_path / "images"
-        out_img_path.mkdir(exist_ok=True)
-        shutil.copy(in_img_path, out_img_path)
+    img_path_pairs = [(images_path / image["file_name"], output_path / "images" / Path(image["file_name"]).name)
+                      for image in new_images]
+    nb_transferred, nb_skipped = materialize_files(img_path_pairs, mode=link_mode, nb_workers=nb_threads)
+    print(f"Put {nb_transferred} images in the output folder ({link_mode}), {nb_skipped} were already there.")
 
     print("Finished trimming dataset.")
 
@@ -0,0 +1,178 @@
+"""Columnar binary cache of the numerical fields of a COCO annotations file.
+
+The cache is a directory of .npy files stored next to the json file (`annotations.json` -> `annotations.json.cache`).
+The arrays are memory-mapped when loaded, so opening the cache takes a few milliseconds and uses almost no memory,
+which makes it suitable for work that only needs ids, image sizes, categories or bounding boxes.
+The cache is rebuilt automatically when the size or modification time of the json file changes.
+"""
+import json
+import os
+import shutil
+from array import array
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+from src.utils.coco_json import iter_coco_entries
+
+CACHE_VERSION = 1
+_META_FILE_NAME = "meta.json"
+_COLUMN_NAMES = ("img_ids", "img_widths", "img_heights", "img_ann_offsets", "ann_ids", "ann_img_ids",
+                 "ann_category_ids", "ann_areas", "ann_iscrowd", "ann_bboxes", "ann_positions")
+
+
+class CocoColumns:
+    """Numerical fields of a COCO dataset, stored as one array per field.
+
+    The annotation arrays are grouped by image (in the order of the images in the json file), the annotations of the
+    image at row `i` are the ones in `img_ann_offsets[i]:img_ann_offsets[i+1]`.
+    Annotations whose image is not in the dataset are stored after `img_ann_offsets[-1]`.
+
+    Attributes:
+        img_ids: (N_imgs,) Ids of the images.
+        img_widths: (N_imgs,) Widths of the images.
+        img_heights: (N_imgs,) Heights of the images.
+        img_ann_offsets: (N_imgs+1,) Offsets of the annotations of each image in the annotation arrays.
+        ann_ids: (N_anns,) Ids of the annotations.
+        ann_img_ids: (N_anns,) Image id of each annotation.
+        ann_category_ids: (N_anns,) Category id of each annotation.
+        ann_areas: (N_anns,) Area of each annotation.
+        ann_iscrowd: (N_anns,) Iscrowd flag of each annotation.
+        ann_bboxes: (N_anns, 4) Bounding box of each annotation, in the COCO format (top left x, top left y, w, h).
+        ann_positions: (N_anns,) Position of each annotation in the "annotations" list of the json file.
+    """
+
+    img_ids: npt.NDArray[np.int64]
+    img_widths: npt.NDArray[np.int32]
+    img_heights: npt.NDArray[np.int32]
+    img_ann_offsets: npt.NDArray[np.int64]
+    ann_ids: npt.NDArray[np.int64]
+    ann_img_ids: npt.NDArray[np.int64]
+    ann_category_ids: npt.NDArray[np.int64]
+    ann_areas: npt.NDArray[np.float64]
+    ann_iscrowd: npt.NDArray[np.uint8]
+    ann_bboxes: npt.NDArray[np.float64]
+    ann_positions: npt.NDArray[np.int64]
+
+    def __init__(self, arrays: dict[str, npt.NDArray[np.generic]]):
+        for name in _COLUMN_NAMES:
+            setattr(self, name, arrays[name])
+
+    def get_img_slice(self, img_row: int) -> slice:
+        """Return the slice of the annotation arrays corresponding to the image at the given row."""
+        return slice(int(self.img_ann_offsets[img_row]), int(self.img_ann_offsets[img_row+1]))
+
+
+def get_cache_path(json_path: Path) -> Path:
+    """Return the path of the cache directory for the given annotations file."""
+    return json_path.with_name(json_path.name + ".cache")
+
+
+def _get_source_meta(json_path: Path) -> dict[str, int]:
+    stat = json_path.stat()
+    return {"version": CACHE_VERSION, "source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _to_int_id(entry_id: int | str, entry_type: str) -> int:
+    if not isinstance(entry_id, int):
+        raise ValueError(f"The cache only supports int ids, got {entry_id!r} for an {entry_type}. "
+                         "Use the coco_ids_to_int script to convert the ids first.")
+    return entry_id
+
+
+def build_coco_cache(json_path: Path) -> Path:
+    """Build (or rebuild) the cache of a COCO annotations file.
+
+    The json file is streamed, only the numerical fields are held in memory.
+
+    Args:
+        json_path: Path to the json file with the coco annotations.
+
+    Returns:
+        The path to the cache directory.
+    """
+    source_meta = _get_source_meta(json_path)
+    img_ids, img_widths, img_heights = array("q"), array("l"), array("l")
+    ann_ids, ann_img_ids, ann_category_ids = array("q"), array("q"), array("q")
+    ann_areas, ann_iscrowd, ann_bboxes = array("d"), array("B"), array("d")
+    for section, entry in iter_coco_entries(json_path, sections=("images", "annotations")):
+        if section == "images":
+            img_ids.append(_to_int_id(entry["id"], "image"))
+            img_widths.append(entry["width"])
+            img_heights.append(entry["height"])
+        else:
+            ann_ids.append(_to_int_id(entry["id"], "annotation"))
+            ann_img_ids.append(_to_int_id(entry["image_id"], "annotation's image"))
+            ann_category_ids.append(entry["category_id"])
+            ann_areas.append(entry.get("area", 0))
+            ann_iscrowd.append(entry.get("iscrowd", 0))
+            ann_bboxes.extend(entry["bbox"] if "bbox" in entry else (0, 0, 0, 0))
+
+    img_ids_array = np.frombuffer(img_ids, dtype=np.int64)
+    ann_img_ids_array = np.frombuffer(ann_img_ids, dtype=np.int64)
+
+    # Find the row of the image of each annotation, annotations without a valid image go at the end.
+    nb_imgs = len(img_ids_array)
+    ann_img_rows = np.full(len(ann_img_ids_array), nb_imgs, dtype=np.int64)
+    if nb_imgs:
+        sorter = np.argsort(img_ids_array, kind="stable")
+        insertion_idx = np.searchsorted(img_ids_array, ann_img_ids_array, sorter=sorter)
+        candidate_rows = sorter[np.minimum(insertion_idx, nb_imgs - 1)]
+        is_valid = img_ids_array[candidate_rows] == ann_img_ids_array
+        ann_img_rows[is_valid] = candidate_rows[is_valid]
+    ann_order = np.argsort(ann_img_rows, kind="stable")
+    img_ann_offsets = np.concatenate(([0], np.cumsum(np.bincount(ann_img_rows, minlength=nb_imgs + 1)[:nb_imgs])))
+
+    arrays: dict[str, npt.NDArray[np.generic]] = {
+        "img_ids": img_ids_array,
+        "img_widths": np.asarray(img_widths, dtype=np.int32),
+        "img_heights": np.asarray(img_heights, dtype=np.int32),
+        "img_ann_offsets": img_ann_offsets.astype(np.int64),
+        "ann_ids": np.frombuffer(ann_ids, dtype=np.int64)[ann_order],
+        "ann_img_ids": ann_img_ids_array[ann_order],
+        "ann_category_ids": np.frombuffer(ann_category_ids, dtype=np.int64)[ann_order],
+        "ann_areas": np.frombuffer(ann_areas, dtype=np.float64)[ann_order],
+        "ann_iscrowd": np.frombuffer(ann_iscrowd, dtype=np.uint8)[ann_order],
+        "ann_bboxes": np.frombuffer(ann_bboxes, dtype=np.float64).reshape(-1, 4)[ann_order],
+        "ann_positions": ann_order.astype(np.int64),
+    }
+
+    # Write the cache in a temporary directory first, so that an incomplete cache is never used.
+    cache_path = get_cache_path(json_path)
+    tmp_cache_path = cache_path.with_name(cache_path.name + ".tmp")
+    shutil.rmtree(tmp_cache_path, ignore_errors=True)
+    tmp_cache_path.mkdir(parents=True)
+    for name, values in arrays.items():
+        np.save(tmp_cache_path / f"{name}.npy", values)
+    with open(tmp_cache_path / _META_FILE_NAME, "w", encoding="utf-8") as meta_file:
+        json.dump(source_meta, meta_file)
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(tmp_cache_path, cache_path)
+    return cache_path
+
+
+def is_cache_valid(json_path: Path) -> bool:
+    """Check whether the cache of the given annotations file exists and is up to date."""
+    meta_path = get_cache_path(json_path) / _META_FILE_NAME
+    if not meta_path.exists():
+        return False
+    with open(meta_path, "r", encoding="utf-8") as meta_file:
+        return json.load(meta_file) == _get_source_meta(json_path)
+
+
+def load_coco_columns(json_path: Path, rebuild: bool = False) -> CocoColumns:
+    """Load the numerical fields of a COCO annotations file from its cache, (re)building the cache if needed.
+
+    Args:
+        json_path: Path to the json file with the coco annotations.
+        rebuild: If True, rebuild the cache even if it is up to date.
+
+    Returns:
+        The memory-mapped (read only) columns.
+    """
+    if rebuild or not is_cache_valid(json_path):
+        build_coco_cache(json_path)
+    cache_path = get_cache_path(json_path)
+    return CocoColumns({name: np.load(cache_path / f"{name}.npy", mmap_mode="r")
+                        for name in _COLUMN_NAMES})
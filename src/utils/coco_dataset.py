@@ -0,0 +1,112 @@
+import json
+import os
+from functools import cached_property
+from pathlib import Path
+
+from src.types.coco_types import Annotation, Category, Image
+from src.utils.profiling import count, stage
+
+
+class CocoDataset:
+    """COCO dataset held in memory, with hash indexes to access its entries in constant time.
+
+    The indexes are built the first time they are used, in a single pass over the entries.
+    They are not updated if the lists of entries are modified afterwards.
+    """
+
+    def __init__(self, images: list[Image], annotations: list[Annotation], categories: list[Category]):
+        """Create the dataset from its lists of entries.
+
+        Args:
+            images: The image entries.
+            annotations: The annotation entries.
+            categories: The category entries.
+        """
+        self.images = images
+        self.annotations = annotations
+        self.categories = categories
+
+    @classmethod
+    def from_json(cls, json_path: Path) -> "CocoDataset":
+        """Load a dataset from a COCO annotations file.
+
+        Args:
+            json_path: Path to the json file with the coco annotations.
+
+        Returns:
+            The loaded dataset.
+        """
+        with stage("load_json"), open(json_path, "r", encoding="utf-8") as annotations_file:
+            coco_dataset = json.load(annotations_file)
+        count("bytes_read", os.path.getsize(json_path))
+        count("images_loaded", len(coco_dataset["images"]))
+        count("annotations_loaded", len(coco_dataset["annotations"]))
+        return cls(coco_dataset["images"], coco_dataset["annotations"], coco_dataset["categories"])
+
+    def to_dict(self) -> dict[str, list[Image] | list[Annotation] | list[Category]]:
+        """Return the dataset in the COCO format, ready to be saved as json."""
+        return {
+            "images": self.images,
+            "annotations": self.annotations,
+            "categories": self.categories
+        }
+
+    @cached_property
+    def imgs_by_id(self) -> dict[int, Image]:
+        """Index mapping an image id to its image entry."""
+        with stage("index"):
+            return {img_entry["id"]: img_entry for img_entry in self.images}
+
+    @cached_property
+    def imgs_by_file_name(self) -> dict[str, Image]:
+        """Index mapping a file name to its image entry."""
+        with stage("index"):
+            return {img_entry["file_name"]: img_entry for img_entry in self.images}
+
+    @cached_property
+    def anns_by_img_id(self) -> dict[int, list[Annotation]]:
+        """Index mapping an image id to the list of its annotations (images without annotation are not present)."""
+        anns_by_img_id: dict[int, list[Annotation]] = {}
+        with stage("index"):
+            for annotation in self.annotations:
+                anns_by_img_id.setdefault(annotation["image_id"], []).append(annotation)
+        return anns_by_img_id
+
+    @cached_property
+    def cats_by_id(self) -> dict[int, Category]:
+        """Index mapping a category id to its category entry."""
+        return {category["id"]: category for category in self.categories}
+
+    def get_img(self, img_id: int) -> Image:
+        """Returns the image with the given id.
+
+        Raises:
+            ValueError: If the given id does not correspond to an image.
+        """
+        if (img_entry := self.imgs_by_id.get(img_id)) is None:
+            raise ValueError(f"No image with id {img_id} is present in the dataset.")
+        return img_entry
+
+    def get_img_by_name(self, file_name: str) -> Image:
+        """Returns the image with the given file name.
+
+        Raises:
+            ValueError: If the given name does not correspond to an image.
+        """
+        if (img_entry := self.imgs_by_file_name.get(file_name)) is None:
+            raise ValueError(f"No image with file name {file_name} is present in the dataset.")
+        return img_entry
+
+    def get_img_annotations(self, img_id: int) -> list[Annotation]:
+        """Returns the annotations of the image with the given id (an empty list if it has none)."""
+        return self.anns_by_img_id.get(img_id, [])
+
+    def get_category(self, cat_id: int) -> Category:
+        """Returns the category with the given id.
+
+        Raises:
+            ValueError: If the given id does not correspond to a category.
+        """
+        if (category := self.cats_by_id.get(cat_id)) is None:
+            raise ValueError(f"There is no class with the id {cat_id}")
+        return category
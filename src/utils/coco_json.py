@@ -0,0 +1,279 @@
+"""Incremental reading and writing of COCO annotations files.
+
+Those allow processing files that do not fit in memory, by handling the entries one at a time.
+"""
+import json
+import os
+import re
+from collections.abc import Iterable, Iterator, Mapping
+from pathlib import Path
+from types import TracebackType
+from typing import Any, BinaryIO, Optional, TextIO
+
+import numpy as np
+
+from src.utils.profiling import count, stage
+
+try:
+    import orjson  # type: ignore
+except ModuleNotFoundError:
+    orjson = None
+
+COCO_SECTIONS = ("images", "annotations", "categories")
+_WHITESPACE_PATTERN = re.compile(r"[ \t\n\r]*")
+_SEPARATOR_PATTERN = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+
+
+class _JsonStreamReader:
+    """Reads JSON values from a text file, keeping only the part of the file currently being parsed in memory."""
+
+    def __init__(self, text_file: TextIO, chunk_size: int):
+        self.text_file = text_file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read_more(self, min_size: int = 0) -> None:
+        """Drop the already parsed part of the buffer and append the next part of the file to it."""
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.text_file.read(max(self.chunk_size, min_size))
+        self.eof = len(chunk) == 0
+        self.buffer += chunk
+
+    def peek(self) -> str:
+        """Skip the whitespaces and return the next character without consuming it ("" at the end of the file)."""
+        while True:
+            self.pos = _WHITESPACE_PATTERN.match(self.buffer, self.pos).end()  # type: ignore
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos+1]
+            self._read_more()
+
+    def expect(self, expected_chars: str) -> str:
+        """Consume the next character, which has to be one of the expected ones."""
+        if (char := self.peek()) == "" or char not in expected_chars:
+            raise ValueError(f"Invalid JSON, expected one of '{expected_chars}' but got '{char}' (near: "
+                             f"{self.buffer[self.pos:self.pos+50]!r}).")
+        self.pos += 1
+        return char
+
+    def decode_value(self) -> Any:
+        """Decode and consume the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer might continue in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow the buffer geometrically so that large values are not parsed too many times.
+            self._read_more(min_size=len(self.buffer) - self.pos)
+
+    def iter_array(self) -> Iterator[Any]:
+        """Decode the next value, which must be an array, one element at a time."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        scan_once = self.decoder.scan_once  # What raw_decode uses, without its wrapper (errors are StopIteration).
+        match_separator = _SEPARATOR_PATTERN.match
+        while True:
+            # Fast path, when the element and the separator after it are already in the buffer.
+            try:
+                value, end = scan_once(self.buffer, self.pos)
+                separator = match_separator(self.buffer, end)
+            except (StopIteration, json.JSONDecodeError):
+                separator = None
+            if separator is not None:
+                self.pos = separator.end()
+                yield value
+                if separator.group(1) == "]":
+                    return
+                continue
+
+            yield self.decode_value()
+            if self.expect(",]") == "]":
+                return
+
+
+def iter_coco_entries(json_path: Path,
+                      sections: Iterable[str] = COCO_SECTIONS,
+                      chunk_size: int = 2**20) -> Iterator[tuple[str, Any]]:
+    """Iterate over the entries of a COCO annotations file without loading the whole file.
+
+    Only the entry being parsed (and a chunk of the file) are held in memory, so the memory usage does not depend on
+    the size of the file. The other top level values (like "info" or "licenses") are skipped.
+
+    Args:
+        json_path: Path to the json file with the coco annotations.
+        sections: The top level lists whose entries should be returned, the other ones are skipped.
+        chunk_size: Number of characters read from the file at once.
+
+    Yields:
+        Tuples with the name of the section ("images", "annotations" or "categories") and an entry of that section,
+        in the order in which they appear in the file.
+    """
+    sections = set(sections)
+    count("bytes_read", os.path.getsize(json_path))
+    with open(json_path, "r", encoding="utf-8") as json_file:
+        reader = _JsonStreamReader(json_file, chunk_size)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.decode_value()
+            reader.expect(":")
+            if reader.peek() == "[":
+                for entry in reader.iter_array():
+                    if key in sections:
+                        yield key, entry
+            else:
+                reader.decode_value()
+            if reader.expect(",}") == "}":
+                return
+
+
+def _to_builtin(obj: Any) -> Any:
+    """Convert the numpy objects that the json module cannot serialize."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class CocoJsonWriter:
+    """Writes a COCO annotations file one entry at a time.
+
+    Entries are serialized one by one and written to the disk in chunks. NumPy scalars and arrays can be used directly
+    in the entries. In compact mode, orjson is used for the serialization if it is installed.
+    The pretty output is identical to the one from `json.dump(coco_dataset, json_file, indent=4)`.
+
+    The file is first written next to the output path and only moved there once complete. This makes it possible to
+    stream entries from a file into the same file, and avoids leaving a half written file behind after a crash.
+
+    Usage:
+        with CocoJsonWriter(output_path) as writer:
+            for section, entry in iter_coco_entries(json_path):
+                writer.write_entry(section, entry)
+    """
+
+    def __init__(self, output_path: Path, compact: bool = False, chunk_size: int = 2**20):
+        """Prepare the writer, the file is created when entering the context.
+
+        Args:
+            output_path: Path to where the annotations file will be saved.
+            compact: If True, write the json without any whitespace. Otherwise indent it with 4 spaces.
+            chunk_size: Number of bytes to accumulate before writing them to the file.
+        """
+        self.output_path = output_path
+        self.compact = compact
+        self.chunk_size = chunk_size
+        self.tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+        self.json_file: Optional[BinaryIO] = None
+        self.chunk: list[bytes] = []
+        self.chunk_len = 0
+        self.current_section: Optional[str] = None
+        self.written_sections: set[str] = set()
+        self.is_first_entry = True
+
+        if compact:
+            self.entry_separator, self.section_start, self.section_end = b",", b":[", b"]"
+        else:
+            self.entry_separator, self.section_start, self.section_end = b",\n        ", b": [\n        ", b"\n    ]"
+
+    def _serialize(self, entry: Any) -> bytes:
+        if self.compact:
+            if orjson is not None:
+                return orjson.dumps(entry, default=_to_builtin, option=orjson.OPT_SERIALIZE_NUMPY)
+            return json.dumps(entry, default=_to_builtin, separators=(",", ":")).encode()
+        return json.dumps(entry, default=_to_builtin, indent=4).replace("\n", "\n        ").encode()
+
+    def _write(self, data: bytes) -> None:
+        self.chunk.append(data)
+        self.chunk_len += len(data)
+        if self.chunk_len >= self.chunk_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        self.json_file.write(b"".join(self.chunk))  # type: ignore
+        self.chunk, self.chunk_len = [], 0
+
+    def __enter__(self) -> "CocoJsonWriter":
+        self.json_file = open(self.tmp_path, "wb")
+        self._write(b"{")
+        return self
+
+    def _start_section(self, section: str) -> None:
+        if section in self.written_sections:
+            raise ValueError(f"The entries of the '{section}' section must be written contiguously.")
+        self._end_section()
+        if self.written_sections:
+            self._write(b"," if self.compact else b",\n    ")
+        elif not self.compact:
+            self._write(b"\n    ")
+        self._write(json.dumps(section).encode())
+        self.written_sections.add(section)
+        self.current_section = section
+        self.is_first_entry = True
+
+    def _end_section(self) -> None:
+        if self.current_section is not None:
+            if self.is_first_entry:
+                self._write(b":[]" if self.compact else b": []")
+            else:
+                self._write(self.section_end)
+            self.current_section = None
+
+    def write_entry(self, section: str, entry: Any) -> None:
+        """Write an entry at the end of the given section (the sections have to be written one after the other)."""
+        if section != self.current_section:
+            self._start_section(section)
+        self._write(self.section_start if self.is_first_entry else self.entry_separator)
+        self._write(self._serialize(entry))
+        self.is_first_entry = False
+
+    def write_section(self, section: str, entries: Iterable[Any]) -> None:
+        """Write all the entries of a section."""
+        self._start_section(section)
+        for entry in entries:
+            self.write_entry(section, entry)
+
+    def __exit__(self,
+                 exc_type: Optional[type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        assert self.json_file is not None
+        if exc_type is None:
+            # Always write the three COCO sections, even if some were empty.
+            for section in COCO_SECTIONS:
+                if section not in self.written_sections:
+                    self._start_section(section)
+            self._end_section()
+            self._write(b"}" if self.compact or not self.written_sections else b"\n}")
+            self._flush()
+            count("bytes_written", self.json_file.tell())
+        self.json_file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.output_path)
+        else:
+            self.tmp_path.unlink()
+
+
+def save_coco_json(output_path: Path, coco_dataset: Mapping[str, Iterable[Any]], compact: bool = False) -> None:
+    """Save a COCO dataset to a json file.
+
+    Args:
+        output_path: Path to where the annotations file will be saved.
+        coco_dataset: Dictionary with the lists of entries of each section ("images", "annotations", "categories").
+        compact: If True, write the json without any whitespace. Otherwise indent it with 4 spaces.
+    """
+    with stage("write_json"), CocoJsonWriter(output_path, compact=compact) as writer:
+        for section, entries in coco_dataset.items():
+            writer.write_section(section, entries)
@@ -0,0 +1,155 @@
+"""Functions to materialize files (images) in an output directory, by copying or linking them."""
+import errno
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Literal
+
+from src.utils.profiling import count, stage
+
+try:
+    import fcntl
+except ModuleNotFoundError:  # Windows
+    fcntl = None
+
+TLinkMode = Literal["copy", "hardlink", "symlink", "reflink", "move"]
+LINK_MODES = ("copy", "hardlink", "symlink", "reflink")
+FICLONE = 0x40049409  # ioctl request to share the data blocks of a file (Linux, on btrfs, xfs, etc)
+# Errors meaning that a link / in-kernel copy is not possible between the two paths (and that a copy should be used).
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS,
+                       errno.EMLINK, errno.EBADF}
+
+
+def is_up_to_date(src_path: Path, dst_path: Path) -> bool:
+    """Check whether the destination file exists and has the same size and modification time as the source."""
+    try:
+        src_stat, dst_stat = src_path.stat(), dst_path.stat()
+    except FileNotFoundError:
+        return False
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+@contextmanager
+def atomic_output_path(dst_path: Path) -> Iterator[Path]:
+    """Give a temporary path to write a file to, and move it to the destination once written.
+
+    The temporary file is in the same directory (and has the same extension, to keep the format of encoders that rely
+    on it), so that the final rename is atomic: the destination either keeps its previous content or has the complete
+    new one, even if the process is killed while writing.
+
+    Args:
+        dst_path: The path of the file to write.
+
+    Yields:
+        The temporary path to which the file should be written.
+    """
+    tmp_path = dst_path.with_name(f".{dst_path.stem}.{os.getpid()}.tmp{dst_path.suffix}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, dst_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _reflink(src_path: Path, dst_path: Path) -> None:
+    """Copy a file, sharing its data blocks if the filesystem supports it.
+
+    Tries a FICLONE ioctl (copy on write clone), then copy_file_range (in kernel copy, server side copy on NFS),
+    then falls back to a regular copy.
+    """
+    with open(src_path, "rb") as src_file, open(dst_path, "wb") as dst_file:
+        try:
+            if fcntl is None:
+                raise OSError(errno.ENOSYS, "No ioctl support")
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError as clone_error:
+            if clone_error.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            try:
+                remaining = os.fstat(src_file.fileno()).st_size
+                while remaining > 0:
+                    if (copied := os.copy_file_range(src_file.fileno(), dst_file.fileno(), remaining)) == 0:
+                        break
+                    remaining -= copied
+            except (OSError, AttributeError) as copy_error:
+                if isinstance(copy_error, OSError) and copy_error.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                src_file.seek(0)
+                dst_file.seek(0)
+                dst_file.truncate()
+                shutil.copyfileobj(src_file, dst_file)
+    shutil.copystat(src_path, dst_path)
+
+
+def materialize_file(src_path: Path, dst_path: Path, mode: TLinkMode = "copy", skip_existing: bool = True) -> bool:
+    """Make the source file available at the destination path.
+
+    Args:
+        src_path: Path of the file to materialize.
+        dst_path: Where the file should be made available. Its parent directory must exist.
+        mode: How to materialize the file:
+                - copy: regular copy (keeping the modification time).
+                - hardlink: hard link to the source, falls back to a copy if not possible (different filesystems).
+                - symlink: symbolic link to the (absolute) source path.
+                - reflink: copy on write clone if supported by the filesystem, falls back to a copy otherwise.
+                - move: move the file.
+        skip_existing: If True, do nothing if the destination already exists with the same size and modification time.
+
+    Returns:
+        False if the file was skipped, True otherwise.
+    """
+    if skip_existing and mode != "move" and is_up_to_date(src_path, dst_path):
+        return False
+    if dst_path.is_symlink() or (mode in ("hardlink", "symlink") and dst_path.exists()):
+        dst_path.unlink()
+
+    if mode == "copy":
+        shutil.copy2(src_path, dst_path)
+    elif mode == "hardlink":
+        try:
+            os.link(src_path, dst_path)
+        except OSError as error:
+            if error.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            shutil.copy2(src_path, dst_path)
+    elif mode == "symlink":
+        os.symlink(src_path.resolve(), dst_path)
+    elif mode == "reflink":
+        _reflink(src_path, dst_path)
+    elif mode == "move":
+        shutil.move(src_path, dst_path)
+    else:
+        raise ValueError(f"Unknown mode {mode}, expected one of {LINK_MODES}")
+    return True
+
+
+def materialize_files(path_pairs: Iterable[tuple[Path, Path]],
+                      mode: TLinkMode = "copy",
+                      nb_workers: int = 8,
+                      skip_existing: bool = True) -> tuple[int, int]:
+    """Materialize several files in parallel (see `materialize_file`).
+
+    The output directories are created beforehand, and the files are transferred by a bounded pool of threads.
+
+    Args:
+        path_pairs: Tuples with the path of a file and where it should be made available.
+        mode: How to materialize the files (copy, hardlink, symlink, reflink or move).
+        nb_workers: Number of threads doing the transfers.
+        skip_existing: If True, skip the files already present at the destination with the same size and mtime.
+
+    Returns:
+        The number of transferred files and the number of skipped files.
+    """
+    path_pairs = list(path_pairs)
+    for dst_dir in {dst_path.parent for _, dst_path in path_pairs}:
+        dst_dir.mkdir(parents=True, exist_ok=True)
+
+    with stage("image_io"), ThreadPoolExecutor(max_workers=max(1, nb_workers)) as executor:
+        results = list(executor.map(lambda pair: materialize_file(*pair, mode=mode, skip_existing=skip_existing),
+                                    path_pairs))
+    nb_transferred = sum(results)
+    count("files_transferred", nb_transferred)
+    return nb_transferred, len(results) - nb_transferred
@@ -0,0 +1,122 @@
+"""Read the number of channels and the encoding settings of JPEG and PNG images from their headers."""
+import struct
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+# Luminance quantization table of the JPEG standard (Annex K), which libjpeg scales according to the quality.
+_STD_LUMINANCE_TABLE = np.asarray((16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+                                   14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+                                   18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+                                   49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99),
+                                  dtype=np.int64)
+# Start of frame markers (baseline, progressive, lossless, etc), the ones not listed are DHT, JPG and DAC.
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Number of color channels (ignoring the alpha one) for each PNG color type. Palette images are considered as color.
+_PNG_COLOR_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 1, 6: 3}
+# zlib compression level (as given by the FLEVEL field of the zlib header) to PNG compression level.
+_ZLIB_FLEVEL_TO_COMPRESSION = (1, 3, 6, 9)
+
+
+class ImageInfo(NamedTuple):
+    """Information on an image read from its header."""
+
+    format: str
+    nb_color_channels: int
+    bit_depth: int
+    jpeg_quality: Optional[int] = None
+    png_compression: Optional[int] = None
+
+
+def estimate_jpeg_quality(luminance_table: np.ndarray) -> int:
+    """Estimate the quality with which a JPEG was saved from its luminance quantization table.
+
+    libjpeg (used by most encoders, including OpenCV and PIL) scales the standard table by 5000 / quality for
+    qualities below 50 and by 200 - 2 * quality above (with the values clipped to [1, 255]). The quality whose table
+    has the closest sum is returned (the sums do not depend on the order in which the values are stored).
+
+    Args:
+        luminance_table: The 64 values of the luminance quantization table.
+
+    Returns:
+        The estimated quality (from 1 to 100).
+    """
+    qualities = np.arange(100, 0, -1)  # Decreasing, to return the highest quality in case of a tie.
+    scales = np.where(qualities < 50, 5000 // qualities, 200 - 2 * qualities)
+    table_sums = np.clip((_STD_LUMINANCE_TABLE[None] * scales[:, None] + 50) // 100, 1, 255).sum(axis=1)
+    return int(qualities[np.argmin(np.abs(table_sums - np.sum(luminance_table, dtype=np.int64)))])
+
+
+def parse_jpeg_header(data: bytes) -> Optional[ImageInfo]:
+    """Read the number of components and the quality of a JPEG from its markers (up to the start of scan)."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    luminance_table: Optional[np.ndarray] = None
+    sof: Optional[tuple[int, int]] = None
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Fill byte.
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # Markers without a payload.
+            pos += 2
+            continue
+        if marker == 0xDA:  # Start of scan, the image data follows.
+            break
+        length, = struct.unpack_from(">H", data, pos + 2)
+        segment = data[pos + 4:pos + 2 + length]
+        if marker == 0xDB:
+            i = 0
+            while i < len(segment):
+                precision, table_idx = segment[i] >> 4, segment[i] & 0x0F
+                table_size = 64 * (precision + 1)
+                if table_idx == 0:
+                    luminance_table = np.frombuffer(segment[i + 1:i + 1 + table_size],
+                                                    dtype=">u2" if precision else np.uint8)
+                i += 1 + table_size
+        elif marker in _SOF_MARKERS and len(segment) >= 6:
+            sof = segment[0], segment[5]
+        pos += 2 + length
+
+    if sof is None:
+        return None
+    bit_depth, nb_components = sof
+    quality = estimate_jpeg_quality(luminance_table) if luminance_table is not None else None
+    return ImageInfo("jpeg", 1 if nb_components == 1 else 3, bit_depth, jpeg_quality=quality)
+
+
+def parse_png_header(data: bytes) -> Optional[ImageInfo]:
+    """Read the color type, bit depth and compression level of a PNG from its IHDR chunk and its first IDAT chunk."""
+    if data[:8] != _PNG_SIGNATURE or data[12:16] != b"IHDR" or len(data) < 26:
+        return None
+    bit_depth, color_type = data[24], data[25]
+    compression: Optional[int] = None
+    pos = 8
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack_from(">I4s", data, pos)
+        if chunk_type == b"IDAT":
+            if pos + 10 <= len(data):
+                compression = _ZLIB_FLEVEL_TO_COMPRESSION[data[pos + 9] >> 6]
+            break
+        pos += 12 + length
+    return ImageInfo("png", _PNG_COLOR_CHANNELS.get(color_type, 3), bit_depth, png_compression=compression)
+
+
+def parse_image_header(data: bytes) -> Optional[ImageInfo]:
+    """Read the information of a JPEG or PNG image from (the beginning of) its content.
+
+    Args:
+        data: The content of the image file.
+
+    Returns:
+        The information on the image, or None if it is not a (valid) JPEG or PNG.
+    """
+    if data[:2] == b"\xff\xd8":
+        return parse_jpeg_header(data)
+    if data[:8] == _PNG_SIGNATURE:
+        return parse_png_header(data)
+    return None
@@ -5,16 +5,23 @@ import numpy as np
 import numpy.typing as npt
 
 
-def show_img(img: npt.NDArray[np.uint8], window_name: str = "Image", is_bgr: bool = True) -> None:
+def show_img(img: npt.NDArray[np.uint8],
+             window_name: str = "Image",
+             is_bgr: bool = True,
+             exit_keys: str = "q") -> str:
     """Display the given image.
 
-    If a display (monitor) is detected, then display the image on the screen until the user presses the "q" key.
-    Otherwise try to display the image to the terminal.
+    If a display (monitor) is detected, then display the image on the screen until the user presses one of the exit
+    keys ("q" by default). Otherwise try to display the image to the terminal.
 
     Args:
         img: The image that is to be displayed.
         window_name: The name of the window in which the image will be displayed.
         is_bgr: Should be True if the image format is BGR, False otherwise.
+        exit_keys: The keys that close the window.
+
+    Returns:
+        The key that closed the window (the first exit key when the image is displayed in the terminal).
     """
     if "DISPLAY" in os.environ:  # TODO: check if that works on Windows too.
         while True:
@@ -28,9 +35,9 @@ def show_img(img: npt.NDArray[np.uint8], window_name: str = "Image", is_bgr: boo
 
             cv2.imshow(window_name, img)
             key = cv2.waitKey(10)
-            if key == ord("q"):
+            if key != -1 and chr(key & 0xFF) in exit_keys:
                 cv2.destroyAllWindows()
-                break
+                return chr(key & 0xFF)
     else:
         try:
             from PIL import Image
@@ -45,3 +52,4 @@ def show_img(img: npt.NDArray[np.uint8], window_name: str = "Image", is_bgr: boo
                 show_img.warning_printed = True
                 print("Consider installing the term_image and Pillow packages to display images in the terminal.")
                 print("You can do that using:\n\tpip install term_image Pillow")
+    return exit_keys[0]
@@ -0,0 +1,186 @@
+"""Manifest of the files processed by the image rewriting tools, to skip the up to date outputs when running again.
+
+For each processed file, the manifest records the input path, size, modification time and content hash, the
+parameters of the operation, and the output path, size and modification time. It is stored in a sqlite database, the
+records being written by batches.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from collections.abc import Iterable, Mapping, Sequence
+from pathlib import Path
+from types import TracebackType
+from typing import Any, NamedTuple, Optional
+
+# Maximum number of parameters of a sqlite query.
+_QUERY_BATCH_SIZE = 500
+
+
+class ManifestRecord(NamedTuple):
+    """What the manifest knows about a processed file."""
+
+    input_path: str
+    input_size: int
+    input_mtime_ns: int
+    input_hash: str
+    params: str
+    output_path: str
+    output_size: int
+    output_mtime_ns: int
+
+
+def data_hash(data: bytes) -> str:
+    """Return the hash of some content, the same as `file_hash` would give for a file with that content."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_hash(path: Path, chunk_size: int = 2**20) -> str:
+    """Return the (blake2b, 128 bits) hash of the content of a file."""
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def encode_params(params: Mapping[str, Any]) -> str:
+    """Return the canonical representation of the parameters of an operation."""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+def make_record(input_path: Path,
+                output_path: Path,
+                params: str,
+                input_stat: os.stat_result,
+                input_hash: Optional[str] = None) -> ManifestRecord:
+    """Create the record of a processed file, once its output has been written.
+
+    Args:
+        input_path: Path of the input file.
+        output_path: Path of the output file.
+        params: The parameters of the operation (see `encode_params`).
+        input_stat: The stat of the input file, taken before processing it (since the output might replace it).
+        input_hash: The hash of the content of the input file. Computed from the input file if not given.
+
+    Returns:
+        The record.
+    """
+    if input_hash is None:
+        input_hash = file_hash(input_path)
+    output_stat = output_path.stat()
+    return ManifestRecord(os.path.abspath(input_path), input_stat.st_size, input_stat.st_mtime_ns, input_hash, params,
+                          os.path.abspath(output_path), output_stat.st_size, output_stat.st_mtime_ns)
+
+
+class Manifest:
+    """Manifest of processed files, stored in a sqlite database."""
+
+    def __init__(self, db_path: Path, batch_size: int = 1000):
+        """Open (or create) the manifest.
+
+        Args:
+            db_path: Path to the sqlite database.
+            batch_size: Number of records written to the database in each transaction.
+        """
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self._pending_records: list[ManifestRecord] = []
+        self._connection = sqlite3.connect(db_path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS records ("
+                                 "input_path TEXT PRIMARY KEY, input_size INTEGER, input_mtime_ns INTEGER, "
+                                 "input_hash TEXT, params TEXT, output_path TEXT, output_size INTEGER, "
+                                 "output_mtime_ns INTEGER) WITHOUT ROWID")
+        self._connection.commit()
+
+    def get_records(self, input_paths: Iterable[Path]) -> dict[str, ManifestRecord]:
+        """Return the records of the given input files (the ones without a record are not in the returned dict).
+
+        Args:
+            input_paths: The paths of the input files.
+
+        Returns:
+            The records, indexed by absolute input path.
+        """
+        self.flush()
+        abs_paths = [os.path.abspath(path) for path in input_paths]
+        records: dict[str, ManifestRecord] = {}
+        for batch_start in range(0, len(abs_paths), _QUERY_BATCH_SIZE):
+            batch = abs_paths[batch_start:batch_start+_QUERY_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            cursor = self._connection.execute(f"SELECT * FROM records WHERE input_path IN ({placeholders})", batch)
+            records.update((row[0], ManifestRecord(*row)) for row in cursor)
+        return records
+
+    def filter_up_to_date(self,
+                          path_pairs: Sequence[tuple[Path, Path]],
+                          params: str,
+                          check_files: bool = True) -> list[bool]:
+        """Check which outputs are up to date, i.e. were produced from the current input with the same parameters.
+
+        Args:
+            path_pairs: The (input path, output path) of the files to check.
+            params: The parameters of the operation (see `encode_params`).
+            check_files: If False, trust the manifest: any file recorded with the same parameters and output path is
+                         up to date (no filesystem access, to quickly resume an interrupted job). Otherwise the output
+                         must still be the recorded one, and the input must have the recorded size and modification
+                         time or content (not checked when processing files inplace).
+
+        Returns:
+            For each pair, whether its output is up to date.
+        """
+        records = self.get_records(input_path for input_path, _ in path_pairs)
+        up_to_date: list[bool] = []
+        for input_path, output_path in path_pairs:
+            record = records.get(os.path.abspath(input_path))
+            if record is None or record.params != params or record.output_path != os.path.abspath(output_path):
+                up_to_date.append(False)
+                continue
+            if not check_files:
+                up_to_date.append(True)
+                continue
+            try:
+                output_stat = output_path.stat()
+                if (output_stat.st_size, output_stat.st_mtime_ns) != (record.output_size, record.output_mtime_ns):
+                    up_to_date.append(False)
+                    continue
+                input_stat = input_path.stat()
+            except FileNotFoundError:
+                up_to_date.append(False)
+                continue
+            up_to_date.append(record.input_path == record.output_path
+                              or (input_stat.st_size, input_stat.st_mtime_ns) == (record.input_size,
+                                                                                  record.input_mtime_ns)
+                              or (input_stat.st_size == record.input_size
+                                  and file_hash(input_path) == record.input_hash))
+        return up_to_date
+
+    def add(self, record: ManifestRecord) -> None:
+        """Add (or replace) the record of a processed file. The records are written by batches."""
+        self._pending_records.append(record)
+        if len(self._pending_records) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the pending records to the database."""
+        if self._pending_records:
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                             self._pending_records)
+            self._pending_records = []
+
+    def close(self) -> None:
+        """Write the pending records and close the database."""
+        self.flush()
+        self._connection.close()
+
+    def __enter__(self) -> "Manifest":
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.close()
@@ -1,3 +1,7 @@
+import gc
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
 from shutil import get_terminal_size
 
 
@@ -11,3 +15,32 @@ def clean_print(msg: str, fallback: tuple[int, int] = (156, 38), end: str = "\n"
         end (str): What to add at the end of the print. Usually '\n' (new line), or '\r' (back to the start of the line)
     """
     print(msg + " " * (get_terminal_size(fallback=fallback).columns - len(msg)), end=end, flush=True)
+
+
+def get_nb_processes(ratio: float = 0.8) -> int:
+    """Return the number of processes to use for a multiprocessing pool.
+
+    Args:
+        ratio: The fraction of the cpu cores to use.
+
+    Returns:
+        The number of processes (at least 1).
+    """
+    cpu_count = os.cpu_count()
+    return max(1, int(cpu_count * ratio)) if cpu_count is not None else 1
+
+
+@contextmanager
+def paused_gc() -> Iterator[None]:
+    """Disable the garbage collector while creating a large number of python objects.
+
+    The cyclic garbage collector gets triggered over and over when creating millions of lists/dicts (for example
+    when converting numpy arrays back to json entries), which can make that step several times slower.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
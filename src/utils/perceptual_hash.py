@@ -0,0 +1,146 @@
+"""Perceptual hashes of images, and search of the hashes within a small Hamming distance of each other."""
+from collections.abc import Iterator, Sequence
+from typing import Literal
+
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+THashType = Literal["dhash", "phash"]
+HASH_TYPES = ("dhash", "phash")
+# Side of the image from which the pHash is computed, images are decoded at the lowest resolution above it.
+PHASH_IMG_SIZE = 32
+# Maximum number of candidate pairs checked at once by the neighbor search.
+MAX_CANDIDATES_PER_CHUNK = 2**22
+_BITS = 2 ** np.arange(63, -1, -1, dtype=np.uint64)
+_BYTE_POPCOUNTS = np.asarray([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _pack_bits(bits: npt.NDArray[np.bool_]) -> int:
+    """Pack 64 booleans into an int, the first one being the most significant bit."""
+    return int(np.sum(_BITS[bits.ravel()], dtype=np.uint64))
+
+
+def dhash(gray_img: npt.NDArray[np.uint8]) -> int:
+    """Difference hash: whether each pixel is brighter than its right neighbor, on a 9x8 version of the image."""
+    small_img = cv2.resize(gray_img, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _pack_bits(small_img[:, 1:] > small_img[:, :-1])
+
+
+def phash(gray_img: npt.NDArray[np.uint8]) -> int:
+    """DCT hash: whether each of the 8x8 lowest frequencies of a 32x32 version of the image is above their median."""
+    small_img = cv2.resize(gray_img, (PHASH_IMG_SIZE, PHASH_IMG_SIZE), interpolation=cv2.INTER_AREA)
+    low_frequencies = cv2.dct(small_img.astype(np.float32))[:8, :8]
+    # The DC coefficient (mean brightness) is excluded from the median, it is much larger than the other ones.
+    return _pack_bits(low_frequencies > np.median(low_frequencies.ravel()[1:]))
+
+
+def popcount(values: npt.NDArray[np.uint64]) -> npt.NDArray[np.uint8]:
+    """Number of bits set in each value."""
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNTS[np.ascontiguousarray(values).view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def _iter_group_pairs(group_keys: npt.NDArray[np.uint64],
+                      max_candidates: int) -> Iterator[tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]]:
+    """Yield all the pairs (i, j), i < j, of elements with the same key, in chunks of at most ~max_candidates pairs."""
+    order = np.argsort(group_keys, kind="stable")
+    sorted_keys = group_keys[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    group_ends = np.r_[group_starts[1:], len(sorted_keys)]
+    # Number of pairs in which each element (in sorted order) is the first one.
+    group_end_per_elt = np.repeat(group_ends, group_ends - group_starts)
+    nb_pairs = group_end_per_elt - np.arange(len(sorted_keys)) - 1
+    cum_pairs = np.cumsum(nb_pairs)
+    chunk_start = 0
+    while chunk_start < len(sorted_keys):
+        chunk_end = max(chunk_start + 1, int(np.searchsorted(cum_pairs, cum_pairs[chunk_start] + max_candidates)))
+        chunk_nb_pairs = nb_pairs[chunk_start:chunk_end]
+        if (total := int(chunk_nb_pairs.sum())) > 0:
+            first = np.repeat(np.arange(chunk_start, chunk_end), chunk_nb_pairs)
+            offsets = np.arange(total) - np.repeat(np.cumsum(chunk_nb_pairs) - chunk_nb_pairs, chunk_nb_pairs)
+            yield order[first], order[first + 1 + offsets]
+        chunk_start = chunk_end
+
+
+def find_close_pairs(hashes: npt.NDArray[np.uint64],
+                     max_distance: int,
+                     max_candidates: int = MAX_CANDIDATES_PER_CHUNK) -> npt.NDArray[np.int64]:
+    """Find the pairs of distinct hashes within the given Hamming distance, using multi-index hashing.
+
+    The 64 bits are split into max_distance + 1 substrings: two hashes within that distance have at least one
+    substring in common (pigeonhole principle). The hashes are grouped by the value of each substring, and only the
+    pairs within a group are compared, instead of all the pairs.
+
+    Args:
+        hashes: (N,) The hashes, should be unique (group the identical ones beforehand).
+        max_distance: The maximum Hamming distance between two hashes of a pair.
+        max_candidates: Maximum number of candidate pairs compared at once, to bound the memory usage.
+
+    Returns:
+        (M, 2) The indices of the pairs of hashes (a pair can appear several times).
+    """
+    if not 0 <= max_distance < 64:
+        raise ValueError(f"The maximum distance should be between 0 and 63, got {max_distance}")
+    nb_substrings = max_distance + 1
+    bounds = np.linspace(0, 64, nb_substrings + 1).astype(np.uint64)
+    pairs: list[npt.NDArray[np.int64]] = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        mask = np.uint64((1 << int(end - start)) - 1)
+        substrings = (hashes >> start) & mask
+        for first, second in _iter_group_pairs(substrings, max_candidates):
+            close = popcount(hashes[first] ^ hashes[second]) <= max_distance
+            pairs.append(np.stack((first[close], second[close]), axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+
+def get_clusters(nb_elements: int, pairs: npt.NDArray[np.int64]) -> list[list[int]]:
+    """Group the elements connected by the pairs (connected components, with a union-find).
+
+    Args:
+        nb_elements: The number of elements.
+        pairs: (M, 2) The pairs of connected elements.
+
+    Returns:
+        The clusters with at least two elements, each sorted, ordered by their first element.
+    """
+    parents = list(range(nb_elements))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for first, second in pairs.tolist():
+        root_1, root_2 = find(first), find(second)
+        if root_1 != root_2:
+            parents[max(root_1, root_2)] = min(root_1, root_2)
+
+    clusters: dict[int, list[int]] = {}
+    for i in range(nb_elements):
+        clusters.setdefault(find(i), []).append(i)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+
+def find_near_duplicates(hashes: Sequence[int] | npt.NDArray[np.uint64], max_distance: int) -> list[list[int]]:
+    """Group the hashes within the given Hamming distance of each other (transitively).
+
+    Args:
+        hashes: The hashes of the images.
+        max_distance: The maximum Hamming distance between two hashes considered as near duplicates.
+
+    Returns:
+        The clusters of indices of near duplicate hashes (only the ones with at least two elements).
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    pairs = find_close_pairs(unique_hashes, max_distance) if max_distance > 0 else np.empty((0, 2), dtype=np.int64)
+    # Identical hashes are linked to the first element with that hash.
+    first_with_hash = np.full(len(unique_hashes), len(hashes), dtype=np.int64)
+    np.minimum.at(first_with_hash, inverse, np.arange(len(hashes)))
+    identical_pairs = np.stack((first_with_hash[inverse], np.arange(len(hashes))), axis=1)
+    identical_pairs = identical_pairs[identical_pairs[:, 0] != identical_pairs[:, 1]]
+    all_pairs = np.concatenate((first_with_hash[pairs], identical_pairs))
+    return get_clusters(len(hashes), all_pairs)
@@ -0,0 +1,123 @@
+"""Vectorized operations on the polygon segmentations of many annotations at once.
+
+The polygons are stored in a single flat buffer of coordinates ([x1, y1, x2, y2, ...] for all the polygons, one after
+the other), with the offsets of each polygon in that buffer and the offsets of the polygons of each annotation.
+This avoids handling each coordinate as a python float when processing large datasets.
+"""
+from collections.abc import Sequence
+from itertools import chain
+from typing import NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.types.coco_types import TPolygon_segmentation
+
+
+class FlatPolygons(NamedTuple):
+    """Polygons of several annotations, stored in a flat buffer.
+
+    Attributes:
+        coords: (2*N_vertices,) The x, y coordinates of all the vertices of all the polygons.
+        poly_offsets: (N_polys+1,) Polygon `i` is `coords[poly_offsets[i]:poly_offsets[i+1]]`.
+        ann_offsets: (N_anns+1,) The polygons of annotation `j` are the ones in `ann_offsets[j]:ann_offsets[j+1]`.
+    """
+
+    coords: npt.NDArray[np.float64]
+    poly_offsets: npt.NDArray[np.int64]
+    ann_offsets: npt.NDArray[np.int64]
+
+    @property
+    def vertex_poly_idx(self) -> npt.NDArray[np.int64]:
+        """(N_vertices,) Index of the polygon of each vertex."""
+        return np.repeat(np.arange(len(self.poly_offsets) - 1), np.diff(self.poly_offsets) // 2)
+
+    @property
+    def next_vertex_idx(self) -> npt.NDArray[np.int64]:
+        """(N_vertices,) Index of the vertex following each vertex (its polygon's first vertex for the last one)."""
+        poly_starts, poly_ends = self.poly_offsets[:-1] // 2, self.poly_offsets[1:] // 2
+        next_idx = np.arange(1, len(self.coords) // 2 + 1)
+        is_not_empty = poly_ends > poly_starts
+        next_idx[poly_ends[is_not_empty] - 1] = poly_starts[is_not_empty]
+        return next_idx
+
+    @property
+    def poly_ann_idx(self) -> npt.NDArray[np.int64]:
+        """(N_polys,) Index of the annotation of each polygon."""
+        return np.repeat(np.arange(len(self.ann_offsets) - 1), np.diff(self.ann_offsets))
+
+
+def flatten_polygons(segmentations: Sequence[TPolygon_segmentation]) -> FlatPolygons:
+    """Put the polygon segmentations of several annotations in a single flat buffer.
+
+    Args:
+        segmentations: The polygon segmentations, each one being a list of polygons ([[x1, y1, x2, y2, ...], ...]).
+
+    Returns:
+        The flat polygons.
+
+    Raises:
+        ValueError: If a polygon has an odd number of coordinates.
+    """
+    polygons = list(chain.from_iterable(segmentations))
+    nb_polys = np.fromiter(map(len, segmentations), dtype=np.int64, count=len(segmentations))
+    poly_lengths = np.fromiter(map(len, polygons), dtype=np.int64, count=len(polygons))
+    if (odd_polys := poly_lengths % 2 == 1).any():
+        raise ValueError(f"Polygons must have an even number of coordinates, got {poly_lengths[odd_polys][0]}.")
+    coords = np.fromiter(chain.from_iterable(polygons), dtype=np.float64, count=int(poly_lengths.sum()))
+    return FlatPolygons(coords,
+                        np.concatenate(([0], np.cumsum(poly_lengths))),
+                        np.concatenate(([0], np.cumsum(nb_polys))))
+
+
+def unflatten_polygons(flat_polygons: FlatPolygons) -> list[TPolygon_segmentation]:
+    """Convert flat polygons back to one list of polygons per annotation (the inverse of `flatten_polygons`)."""
+    coords: list[float] = flat_polygons.coords.tolist()
+    poly_offsets: list[int] = flat_polygons.poly_offsets.tolist()
+    ann_offsets: list[int] = flat_polygons.ann_offsets.tolist()
+    polygons = [coords[start:end] for start, end in zip(poly_offsets[:-1], poly_offsets[1:])]
+    return [polygons[start:end] for start, end in zip(ann_offsets[:-1], ann_offsets[1:])]
+
+
+def scale_polygons(flat_polygons: FlatPolygons, scales: npt.NDArray[np.float64]) -> FlatPolygons:
+    """Scale the polygons of each annotation.
+
+    Args:
+        flat_polygons: The polygons to scale.
+        scales: (N_anns, 2) The x and y scale factors of each annotation.
+
+    Returns:
+        The scaled polygons (the offsets are shared with the input).
+    """
+    vertex_ann_idx = flat_polygons.poly_ann_idx[flat_polygons.vertex_poly_idx]
+    coords = (flat_polygons.coords.reshape(-1, 2) * scales[vertex_ann_idx]).reshape(-1)
+    return flat_polygons._replace(coords=coords)
+
+
+def polygons_areas(flat_polygons: FlatPolygons) -> npt.NDArray[np.float64]:
+    """Compute the area of each polygon with the shoelace formula.
+
+    Args:
+        flat_polygons: The polygons.
+
+    Returns:
+        (N_polys,) The area of each polygon.
+    """
+    vertices = flat_polygons.coords.reshape(-1, 2)
+    next_idx = flat_polygons.next_vertex_idx
+    cross_products = vertices[:, 0] * vertices[next_idx, 1] - vertices[next_idx, 0] * vertices[:, 1]
+    return 0.5 * np.abs(np.bincount(flat_polygons.vertex_poly_idx, weights=cross_products,
+                                    minlength=len(flat_polygons.poly_offsets) - 1))
+
+
+def annotations_areas(flat_polygons: FlatPolygons) -> npt.NDArray[np.float64]:
+    """Compute the area of each annotation, as the sum of the areas of its polygons.
+
+    Args:
+        flat_polygons: The polygons.
+
+    Returns:
+        (N_anns,) The area of each annotation.
+    """
+    return np.bincount(flat_polygons.poly_ann_idx, weights=polygons_areas(flat_polygons),
+                       minlength=len(flat_polygons.ann_offsets) - 1)
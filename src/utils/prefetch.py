@@ -0,0 +1,119 @@
+"""Background preparation of the frames (rendered images) of a viewer, and cache of the recently shown ones."""
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import TracebackType
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+TFrame = npt.NDArray[np.uint8]
+
+
+class FrameCache:
+    """LRU cache of frames, bounded by the total size (in bytes) of the frames it holds."""
+
+    def __init__(self, max_bytes: int):
+        """Create an empty cache.
+
+        Args:
+            max_bytes: Maximum total size of the cached frames. The most recent frame is always kept, even if it is
+                       bigger than that.
+        """
+        self.max_bytes = max_bytes
+        self.nb_bytes = 0
+        self._frames: OrderedDict[int, TFrame] = OrderedDict()
+
+    def __contains__(self, idx: int) -> bool:
+        return idx in self._frames
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def get(self, idx: int) -> Optional[TFrame]:
+        """Return the frame with the given index (marking it as recently used), or None if it is not cached."""
+        if (frame := self._frames.get(idx)) is not None:
+            self._frames.move_to_end(idx)
+        return frame
+
+    def put(self, idx: int, frame: TFrame) -> None:
+        """Add a frame to the cache, evicting the least recently used ones if needed."""
+        if (previous_frame := self._frames.pop(idx, None)) is not None:
+            self.nb_bytes -= previous_frame.nbytes
+        self._frames[idx] = frame
+        self.nb_bytes += frame.nbytes
+        while self.nb_bytes > self.max_bytes and len(self._frames) > 1:
+            _, evicted_frame = self._frames.popitem(last=False)
+            self.nb_bytes -= evicted_frame.nbytes
+
+
+class FramePrefetcher:
+    """Render the frames following the one being shown in background threads, and cache the rendered frames.
+
+    The rendering function typically reads and decodes an image and draws on it, which is mostly done by OpenCV and
+    numpy without holding the GIL, so threads are enough to do it while the current frame is displayed.
+    Only the main thread accesses the cache and the pending renders.
+    """
+
+    def __init__(self,
+                 render_fn: Callable[[int], Optional[TFrame]],
+                 nb_frames: int,
+                 nb_prefetch: int = 4,
+                 nb_workers: int = 2,
+                 max_cache_bytes: int = 512 * 2**20):
+        """Create the prefetcher.
+
+        Args:
+            render_fn: Function returning the frame with the given index (or None if it cannot be rendered).
+            nb_frames: Number of frames (the indices go from 0 to nb_frames - 1).
+            nb_prefetch: Number of frames after the current one rendered in advance.
+            nb_workers: Number of rendering threads.
+            max_cache_bytes: Maximum total size of the cached frames.
+        """
+        self.render_fn = render_fn
+        self.nb_frames = nb_frames
+        self.nb_prefetch = nb_prefetch
+        self.cache = FrameCache(max_cache_bytes)
+        self._pending: dict[int, Future[Optional[TFrame]]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, nb_workers))
+
+    def get(self, idx: int) -> Optional[TFrame]:
+        """Return the frame with the given index, and start rendering the next ones.
+
+        Args:
+            idx: Index of the frame.
+
+        Returns:
+            The frame, or None if it could not be rendered.
+        """
+        if (frame := self.cache.get(idx)) is None:
+            future = self._pending.pop(idx, None)
+            frame = future.result() if future is not None else self.render_fn(idx)
+            if frame is not None:
+                self.cache.put(idx, frame)
+        self._prefetch(idx)
+        return frame
+
+    def _prefetch(self, idx: int) -> None:
+        """Schedule the rendering of the frames following the given one (and drop the ones that are not needed)."""
+        window = range(idx + 1, min(idx + 1 + self.nb_prefetch, self.nb_frames))
+        for pending_idx in [pending_idx for pending_idx in self._pending if pending_idx not in window]:
+            self._pending.pop(pending_idx).cancel()
+        for next_idx in window:
+            if next_idx not in self.cache and next_idx not in self._pending:
+                self._pending[next_idx] = self._executor.submit(self.render_fn, next_idx)
+
+    def close(self) -> None:
+        """Stop the rendering threads, dropping the pending renders."""
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self) -> "FramePrefetcher":
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.close()
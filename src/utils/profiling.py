@@ -0,0 +1,220 @@
+"""Optional instrumentation of the scripts: stage timers, counters, peak memory tracking and cProfile dumps.
+
+The code calls `stage` around its main steps and `count` once per step or batch of entries (never per entry).
+Profiling is disabled by default: `stage` then returns a shared no-op context manager and `count` returns immediately,
+so the instrumentation has no noticeable cost. The scripts enable it with the arguments added by `add_profiling_args`,
+and a json report is then written when the script exits.
+
+Only the main thread of the main process is instrumented: the work of the multiprocessing workers is timed as part of
+the stage waiting for their results.
+
+Usage:
+    with stage("load_json"):
+        dataset = CocoDataset.from_json(json_path)
+    count("annotations", len(dataset.annotations))
+"""
+import argparse
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import AbstractContextManager, nullcontext
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Optional
+
+try:
+    import resource
+except ModuleNotFoundError:  # Windows
+    resource = None
+
+_NULL_STAGE = nullcontext()
+# Number of functions (by cumulative time) printed with --profile.
+NB_PRINTED_FUNCTIONS = 25
+
+
+class _Stage:
+    """Adds the time spent in the context (and its peak traced memory) to a stage of the profiler."""
+
+    __slots__ = ("profiler", "name", "start_time")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start_time = 0.
+
+    def __enter__(self) -> None:
+        self.profiler._enter_stage()
+        self.start_time = time.perf_counter()
+
+    def __exit__(self,
+                 exc_type: Optional[type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.profiler._exit_stage(self.name, time.perf_counter() - self.start_time)
+
+
+class Profiler:
+    """Collects the durations of named stages and the values of counters, for the report of a script.
+
+    Stages can be nested (the time of the inner stages is included in the outer ones) and entered several times
+    (their durations are summed).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.stages: dict[str, dict[str, float]] = {}
+        self.counters: dict[str, int] = {}
+        self.cprofile: Optional[cProfile.Profile] = None
+        self.start_time = self.start_cpu_time = 0.
+        self.traced_peak = 0
+        # Peak traced memory of each open stage (the root being the whole run), up to the last tracemalloc reset.
+        self._peaks: list[int] = []
+        self._fork_hook_registered = False
+
+    def start(self, trace_memory: bool = False, cprofile: bool = False) -> None:
+        """Enable the profiler.
+
+        Args:
+            trace_memory: If True, track the peak memory allocated by python (overall and in each stage) with
+                          tracemalloc. This slows down the code noticeably.
+            cprofile: If True, also profile all the function calls with cProfile.
+        """
+        self.enabled = True
+        self.start_time, self.start_cpu_time = time.perf_counter(), time.process_time()
+        if trace_memory:
+            self.trace_memory = True
+            self._peaks = [0]
+            tracemalloc.start()
+        if cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if not self._fork_hook_registered and hasattr(os, "register_at_fork"):
+            # The workers forked by multiprocessing pools should not keep tracing (and never write a report).
+            os.register_at_fork(after_in_child=self._disable_in_child)
+            self._fork_hook_registered = True
+
+    def stop(self) -> None:
+        """Stop the profiling, the collected values are kept for the report."""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.traced_peak = max(self._peaks[0], tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.enabled = False
+
+    def _disable_in_child(self) -> None:
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+
+    def stage(self, name: str) -> AbstractContextManager[None]:
+        """Return a context manager timing the code it contains as part of the given stage."""
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add a value to a counter."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _enter_stage(self) -> None:
+        if self.trace_memory:
+            self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            self._peaks.append(0)
+            tracemalloc.reset_peak()
+
+    def _exit_stage(self, name: str, duration: float) -> None:
+        stage = self.stages.setdefault(name, {"calls": 0, "time": 0.})
+        stage["calls"] += 1
+        stage["time"] += duration
+        if self.trace_memory and len(self._peaks) > 1:
+            peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            self._peaks[-1] = max(self._peaks[-1], peak)
+            stage["traced_peak_mb"] = max(stage.get("traced_peak_mb", 0.), peak / 2**20)
+
+    def get_report(self) -> dict[str, Any]:
+        """Return the collected values: total wall and cpu times, stages, counters and peak memory usages."""
+        report: dict[str, Any] = {
+            "wall_time": time.perf_counter() - self.start_time,
+            "cpu_time": time.process_time() - self.start_cpu_time,
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+        if resource is not None:
+            # ru_maxrss is in bytes on macOS, in KB elsewhere.
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report["max_rss_mb"] = max_rss / (2**20 if sys.platform == "darwin" else 2**10)
+        if self.trace_memory:
+            report["traced_peak_mb"] = self.traced_peak / 2**20
+        return report
+
+
+PROFILER = Profiler()
+
+
+def stage(name: str) -> AbstractContextManager[None]:
+    """Time the code in the context as part of the given stage, does nothing when profiling is disabled."""
+    return PROFILER.stage(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add a value to a counter, does nothing when profiling is disabled."""
+    PROFILER.count(name, value)
+
+
+def add_profiling_args(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments enabling the profiling to a script's parser (see `start_profiling`)."""
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile", action="store_true",
+                       help="Profile the script with cProfile: print the slowest functions and save the stats next to "
+                            "the metrics (or to <script name>.prof). The metrics are printed if not saved.")
+    group.add_argument("--metrics_out", "--metrics-out", type=Path, default=None,
+                       help="Save a json report (time spent in each stage, counters, peak memory usage) to this file.")
+    group.add_argument("--trace_memory", "--trace-memory", action="store_true",
+                       help="Also report the peak memory allocated by python, overall and per stage (uses tracemalloc, "
+                            "which slows the script down).")
+
+
+def write_report(script_name: str, metrics_path: Optional[Path], cprofile_path: Optional[Path]) -> None:
+    """Stop the profiler and save its report (printed to stderr if no path is given) and cProfile stats."""
+    PROFILER.stop()
+    report = {"script": script_name, "argv": sys.argv[1:], **PROFILER.get_report()}
+    if metrics_path is not None:
+        metrics_path.parent.mkdir(parents=True, exist_ok=True)
+    if PROFILER.cprofile is not None and cprofile_path is not None:
+        PROFILER.cprofile.dump_stats(cprofile_path)
+        report["cprofile_path"] = str(cprofile_path)
+        stats_output = io.StringIO()
+        pstats.Stats(PROFILER.cprofile, stream=stats_output).sort_stats("cumulative").print_stats(NB_PRINTED_FUNCTIONS)
+        print(stats_output.getvalue(), file=sys.stderr)
+    if metrics_path is not None:
+        with open(metrics_path, "w", encoding="utf-8") as metrics_file:
+            json.dump(report, metrics_file, indent=2)
+        print(f"Saved the profiling metrics to {metrics_path}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2), file=sys.stderr)
+
+
+def start_profiling(args: argparse.Namespace) -> None:
+    """Enable the profiling if requested by the arguments (see `add_profiling_args`), the report is written at exit."""
+    profile: bool = args.profile
+    metrics_path: Optional[Path] = args.metrics_out
+    trace_memory: bool = args.trace_memory
+    if not (profile or metrics_path is not None or trace_memory):
+        return
+
+    script_name = Path(sys.argv[0]).stem
+    cprofile_path: Optional[Path] = None
+    if profile:
+        cprofile_path = metrics_path.with_suffix(".prof") if metrics_path is not None else Path(f"{script_name}.prof")
+    PROFILER.start(trace_memory=trace_memory, cprofile=profile)
+    atexit.register(write_report, script_name, metrics_path, cprofile_path)
@@ -0,0 +1,210 @@
+"""Operations on masks done directly on their RLE, without decoding them to full (height x width) masks.
+
+The RLEs are the uncompressed ones (list of counts, in column-major order). Encoded RLEs can be decoded with
+`encoded_rles_to_rles` first, which is much cheaper than building the masks.
+Each RLE is handled as its sorted runs of 1s (see `rle_to_intervals`), so the cost of the operations depends on the
+number of runs and not on the size of the images.
+"""
+from collections.abc import Sequence
+from itertools import chain
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from src.utils.segmentation_conversions import intervals_to_rles
+
+TRLE = list[int] | npt.NDArray[np.uint32]
+
+
+def rle_area(rle: TRLE) -> int:
+    """Return the number of pixels set in the mask of a RLE."""
+    return int(np.asarray(rle, dtype=np.int64)[1::2].sum())
+
+
+def rles_areas(rles: Sequence[TRLE]) -> npt.NDArray[np.int64]:
+    """Return the number of pixels set in the mask of each RLE."""
+    return np.fromiter((rle_area(rle) for rle in rles), dtype=np.int64, count=len(rles))
+
+
+def _concat_intervals(rles: Sequence[TRLE]
+                      ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """Return the runs of 1s of all the RLEs (starts, ends and index of the RLE), sorted by RLE and position."""
+    lengths = np.fromiter(map(len, rles), dtype=np.int64, count=len(rles))
+    counts = np.fromiter(chain.from_iterable(rles), dtype=np.int64, count=int(lengths.sum()))
+    rle_offsets = np.cumsum(lengths) - lengths
+    rle_idx = np.repeat(np.arange(len(rles)), lengths)
+    # The runs of 1s are the odd counts of each RLE, and their end is the cumulative sum of the counts of the RLE.
+    is_set_run = (np.arange(len(counts)) - rle_offsets[rle_idx]) % 2 == 1
+    cumulative_counts = np.cumsum(counts)
+    run_ends = cumulative_counts - (cumulative_counts - counts)[rle_offsets[rle_idx]]
+    is_kept = is_set_run & (counts > 0)
+    return run_ends[is_kept] - counts[is_kept], run_ends[is_kept], rle_idx[is_kept]
+
+
+def _intervals_bboxes(starts: npt.NDArray[np.int64],
+                      ends: npt.NDArray[np.int64],
+                      rle_idx: npt.NDArray[np.int64],
+                      nb_rles: int,
+                      height: int) -> npt.NDArray[np.int64]:
+    """Compute the (inclusive) x_min, y_min, x_max, y_max of the pixels set in each RLE (-1 for the empty ones)."""
+    bboxes = np.full((nb_rles, 4), -1, dtype=np.int64)
+    if len(starts) == 0:
+        return bboxes
+    first_columns, last_columns = starts // height, (ends - 1) // height
+    nb_intervals = np.bincount(rle_idx, minlength=nb_rles)
+    is_not_empty = nb_intervals > 0
+    last_interval = np.cumsum(nb_intervals) - 1
+    first_interval = last_interval - nb_intervals + 1
+    bboxes[is_not_empty, 0] = first_columns[first_interval[is_not_empty]]
+    bboxes[is_not_empty, 2] = last_columns[last_interval[is_not_empty]]
+
+    # A run over several columns covers all the rows.
+    y_min = np.full(nb_rles, height - 1, dtype=np.int64)
+    y_max = np.zeros(nb_rles, dtype=np.int64)
+    np.minimum.at(y_min, rle_idx, np.where(first_columns != last_columns, 0, starts % height))
+    np.maximum.at(y_max, rle_idx, np.where(first_columns != last_columns, height - 1, (ends - 1) % height))
+    bboxes[is_not_empty, 1] = y_min[is_not_empty]
+    bboxes[is_not_empty, 3] = y_max[is_not_empty]
+    return bboxes
+
+
+def rles_bboxes(rles: Sequence[TRLE], height: int) -> npt.NDArray[np.float64]:
+    """Compute the tight bounding box of each RLE.
+
+    Args:
+        rles: The RLE lists corresponding to the masks.
+        height: The height of the masks.
+
+    Returns:
+        (N, 4) The COCO bounding boxes (top left x, top left y, width, height), all 0 for empty masks.
+    """
+    bboxes = _intervals_bboxes(*_concat_intervals(rles), nb_rles=len(rles), height=height)
+    coco_bboxes = np.zeros((len(rles), 4), dtype=np.float64)
+    is_not_empty = bboxes[:, 0] >= 0
+    coco_bboxes[is_not_empty, :2] = bboxes[is_not_empty, :2]
+    coco_bboxes[is_not_empty, 2:] = bboxes[is_not_empty, 2:] - bboxes[is_not_empty, :2] + 1
+    return coco_bboxes
+
+
+def rle_bbox(rle: TRLE, height: int) -> list[float]:
+    """Compute the tight COCO bounding box (top left x, top left y, width, height) of a RLE."""
+    return rles_bboxes([rle], height)[0].tolist()
+
+
+def merge_rles(rles: Sequence[TRLE], intersect: bool = False) -> npt.NDArray[np.uint32]:
+    """Compute the union (or the intersection) of the masks of several RLEs.
+
+    Args:
+        rles: The RLE lists corresponding to the masks, which must all have the same size.
+        intersect: If True, compute the intersection of the masks instead of their union.
+
+    Returns:
+        The RLE of the merged mask.
+
+    Raises:
+        ValueError: If no RLE is given or if the RLEs do not have the same size.
+    """
+    if not rles:
+        raise ValueError("At least one RLE is needed.")
+    mask_sizes = {int(np.sum(rle, dtype=np.int64)) for rle in rles}
+    if len(mask_sizes) != 1:
+        raise ValueError(f"The RLEs must be for masks of the same size, got sizes {sorted(mask_sizes)}.")
+    starts, ends, _ = _concat_intervals(rles)
+
+    # Sweep over the boundaries of the runs, keeping track of how many masks cover each segment between two of them.
+    positions, inverse = np.unique(np.concatenate((starts, ends)), return_inverse=True)
+    deltas = np.bincount(inverse, weights=np.repeat([1, -1], len(starts)), minlength=len(positions))
+    coverage = np.cumsum(deltas)
+    is_set = coverage >= (len(rles) if intersect else 1)
+    was_set = np.concatenate(([False], is_set[:-1]))
+    merged_starts, merged_ends = positions[is_set & ~was_set], positions[~is_set & was_set]
+    return intervals_to_rles(merged_starts, merged_ends, np.zeros(len(merged_starts), dtype=np.int64),
+                             np.asarray([mask_sizes.pop()]))[0]
+
+
+def rle_union(rle_1: TRLE, rle_2: TRLE) -> npt.NDArray[np.uint32]:
+    """Return the RLE of the union of two masks."""
+    return merge_rles([rle_1, rle_2])
+
+
+def rle_intersection(rle_1: TRLE, rle_2: TRLE) -> npt.NDArray[np.uint32]:
+    """Return the RLE of the intersection of two masks."""
+    return merge_rles([rle_1, rle_2], intersect=True)
+
+
+def rles_iou(rles_1: Sequence[TRLE],
+             rles_2: Sequence[TRLE],
+             height: int,
+             iscrowd: Optional[Sequence[int] | npt.NDArray[np.int64]] = None) -> npt.NDArray[np.float64]:
+    """Compute the IoU between each pair of masks of two sets of RLEs (from the same image).
+
+    The intersections are computed with the cumulative number of set pixels of the masks of `rles_1`, evaluated at the
+    boundaries of the runs of the masks of `rles_2` (all the pairs at once, with a single `np.searchsorted`).
+    Only the pairs whose bounding boxes overlap are evaluated, and only on the runs within the span of the first mask.
+
+    Args:
+        rles_1: The RLEs of the first set of masks (typically the detections).
+        rles_2: The RLEs of the second set of masks (typically the ground truths).
+        height: The height of the masks.
+        iscrowd: For each mask of `rles_2`, whether it is a crowd region. Like with pycocotools, the IoU with a crowd
+                 region is the intersection divided by the area of the mask from `rles_1`.
+
+    Returns:
+        (N_1, N_2) The IoUs.
+    """
+    starts_1, ends_1, idx_1 = _concat_intervals(rles_1)
+    starts_2, ends_2, idx_2 = (starts_1, ends_1, idx_1) if rles_2 is rles_1 else _concat_intervals(rles_2)
+    nb_rles_1, nb_rles_2 = len(rles_1), len(rles_2)
+    ious = np.zeros((nb_rles_1, nb_rles_2), dtype=np.float64)
+    if len(starts_1) == 0 or len(starts_2) == 0:
+        return ious
+    areas_1 = np.bincount(idx_1, weights=ends_1 - starts_1, minlength=nb_rles_1)
+    areas_2 = np.bincount(idx_2, weights=ends_2 - starts_2, minlength=nb_rles_2)
+
+    # Candidate pairs: both masks are not empty and their bounding boxes overlap.
+    bboxes_1 = _intervals_bboxes(starts_1, ends_1, idx_1, nb_rles_1, height)[:, :, None]
+    bboxes_2 = _intervals_bboxes(starts_2, ends_2, idx_2, nb_rles_2, height).T[None]
+    pairs_1, pairs_2 = np.nonzero((areas_1[:, None] > 0) & (areas_2[None] > 0)
+                                  & (bboxes_1[:, 0] <= bboxes_2[:, 2]) & (bboxes_2[:, 0] <= bboxes_1[:, 2])
+                                  & (bboxes_1[:, 1] <= bboxes_2[:, 3]) & (bboxes_2[:, 1] <= bboxes_1[:, 3]))
+    if len(pairs_1) == 0:
+        return ious
+
+    # The positions of each mask are offset by its index times the stride, so that all masks can be searched at once.
+    stride = int(max(ends_1.max(), ends_2.max())) + 1
+    keys_starts_1, keys_ends_1 = idx_1 * stride + starts_1, idx_1 * stride + ends_1
+    keys_starts_2, keys_ends_2 = idx_2 * stride + starts_2, idx_2 * stride + ends_2
+
+    # For each pair, the runs of the second mask that overlap the span of the first one.
+    nb_intervals_1 = np.bincount(idx_1, minlength=nb_rles_1)
+    is_not_empty_1 = nb_intervals_1 > 0
+    last_interval_1 = np.cumsum(nb_intervals_1) - 1
+    span_starts_1, span_ends_1 = np.zeros(nb_rles_1, dtype=np.int64), np.zeros(nb_rles_1, dtype=np.int64)
+    span_starts_1[is_not_empty_1] = starts_1[(last_interval_1 - nb_intervals_1 + 1)[is_not_empty_1]]
+    span_ends_1[is_not_empty_1] = ends_1[last_interval_1[is_not_empty_1]]
+    first_runs = np.searchsorted(keys_ends_2, pairs_2 * stride + span_starts_1[pairs_1], side="right")
+    last_runs = np.searchsorted(keys_starts_2, pairs_2 * stride + span_ends_1[pairs_1], side="left")
+    nb_runs = np.maximum(last_runs - first_runs, 0)
+    query_pair = np.repeat(np.arange(len(pairs_1)), nb_runs)
+    query_run = np.repeat(first_runs - (np.cumsum(nb_runs) - nb_runs), nb_runs) + np.arange(int(nb_runs.sum()))
+
+    # Number of set pixels of the first masks before a (offset) position.
+    cumulative_areas_1 = np.concatenate(([0], np.cumsum(ends_1 - starts_1)))
+    padded_keys_starts_1 = np.concatenate((keys_starts_1, [np.iinfo(np.int64).max]))
+
+    def nb_set_before(keys: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+        run_idx = np.searchsorted(keys_ends_1, keys, side="right")
+        return cumulative_areas_1[run_idx] + np.maximum(keys - padded_keys_starts_1[run_idx], 0)
+
+    offsets = (pairs_1[query_pair] - pairs_2[query_pair]) * stride
+    intersections = np.bincount(query_pair, minlength=len(pairs_1),
+                                weights=(nb_set_before(keys_ends_2[query_run] + offsets)
+                                         - nb_set_before(keys_starts_2[query_run] + offsets)))
+
+    unions = areas_1[pairs_1] + areas_2[pairs_2] - intersections
+    if iscrowd is not None:
+        is_crowd = np.asarray(iscrowd, dtype=np.bool_)[pairs_2]
+        unions[is_crowd] = areas_1[pairs_1[is_crowd]]
+    ious[pairs_1, pairs_2] = intersections / unions
+    return ious
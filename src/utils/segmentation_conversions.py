@@ -1,10 +1,79 @@
+from collections.abc import Sequence
+
+import cv2
 import numpy as np
 import numpy.typing as npt
 
+from src.types.coco_types import TPolygon_segmentation
 from src.types.img_types import Tmask
+from src.utils.polygons import flatten_polygons
+
+# The polygons are upsampled by this factor before being rasterized (same value as in pycocotools).
+_POLYGON_UPSAMPLING = 5
+# Number of pixels of the chunks of masks processed at once by masks_to_rles (a few MB, to stay in the CPU cache).
+_MASKS_CHUNK_PIXELS = 2**20
+
+
+def _split_counts(counts: npt.NDArray[np.int64], lengths: npt.NDArray[np.int64]) -> list[npt.NDArray[np.uint32]]:
+    """Split a flat array of counts into one array per RLE."""
+    return np.split(counts.astype(np.uint32), np.cumsum(lengths)[:-1])
+
+
+def encoded_rles_to_rles(encoded_rles: Sequence[str | bytes]) -> list[npt.NDArray[np.uint32]]:
+    """Decode several encoded RLE strings at once.
+
+    All the strings are concatenated into a single byte buffer and decoded together, which avoids paying the numpy
+    overhead once per annotation. See `encoded_rle_to_rle` for details on the format.
+
+    Args:
+        encoded_rles: The encoded strings from the annotations file.
+
+    Returns:
+        The decoded RLE arrays, in the same order as the input strings.
+    """
+    if len(encoded_rles) == 0:
+        return []
+    encoded_bytes = [rle if isinstance(rle, bytes) else str.encode(rle, encoding="ascii") for rle in encoded_rles]
+    nb_bytes = np.fromiter((len(rle) for rle in encoded_bytes), dtype=np.int64, count=len(encoded_bytes))
+    # The encoding uses the ascii chars 48-111.
+    buffer = np.frombuffer(b"".join(encoded_bytes), dtype=np.uint8).astype(np.int64) - 48
+
+    # When the high order bit (0x20, i.e. 32 or 010000) of a byte is 0, it is the last byte of an integer.
+    is_last_byte = (buffer & 0x20) == 0
+    string_ends = np.cumsum(nb_bytes)
+    if not is_last_byte[string_ends[nb_bytes > 0] - 1].all():
+        raise ValueError("Invalid encoded RLE, the last integer of a string is incomplete.")
+    last_byte_idx = np.flatnonzero(is_last_byte)
+    first_byte_idx = np.concatenate(([0], last_byte_idx + 1))[:len(last_byte_idx)]
+
+    # Each byte holds 5 bits of payload (0x1f is 31, i.e. 001111), the first byte being the least significant one.
+    value_idx = np.cumsum(is_last_byte) - is_last_byte
+    shift = 5 * (np.arange(len(buffer)) - first_byte_idx[value_idx])
+    values = np.add.reduceat((buffer & 0x1f) << shift, first_byte_idx) if len(first_byte_idx) else buffer[:0]
+
+    # Sign extension: if the fourth payload bit (0x10) of the last byte is set, then the value is negative.
+    nb_value_bits = 5 * (last_byte_idx - first_byte_idx + 1)
+    values -= np.where(buffer[last_byte_idx] & 0x10, np.left_shift(1, nb_value_bits), 0)
+
+    # Split the values between the strings, using the number of integers terminated in each string.
+    cumulative_last_bytes = np.concatenate(([0], np.cumsum(is_last_byte)))
+    nb_counts = cumulative_last_bytes[string_ends] - cumulative_last_bytes[string_ends - nb_bytes]
+
+    # Except for the first three, the counts are stored as an offset from the count two positions before.
+    # This is undone with a cumulative sum over each parity, restarted for each string.
+    string_starts = np.cumsum(nb_counts) - nb_counts
+    local_idx = np.arange(len(values)) - np.repeat(string_starts, nb_counts)
+    counts = values.copy()
+    for parity in (0, 1):
+        is_in_chain = (local_idx % 2 == parity) & (local_idx >= 1)
+        chain_cumsum = np.cumsum(np.where(is_in_chain, values, 0))
+        chain_offset = np.concatenate(([0], chain_cumsum))[string_starts]
+        counts = np.where(is_in_chain, chain_cumsum - np.repeat(chain_offset, nb_counts), counts)
 
+    return _split_counts(counts, nb_counts)
 
-def encoded_rle_to_rle(encoded_count_rle: str) -> npt.NDArray[np.uint32]:
+
+def encoded_rle_to_rle(encoded_count_rle: str | bytes) -> npt.NDArray[np.uint32]:
     """Decode encoded rle segmentation information into a rle.
 
     See the (hard to read) implementation:
@@ -15,44 +84,109 @@ def encoded_rle_to_rle(encoded_count_rle: str) -> npt.NDArray[np.uint32]:
     It is similar to LEB128, but here shift is incremented by 5 instead of 7 because the implementation uses
     6 bits per byte instead of 8. (no idea why, I guess it's more efficient for the COCO dataset?)
 
-    I'm reimplementing it in python here half by curiosity and half for debugging purposes.
-    Performance is obviously worse.
+    My hypothesis as to why counts (after the third one) are stored as an offset from the count two positions before,
+    is that most objects are going to be somewhat 'vertically convex' (i.e. have only one continuous run per line).
+    In which case, the next 'row' of black/white pixels is going to be similar to the one preceding it.
+    Therefore, by having the count be an offset of the one preceding it, it can be a smaller int and use less bits.
+
+    The decoding is done on the whole byte array at once with numpy, and gives the same result as pycocotools.
 
     Args:
         encoded_count_rle: The encoded string from the annotations file.
 
     Returns:
-        The decoded RLE list.
+        The decoded RLE array.
+    """
+    return encoded_rles_to_rles([encoded_count_rle])[0]
+
+
+def rles_to_encoded_rles(rles: Sequence[list[int] | npt.NDArray[np.uint32]]) -> list[str]:
+    """Encode several RLEs at once into the compressed COCO string format.
+
+    Args:
+        rles: The RLE lists/arrays to encode.
+
+    Returns:
+        The encoded strings, in the same order as the input RLEs.
     """
-    bytes_rle = str.encode(encoded_count_rle, encoding="ascii")
-
-    # Get the RLE from the encoded RLE.
-    current_count_idx, current_byte_idx, counts = 0, 0, np.zeros(len(encoded_count_rle), dtype=np.uint32)
-    while current_byte_idx < len(bytes_rle):
-        continuous_pixels, shift, high_order_bit = 0, 0, 1
-
-        # When the high order bit of a byte becomes 0, we have decoded the integer and can move on to the next one.
-        while high_order_bit:
-            byte = bytes_rle[current_byte_idx] - 48  # The encoding uses the ascii chars 48-111.
-            # 0x1f is 31, i.e. 001111 --> Here we select the first four bits of the byte.
-            continuous_pixels |= (byte & 0x1f) << shift
-            # 0x20 is 32 as int, i.e. 2**5, i.e 010000 --> Here we select the fifth bit of the byte.
-            high_order_bit = byte & 0x20
-            current_byte_idx += 1
-            shift += 5
-            if (not high_order_bit) and (byte & 0x10):  # 0x10 is 16 as int, i.e. 1000
-                continuous_pixels |= (~0 << shift)
-
-        if current_count_idx > 2:
-            # My hypothesis as to what is happening here, is that most objects are going to be somewhat
-            # 'vertically convex' (i.e. have only one continuous run per line).
-            # In which case, the next 'row' of black/white pixels is going to be similar to the one preceding it.
-            # Therefore, by have the continuous count of pixels be an offset of the one preceding it, we can have it be
-            # a smaller int and therefore use less bits to encode it.
-            continuous_pixels += counts[current_count_idx-2]
-        counts[current_count_idx] = continuous_pixels
-        current_count_idx += 1
-    return counts
+    if len(rles) == 0:
+        return []
+    nb_counts = np.fromiter((len(rle) for rle in rles), dtype=np.int64, count=len(rles))
+    counts = np.concatenate([np.asarray(rle, dtype=np.int64) for rle in rles])
+
+    # Store the counts (after the third one) as an offset from the count two positions before.
+    string_starts = np.cumsum(nb_counts) - nb_counts
+    local_idx = np.arange(len(counts)) - np.repeat(string_starts, nb_counts)
+    values = counts.copy()
+    values[2:] -= np.where(local_idx[2:] > 2, counts[:-2], 0)
+
+    # A value is written with as many 5 bits chunks as needed to represent it as a signed integer.
+    nb_value_bytes = np.ones(len(values), dtype=np.int64)
+    for nb_bits in range(5, 64, 5):
+        is_too_big = (values >> (nb_bits - 1) != 0) & (values >> (nb_bits - 1) != -1)
+        if not is_too_big.any():
+            break
+        nb_value_bytes += is_too_big
+
+    # Write each value in its chunks, the least significant one first.
+    value_idx = np.repeat(np.arange(len(values)), nb_value_bytes)
+    first_byte_idx = np.cumsum(nb_value_bytes) - nb_value_bytes
+    byte_rank = np.arange(len(value_idx)) - first_byte_idx[value_idx]
+    buffer = (values[value_idx] >> (5 * byte_rank)) & 0x1f
+    buffer |= np.where(byte_rank < nb_value_bytes[value_idx] - 1, 0x20, 0)
+    encoded = (buffer + 48).astype(np.uint8).tobytes().decode("ascii")
+
+    # Split the bytes between the strings.
+    string_idx = np.repeat(np.arange(len(rles)), nb_counts)
+    string_nb_bytes = np.bincount(string_idx, weights=nb_value_bytes, minlength=len(rles)).astype(np.int64)
+    string_ends = np.cumsum(string_nb_bytes)
+    return [encoded[start:end] for start, end in zip(string_ends - string_nb_bytes, string_ends)]
+
+
+def rle_to_encoded_rle(rle: list[int] | npt.NDArray[np.uint32]) -> str:
+    """Encode a RLE into the compressed COCO string format (the inverse of `encoded_rle_to_rle`).
+
+    The output is byte for byte identical to the one from pycocotools.
+
+    Args:
+        rle: The RLE list corresponding to the mask.
+
+    Returns:
+        The encoded string, as it would be stored in an annotations file.
+    """
+    return rles_to_encoded_rles([rle])[0]
+
+
+def rles_to_masks(rles: Sequence[list[int] | npt.NDArray[np.uint32]], height: int, width: int
+                  ) -> npt.NDArray[np.bool_]:
+    """Converts several RLEs (of masks with the same size) to their uncompressed masks.
+
+    The masks are built with a single `np.repeat` over the alternating 0/1 runs of all the RLEs.
+
+    Args:
+        rles: The RLE lists corresponding to the masks.
+        height: The height of the image.
+        width: The with of the image.
+
+    Returns:
+        A (N, height, width) boolean array indicating for each mask and pixel whether it belongs to the object or not.
+        The masks are stored in column-major order (like the RLEs), i.e. the array is a transposed view.
+
+    Raises:
+        ValueError: If a RLE does not cover exactly height * width pixels.
+    """
+    nb_counts = np.fromiter((len(rle) for rle in rles), dtype=np.int64, count=len(rles))
+    counts = (np.concatenate([np.asarray(rle, dtype=np.int64) for rle in rles]) if len(rles)
+              else np.zeros(0, dtype=np.int64))
+
+    rle_idx = np.repeat(np.arange(len(rles)), nb_counts)
+    if (invalid := np.bincount(rle_idx, weights=counts, minlength=len(rles)) != height * width).any():
+        raise ValueError(f"The RLE at index {np.flatnonzero(invalid)[0]} does not match the {height}x{width} size.")
+
+    # Each RLE starts with a run of 0s, and then alternates between runs of 1s and 0s.
+    local_idx = np.arange(len(counts)) - np.repeat(np.cumsum(nb_counts) - nb_counts, nb_counts)
+    masks = np.repeat(local_idx % 2 == 1, counts)
+    return masks.reshape((len(rles), width, height)).transpose(0, 2, 1)
 
 
 def rle_to_mask(rle: list[int] | npt.NDArray[np.uint32], height: int, width: int) -> npt.NDArray[np.bool_]:
@@ -66,16 +200,64 @@ def rle_to_mask(rle: list[int] | npt.NDArray[np.uint32], height: int, width: int
     Returns:
         A boolean mask indicating for each pixel whether it belongs to the object or not.
     """
-    # Construct the mask from the RLE.
-    # (Could do it fully in numpy by using np.repeat and starting from an array of alternating 0s and 1)
-    mask = np.zeros(height * width, dtype=np.bool_)
-    current_value, current_position = 0, 0
-    for nb_pixels in rle:
-        mask[current_position:current_position+nb_pixels] = current_value
-        current_value = 0 if current_value else 1
-        current_position += nb_pixels
+    return rles_to_masks([rle], height, width)[0]
+
+
+def masks_to_rles(masks: npt.NDArray[Tmask]) -> list[list[int]]:
+    """Convert a stack of masks into their RLE forms.
+
+    The masks are read by chunks that fit in the CPU cache, in the order in which they are stored. Column-major masks
+    (like the ones from `rles_to_masks`) directly give the changes of value in the order of the RLEs. Row-major masks
+    are not transposed, which would cost more than everything else: only the positions of their changes are sorted.
+
+    Args:
+        masks: A (N, height, width) array indicating for each mask and pixel whether it belongs to the object or not.
+
+    Returns:
+        The RLE lists corresponding to the masks.
+    """
+    assert masks.ndim == 3, "Masks must be stacked in a (N, height, width) array."
+    nb_masks, height, width = masks.shape
+    mask_size = height * width
+    if mask_size == 0:
+        return [[0] for _ in range(nb_masks)]
+
+    # A run ends wherever the value changes. The changes are identified by their mask index * mask_size + column-major
+    # position of the end of the run.
+    is_column_major = masks.transpose(0, 2, 1).flags.c_contiguous
+    chunk_size = max(1, _MASKS_CHUNK_PIXELS // mask_size)
+    change_keys: list[npt.NDArray[np.int64]] = []
+    starts_with_one: list[npt.NDArray[np.bool_]] = []
+    for chunk_start in range(0, nb_masks, chunk_size):
+        chunk = masks[chunk_start:chunk_start + chunk_size]
+        if chunk.dtype != np.bool_:
+            chunk = chunk != 0
+        if is_column_major:
+            is_set = chunk.transpose(0, 2, 1).reshape(len(chunk), mask_size)
+            starts_with_one.append(is_set[:, 0])
+            mask_idx, positions = np.divmod(np.flatnonzero(is_set[:, 1:] != is_set[:, :-1]), max(mask_size - 1, 1))
+            change_keys.append((chunk_start + mask_idx) * mask_size + positions + 1)
+            continue
+        # Changes inside a column, and between the end of a column and the start of the next one.
+        is_set = chunk
+        starts_with_one.append(is_set[:, 0, 0])
+        mask_idx, rows, cols = np.unravel_index(np.flatnonzero(is_set[:, 1:] != is_set[:, :-1]),
+                                                (len(is_set), height - 1, width))
+        change_keys.append((chunk_start + mask_idx) * mask_size + cols * height + rows + 1)
+        mask_idx, cols = np.divmod(np.flatnonzero(is_set[:, -1, :-1] != is_set[:, 0, 1:]), max(width - 1, 1))
+        change_keys.append((chunk_start + mask_idx) * mask_size + (cols + 1) * height)
+    keys = np.concatenate(change_keys)
+    mask_idx, run_ends = np.divmod(keys if is_column_major else np.sort(keys), mask_size)
 
-    return mask.reshape((height, width), order="F")
+    # The end of each mask is also the end of its last run.
+    nb_runs = np.bincount(mask_idx, minlength=nb_masks) + 1
+    first_runs = np.cumsum(nb_runs) - nb_runs
+    run_ends = np.insert(run_ends, first_runs + nb_runs - np.arange(1, nb_masks + 1), mask_size)
+    run_lengths = np.diff(run_ends, prepend=0)
+    run_lengths[first_runs] = run_ends[first_runs]
+
+    return [[0, *runs.tolist()] if first_is_set else runs.tolist()
+            for runs, first_is_set in zip(_split_counts(run_lengths, nb_runs), np.concatenate(starts_with_one))]
 
 
 def mask_to_rle(mask: npt.NDArray[Tmask]) -> list[int]:
@@ -90,12 +272,310 @@ def mask_to_rle(mask: npt.NDArray[Tmask]) -> list[int]:
     if mask.shape[-1] == 1:
         mask = np.squeeze(mask)
     assert mask.ndim == 2, "Mask must not be RGB."
-    previous_value, count = 0, 0
-    rle: list[int] = []
-    for pixel in mask.ravel(order="F"):
-        if pixel != previous_value:
-            rle.append(count)
-            previous_value, count = pixel, 0
-        count += 1
-    rle.append(count)
-    return rle
+    flat_mask = mask.ravel(order="F") != 0
+    if flat_mask.size == 0:
+        return [0]
+
+    change_idx = np.flatnonzero(flat_mask[1:] != flat_mask[:-1]) + 1
+    rle: list[int] = np.diff(change_idx, prepend=0, append=flat_mask.size).tolist()
+    return [0, *rle] if flat_mask[0] else rle
+
+
+def rle_to_intervals(rle: list[int] | npt.NDArray[np.uint32]) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """Return the runs of 1s of a RLE.
+
+    Args:
+        rle: The RLE list corresponding to the mask.
+
+    Returns:
+        The start and (exclusive) end positions, in column-major order, of the non-empty runs of 1s.
+    """
+    counts = np.asarray(rle, dtype=np.int64)
+    run_ends = np.cumsum(counts)
+    starts, ends = run_ends[1::2] - counts[1::2], run_ends[1::2]
+    is_not_empty = ends > starts
+    return starts[is_not_empty], ends[is_not_empty]
+
+
+def intervals_to_rles(starts: npt.NDArray[np.int64],
+                      ends: npt.NDArray[np.int64],
+                      rle_idx: npt.NDArray[np.int64],
+                      mask_sizes: npt.NDArray[np.int64]) -> list[npt.NDArray[np.uint32]]:
+    """Build RLEs from the runs of 1s of several masks.
+
+    Args:
+        starts: (N_intervals,) Start (in column-major order) of each run of 1s.
+        ends: (N_intervals,) End (exclusive) of each run of 1s.
+        rle_idx: (N_intervals,) Index of the RLE to which each run belongs. The runs must be sorted by RLE and then by
+                 position, and the runs of a RLE must neither overlap nor touch.
+        mask_sizes: (N_rles,) Number of pixels (height * width) of each mask.
+
+    Returns:
+        The RLEs.
+    """
+    nb_rles = len(mask_sizes)
+    nb_intervals = np.bincount(rle_idx, minlength=nb_rles)
+    # Each RLE is made of the boundaries of its intervals followed by the size of the mask, as differences.
+    nb_bounds = 2 * nb_intervals + 1
+    rle_offsets = np.cumsum(nb_bounds) - nb_bounds
+    interval_rank = np.arange(len(starts)) - np.repeat(np.cumsum(nb_intervals) - nb_intervals, nb_intervals)
+    bounds = np.empty(int(nb_bounds.sum()), dtype=np.int64)
+    bounds[rle_offsets[rle_idx] + 2 * interval_rank] = starts
+    bounds[rle_offsets[rle_idx] + 2 * interval_rank + 1] = ends
+    last_idx = rle_offsets + nb_bounds - 1
+    bounds[last_idx] = mask_sizes
+    previous_bounds = np.concatenate(([0], bounds[:-1]))
+    previous_bounds[rle_offsets] = 0
+    counts = bounds - previous_bounds
+
+    # The RLE does not end with a run of 0 pixels if the last interval goes to the end of the mask.
+    is_empty_end = (counts[last_idx] == 0) & (nb_intervals > 0)
+    keep = np.ones(len(counts), dtype=np.bool_)
+    keep[last_idx[is_empty_end]] = False
+    return _split_counts(counts[keep], nb_bounds - is_empty_end)
+
+
+def polygons_to_rles(segmentations: Sequence[TPolygon_segmentation],
+                     heights: int | Sequence[int] | npt.NDArray[np.int64],
+                     widths: int | Sequence[int] | npt.NDArray[np.int64]) -> list[npt.NDArray[np.uint32]]:
+    """Rasterize the polygon segmentations of several annotations into RLEs.
+
+    This gives the same result as pycocotools' `frPyObjects` followed by `merge` (i.e. the mask of an annotation is the
+    union of the masks of its polygons). Like in pycocotools, the masks are never built: the polygons are upsampled,
+    the points where their edges cross a pixel column are computed and turned directly into column-major runs.
+    All the polygons are processed together with numpy, so batches of a few thousand annotations work best.
+
+    See: https://github.com/cocodataset/cocoapi/blob/master/common/maskApi.c#L162
+
+    Args:
+        segmentations: The polygon segmentations, each one being a list of polygons ([[x1, y1, x2, y2, ...], ...]).
+        heights: The height of the image of each annotation (or one height for all of them).
+        widths: The width of the image of each annotation (or one width for all of them).
+
+    Returns:
+        The RLE of each annotation.
+    """
+    nb_anns = len(segmentations)
+    heights = np.broadcast_to(np.asarray(heights, dtype=np.int64), (nb_anns,))
+    widths = np.broadcast_to(np.asarray(widths, dtype=np.int64), (nb_anns,))
+    flat_polygons = flatten_polygons(segmentations)
+    poly_ann_idx = flat_polygons.poly_ann_idx
+    vertex_poly_idx = flat_polygons.vertex_poly_idx
+    scale = _POLYGON_UPSAMPLING
+
+    # Upsample the vertices and get discrete points densely along each edge (the C casts truncate toward zero).
+    vertices = (scale * flat_polygons.coords + 0.5).astype(np.int64).reshape(-1, 2)
+    next_vertices = vertices[flat_polygons.next_vertex_idx]
+    xs, ys, xe, ye = vertices[:, 0], vertices[:, 1], next_vertices[:, 0], next_vertices[:, 1]
+    dx, dy = np.abs(xe - xs), np.abs(ye - ys)
+    is_x_major = dx >= dy
+    flip = (is_x_major & (xs > xe)) | (~is_x_major & (ys > ye))
+    xs, xe = np.where(flip, xe, xs), np.where(flip, xs, xe)
+    ys, ye = np.where(flip, ye, ys), np.where(flip, ys, ye)
+    nb_steps = np.where(is_x_major, dx, dy)
+    slopes = np.where(is_x_major, ye - ys, xe - xs) / np.maximum(nb_steps, 1)
+
+    # The step of each point along its edge is computed as offset + sign * point_idx, the sign being -1 when flipped.
+    nb_edge_points = nb_steps + 1
+    signs = np.where(flip, -1, 1)
+    step_offsets = np.where(flip, nb_steps, 0) - signs * (np.cumsum(nb_edge_points) - nb_edge_points)
+    steps = (np.repeat(step_offsets, nb_edge_points)
+             + np.repeat(signs, nb_edge_points) * np.arange(int(nb_edge_points.sum())))
+    major_coords = np.repeat(np.where(is_x_major, xs, ys), nb_edge_points) + steps
+    minor_coords = (np.repeat(np.where(is_x_major, ys, xs), nb_edge_points)
+                    + np.repeat(slopes, nb_edge_points) * steps + 0.5).astype(np.int64)
+    point_is_x_major = np.repeat(is_x_major, nb_edge_points)
+    u = np.where(point_is_x_major, major_coords, minor_coords)
+    v = np.where(point_is_x_major, minor_coords, major_coords)
+    point_poly_idx = np.repeat(vertex_poly_idx, nb_edge_points)
+
+    # Get the points where the boundary crosses the center of a pixel column, and downsample them.
+    poly_heights, poly_widths = heights[poly_ann_idx], widths[poly_ann_idx]
+    crossing_idx = np.flatnonzero((u[1:] != u[:-1]) & (point_poly_idx[1:] == point_poly_idx[:-1])) + 1
+    u_prev, u_cur = u[crossing_idx - 1], u[crossing_idx]
+    xd = (np.where(u_cur < u_prev, u_cur, u_cur - 1) + 0.5) / scale - 0.5
+    crossing_poly_idx = point_poly_idx[crossing_idx]
+    is_valid = (np.floor(xd) == xd) & (xd >= 0) & (xd <= poly_widths[crossing_poly_idx] - 1)
+    crossing_idx, xd, crossing_poly_idx = crossing_idx[is_valid], xd[is_valid], crossing_poly_idx[is_valid]
+    yd = (np.minimum(v[crossing_idx], v[crossing_idx - 1]) + 0.5) / scale - 0.5
+    poly_heights = poly_heights[crossing_poly_idx]
+    yd = np.ceil(np.clip(yd, 0, poly_heights))
+    positions = xd.astype(np.int64) * poly_heights + yd.astype(np.int64)
+
+    # Each boundary point toggles the mask (points with an even multiplicity cancel out).
+    order = np.lexsort((positions, crossing_poly_idx))
+    positions, crossing_poly_idx = positions[order], crossing_poly_idx[order]
+    is_new = np.ones(len(positions), dtype=np.bool_)
+    is_new[1:] = (positions[1:] != positions[:-1]) | (crossing_poly_idx[1:] != crossing_poly_idx[:-1])
+    group_starts = np.flatnonzero(is_new)
+    multiplicity = np.diff(group_starts, append=len(positions))
+    mask_sizes = (heights * widths)[poly_ann_idx]
+    is_toggle = (multiplicity % 2 == 1) & (positions[group_starts] < mask_sizes[crossing_poly_idx[group_starts]])
+    toggles, toggle_poly_idx = positions[group_starts[is_toggle]], crossing_poly_idx[group_starts[is_toggle]]
+
+    # Pair the toggles into intervals of 1s, a polygon with an odd number of toggles is filled until the end.
+    nb_toggles = np.bincount(toggle_poly_idx, minlength=len(poly_ann_idx))
+    toggle_rank = np.arange(len(toggles)) - np.repeat(np.cumsum(nb_toggles) - nb_toggles, nb_toggles)
+    starts, interval_poly_idx = toggles[toggle_rank % 2 == 0], toggle_poly_idx[toggle_rank % 2 == 0]
+    ends = mask_sizes[interval_poly_idx]
+    is_closed = toggle_rank % 2 == 1
+    nb_poly_intervals = (nb_toggles + 1) // 2
+    ends[(np.cumsum(nb_poly_intervals) - nb_poly_intervals)[toggle_poly_idx[is_closed]]
+         + toggle_rank[is_closed] // 2] = toggles[is_closed]
+
+    # Union of the intervals of the polygons of each annotation. An interval starts a new group if it begins after the
+    # furthest end seen so far, the ends of each annotation are offset to compute that maximum for all of them at once.
+    interval_ann_idx = poly_ann_idx[interval_poly_idx]
+    order = np.lexsort((starts, interval_ann_idx))
+    starts, ends, interval_ann_idx = starts[order], ends[order], interval_ann_idx[order]
+    key_offset = int(mask_sizes.max(initial=0)) + 1
+    max_ends = np.maximum.accumulate(interval_ann_idx * key_offset + ends) - interval_ann_idx * key_offset
+    is_new = np.ones(len(starts), dtype=np.bool_)
+    is_new[1:] = (interval_ann_idx[1:] != interval_ann_idx[:-1]) | (starts[1:] > max_ends[:-1])
+    is_last = np.ones(len(starts), dtype=np.bool_)
+    is_last[:-1] = is_new[1:]
+    return intervals_to_rles(starts[is_new], max_ends[is_last], interval_ann_idx[is_new], heights * widths)
+
+
+def polygon_to_rle(segmentation: TPolygon_segmentation, height: int, width: int) -> npt.NDArray[np.uint32]:
+    """Rasterize a polygon segmentation (made of one or more polygons) into a RLE.
+
+    Args:
+        segmentation: The polygons of the annotation ([[x1, y1, x2, y2, ...], ...]).
+        height: The height of the image.
+        width: The with of the image.
+
+    Returns:
+        The RLE array corresponding to the union of the polygons.
+    """
+    return polygons_to_rles([segmentation], height, width)[0]
+
+
+def _trace_outer_boundaries(mask: npt.NDArray[np.bool_]) -> list[npt.NDArray[np.int64]]:
+    """Trace the outer boundaries of the 4-connected components of a mask along the edges of its pixels.
+
+    The boundary edges are oriented so that the mask is on their left, and linked into loops (turning left at the
+    vertices shared by two diagonal pixels, which keeps them in separate loops). The loops are then ordered with
+    pointer jumping, so that everything is done with numpy. The loops going around holes are clockwise, and dropped.
+
+    Args:
+        mask: The mask, which must be 0 on its border.
+
+    Returns:
+        The (x, y) corners of each outer boundary, starting from its top-left corner (the vertex (x, y) being the
+        top-left corner of the pixel mask[y, x]).
+    """
+    directions = np.asarray([(1, 0), (0, 1), (-1, 0), (0, -1)], dtype=np.int64)  # right, down, left, up
+    # Horizontal edges go right if the mask is above them, left otherwise. Vertical edges go down if the mask is on
+    # their right, up otherwise.
+    rows, cols = np.nonzero(mask[:-1] != mask[1:])
+    is_above = mask[rows, cols]
+    h_starts = np.stack((cols + ~is_above, rows + 1), axis=1)
+    h_directions = np.where(is_above, 0, 2)
+    rows, cols = np.nonzero(mask[:, :-1] != mask[:, 1:])
+    is_right = mask[rows, cols + 1]
+    v_starts = np.stack((cols + 1, rows + ~is_right), axis=1)
+    v_directions = np.where(is_right, 1, 3)
+    starts = np.concatenate((h_starts, v_starts)).astype(np.int64).reshape(-1, 2)
+    edge_directions = np.concatenate((h_directions, v_directions)).astype(np.int64)
+    nb_edges = len(starts)
+    if nb_edges == 0:
+        return []
+
+    # Sort the edges by start vertex (in raster order) and direction, so that the next edge can be searched.
+    stride = mask.shape[1] + 1
+    keys = (starts[:, 1] * stride + starts[:, 0]) * 4 + edge_directions
+    order = np.argsort(keys)
+    keys, starts, edge_directions = keys[order], starts[order], edge_directions[order]
+    ends = starts + directions[edge_directions]
+    end_keys = (ends[:, 1] * stride + ends[:, 0]) * 4
+    left_idx = np.minimum(np.searchsorted(keys, end_keys + (edge_directions + 3) % 4), nb_edges - 1)
+    next_edges = np.where(keys[left_idx] == end_keys + (edge_directions + 3) % 4,
+                          left_idx, np.searchsorted(keys, end_keys))
+
+    # Label each loop with its smallest edge index (its top-left vertex), and rank the edges by distance to its end.
+    nb_jumps = nb_edges.bit_length()
+    labels, successors = np.arange(nb_edges), next_edges
+    for _ in range(nb_jumps):
+        labels, successors = np.minimum(labels, labels[successors]), successors[successors]
+    is_last = next_edges == labels
+    successors = np.where(is_last, np.arange(nb_edges), next_edges)
+    distances = (~is_last).astype(np.int64)
+    for _ in range(nb_jumps):
+        distances, successors = distances + distances[successors], successors[successors]
+
+    # Keep the corners of the counterclockwise loops (negative area with the y axis pointing down).
+    areas = np.bincount(labels, weights=starts[:, 0] * ends[:, 1] - ends[:, 0] * starts[:, 1], minlength=nb_edges)
+    previous_edges = np.empty(nb_edges, dtype=np.int64)
+    previous_edges[next_edges] = np.arange(nb_edges)
+    is_kept = (edge_directions != edge_directions[previous_edges]) & (areas[labels] < 0)
+    order = np.lexsort((-distances[is_kept], labels[is_kept]))
+    corners, corner_labels = starts[is_kept][order], labels[is_kept][order]
+    return np.split(corners, np.flatnonzero(corner_labels[1:] != corner_labels[:-1]) + 1)
+
+
+def rle_to_polygon(rle: list[int] | npt.NDArray[np.uint32],
+                   height: int,
+                   width: int,
+                   epsilon: float = 0.) -> TPolygon_segmentation:
+    """Convert a RLE to a polygon segmentation, by tracing the contours of its mask along the edges of its pixels.
+
+    Only the part of the mask within the bounding box of the object is decoded, so the work depends on the size of the
+    object and not on the size of the image.
+    Holes cannot be represented by COCO polygons, so only the outer contours are kept. Without simplification, the
+    polygons therefore give back the mask with its holes filled when rasterized (the mask itself if it has no hole).
+    Pixels touching only by a corner are put in different polygons.
+
+    Args:
+        rle: The RLE list corresponding to the mask.
+        height: The height of the image.
+        width: The width of the image.
+        epsilon: If above 0, simplify the polygons (with the Douglas-Peucker algorithm) so that they are at most that
+                 many pixels away from the contours (polygons that would have less than 3 vertices are kept as is).
+
+    Returns:
+        The polygons ([[x1, y1, x2, y2, ...], ...]).
+    """
+    starts, ends = rle_to_intervals(rle)
+    if len(starts) == 0:
+        return []
+    first_columns, last_columns = starts // height, (ends - 1) // height
+    x_min, x_max = int(first_columns.min()), int(last_columns.max())
+    if (first_columns != last_columns).any():
+        y_min, y_max = 0, height - 1
+    else:
+        y_min, y_max = int((starts % height).min()), int(((ends - 1) % height).max())
+
+    # Decode the cropped mask, with a 1 pixel border.
+    lengths = ends - starts
+    pixels = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(int(lengths.sum()))
+    cropped_mask = np.zeros((y_max - y_min + 3, x_max - x_min + 3), dtype=np.bool_)
+    cropped_mask[pixels % height - y_min + 1, pixels // height - x_min + 1] = True
+
+    polygons: TPolygon_segmentation = []
+    for contour in _trace_outer_boundaries(cropped_mask):
+        if epsilon > 0 and len(simplified_contour := cv2.approxPolyDP(contour.astype(np.int32).reshape(-1, 1, 2),
+                                                                      epsilon, closed=True)) >= 3:
+            contour = simplified_contour.reshape(-1, 2)
+        polygons.append((contour + (x_min - 1, y_min - 1)).astype(np.float64).ravel().tolist())
+    return polygons
+
+
+def rles_to_polygons(rles: Sequence[list[int] | npt.NDArray[np.uint32]],
+                     heights: int | Sequence[int] | npt.NDArray[np.int64],
+                     widths: int | Sequence[int] | npt.NDArray[np.int64],
+                     epsilon: float = 0.) -> list[TPolygon_segmentation]:
+    """Convert several RLEs to polygon segmentations (see `rle_to_polygon`).
+
+    Args:
+        rles: The RLE lists corresponding to the masks.
+        heights: The height of each mask (or one height for all of them).
+        widths: The width of each mask (or one width for all of them).
+        epsilon: If above 0, the tolerance (in pixels) used to simplify the polygons.
+
+    Returns:
+        The polygons of each RLE.
+    """
+    heights = np.broadcast_to(np.asarray(heights, dtype=np.int64), (len(rles),))
+    widths = np.broadcast_to(np.asarray(widths, dtype=np.int64), (len(rles),))
+    return [rle_to_polygon(rle, int(height), int(width), epsilon) for rle, height, width in zip(rles, heights, widths)]
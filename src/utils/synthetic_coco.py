@@ -0,0 +1,218 @@
+"""Deterministic generation of synthetic COCO datasets, to test and benchmark the scripts at any scale."""
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, NamedTuple
+from xml.sax.saxutils import escape
+
+import cv2
+import numpy as np
+import numpy.typing as npt
+
+from src.types.coco_types import Annotation, Category, Image
+from src.utils.segmentation_conversions import polygons_to_rles, rles_to_encoded_rles
+
+SEGMENTATION_TYPES = ("polygon", "rle", "encoded_rle")
+# Number of annotations generated together (the polygons of a chunk are rasterized in one call).
+CHUNK_SIZE = 4096
+# Separate random streams, so that changing one part of the config does not change the other parts of the dataset.
+_IMAGES_STREAM, _ANNOTATIONS_STREAM, _PIXELS_STREAM = 0, 1, 2
+
+
+class SyntheticConfig(NamedTuple):
+    """Parameters of a synthetic dataset, the same parameters always give the same dataset."""
+
+    nb_images: int = 100
+    nb_annotations: int = 1000
+    nb_categories: int = 10
+    img_sizes: tuple[tuple[int, int], ...] = ((640, 480),)  # (width, height) choices, picked uniformly.
+    segmentation_mix: tuple[float, float, float] = (1., 0., 0.)  # Weights of the polygon, RLE and encoded RLE types.
+    nb_vertices: int = 8  # Number of vertices of the polygons.
+    image_extension: str = ".jpg"
+    seed: int = 0
+
+
+def check_config(config: SyntheticConfig) -> None:
+    """Raise a ValueError if the config cannot be used to generate a dataset."""
+    if config.nb_images < 1 and config.nb_annotations > 0:
+        raise ValueError("The annotations need at least one image.")
+    if config.nb_categories < 1:
+        raise ValueError(f"There should be at least one category, got {config.nb_categories}")
+    if not config.img_sizes or any(width < 1 or height < 1 for width, height in config.img_sizes):
+        raise ValueError(f"Invalid image sizes: {config.img_sizes}")
+    if len(config.segmentation_mix) != len(SEGMENTATION_TYPES) or min(config.segmentation_mix) < 0 \
+            or sum(config.segmentation_mix) <= 0:
+        raise ValueError(f"The segmentation mix should be {len(SEGMENTATION_TYPES)} non-negative weights (not all 0), "
+                         f"got {config.segmentation_mix}")
+    if config.nb_vertices < 3:
+        raise ValueError(f"The polygons need at least 3 vertices, got {config.nb_vertices}")
+
+
+def get_synthetic_images(config: SyntheticConfig) -> list[Image]:
+    """Return the image entries of the dataset, with consecutive ids and file names."""
+    rng = np.random.default_rng([config.seed, _IMAGES_STREAM])
+    sizes = np.asarray(config.img_sizes, dtype=np.int64)[rng.integers(len(config.img_sizes), size=config.nb_images)]
+    return [{"id": img_id, "width": width, "height": height, "file_name": f"{img_id:07d}{config.image_extension}"}
+            for img_id, (width, height) in enumerate(sizes.tolist())]
+
+
+def get_synthetic_categories(config: SyntheticConfig) -> list[Category]:
+    """Return the category entries of the dataset (ids start at 1, like in the COCO dataset)."""
+    return [{"id": cat_id, "name": f"category_{cat_id}", "supercategory": f"supercategory_{cat_id % 4}"}
+            for cat_id in range(1, config.nb_categories + 1)]
+
+
+def _random_polygons(rng: np.random.Generator,
+                     widths: npt.NDArray[np.int64],
+                     heights: npt.NDArray[np.int64],
+                     nb_vertices: int) -> npt.NDArray[np.float64]:
+    """Draw one star-shaped polygon per image size, within a random box of the image.
+
+    Returns:
+        (N, nb_vertices, 2) The x and y coordinates of the vertices, rounded to 2 decimals.
+    """
+    nb_polygons = len(widths)
+    box_sizes = np.stack((widths, heights), axis=1) * rng.uniform(0.05, 0.5, size=(nb_polygons, 2))
+    top_lefts = (np.stack((widths, heights), axis=1) - box_sizes) * rng.uniform(size=(nb_polygons, 2))
+    # One vertex per angular sector (so that the polygon does not self-intersect), at a random distance of the center.
+    angles = 2 * np.pi * (np.arange(nb_vertices) + rng.uniform(size=(nb_polygons, nb_vertices))) / nb_vertices
+    radii = rng.uniform(0.5, 1., size=(nb_polygons, nb_vertices))
+    unit_points = np.stack((np.cos(angles), np.sin(angles)), axis=2) * radii[..., None]
+    points = top_lefts[:, None] + box_sizes[:, None] * (unit_points + 1) / 2
+    return np.round(points, 2)
+
+
+def iter_synthetic_annotations(config: SyntheticConfig,
+                               images: Sequence[Image],
+                               chunk_size: int = CHUNK_SIZE) -> Iterator[Annotation]:
+    """Yield the annotation entries of the dataset, sorted by image.
+
+    The number of annotations per image is multinomial, each annotation is a random polygon whose segmentation is
+    stored with a type drawn according to the segmentation mix (the RLEs are the rasterized polygons).
+
+    Args:
+        config: The parameters of the dataset.
+        images: The image entries of the dataset (see `get_synthetic_images`).
+        chunk_size: Number of annotations generated together.
+
+    Yields:
+        The annotations.
+    """
+    check_config(config)
+    rng = np.random.default_rng([config.seed, _ANNOTATIONS_STREAM])
+    nb_imgs = len(images)
+    img_widths = np.asarray([image["width"] for image in images], dtype=np.int64)
+    img_heights = np.asarray([image["height"] for image in images], dtype=np.int64)
+    nb_anns_per_img = rng.multinomial(config.nb_annotations, np.full(nb_imgs, 1 / nb_imgs)) if nb_imgs else []
+    ann_img_idx = np.repeat(np.arange(nb_imgs), nb_anns_per_img)
+    mix = np.asarray(config.segmentation_mix, dtype=np.float64)
+
+    for chunk_start in range(0, config.nb_annotations, chunk_size):
+        img_idx = ann_img_idx[chunk_start:chunk_start+chunk_size]
+        widths, heights = img_widths[img_idx], img_heights[img_idx]
+        polygons = _random_polygons(rng, widths, heights, config.nb_vertices)
+        seg_types = rng.choice(len(SEGMENTATION_TYPES), size=len(img_idx), p=mix / mix.sum())
+        cat_ids = rng.integers(1, config.nb_categories + 1, size=len(img_idx))
+
+        mins, maxs = polygons.min(axis=1), polygons.max(axis=1)
+        bboxes = np.round(np.concatenate((mins, maxs - mins), axis=1), 2)
+        x, y = polygons[..., 0], polygons[..., 1]
+        areas = np.round(np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1)) / 2, 2)
+        segmentations: list[Any] = [[polygon] for polygon in polygons.reshape(len(img_idx), -1).tolist()]
+
+        if (is_rle := seg_types != 0).any():
+            rle_idx = np.flatnonzero(is_rle)
+            rles = polygons_to_rles([segmentations[i] for i in rle_idx], heights[rle_idx], widths[rle_idx])
+            encoded_rles = iter(rles_to_encoded_rles([rle for i, rle in zip(rle_idx, rles) if seg_types[i] == 2]))
+            for i, rle, width, height in zip(rle_idx.tolist(), rles, widths[rle_idx].tolist(),
+                                             heights[rle_idx].tolist()):
+                counts = next(encoded_rles) if seg_types[i] == 2 else rle.tolist()
+                segmentations[i] = {"size": [height, width], "counts": counts}
+                areas[i] = rle[1::2].sum()
+
+        for i, (img_i, cat_id, segmentation, area, bbox) in enumerate(
+                zip(img_idx.tolist(), cat_ids.tolist(), segmentations, areas.tolist(), bboxes.tolist())):
+            yield {
+                "id": chunk_start + i,
+                "image_id": images[img_i]["id"],
+                "category_id": cat_id,
+                "segmentation": segmentation,
+                "area": area,
+                "bbox": bbox,
+                "iscrowd": 0,
+            }
+
+
+def generate_synthetic_coco(config: SyntheticConfig) -> dict[str, list[Any]]:
+    """Generate a whole synthetic dataset in memory (see `iter_synthetic_annotations` for large datasets)."""
+    images = get_synthetic_images(config)
+    return {"images": images,
+            "annotations": list(iter_synthetic_annotations(config, images)),
+            "categories": get_synthetic_categories(config)}
+
+
+def make_synthetic_image(width: int,
+                         height: int,
+                         rng: np.random.Generator,
+                         gray: bool = False) -> npt.NDArray[np.uint8]:
+    """Make a smooth random image (a few random colors interpolated over the image), cheap to generate and encode."""
+    nb_channels = 1 if gray else 3
+    small_img = rng.integers(0, 256, size=(3, 4, nb_channels), dtype=np.uint8)
+    img = cv2.resize(small_img, (width, height), interpolation=cv2.INTER_LINEAR)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if gray else img
+
+
+def write_synthetic_images(images: Sequence[Image],
+                           output_dir: Path,
+                           seed: int = 0,
+                           gray_ratio: float = 0.2,
+                           nb_threads: int = 8) -> None:
+    """Write an image file for each image entry, with the size given by the entry.
+
+    Args:
+        images: The image entries.
+        output_dir: The folder in which the images are written.
+        seed: The seed of the dataset, each image is generated from it and its index (independently of the others).
+        gray_ratio: The fraction of the images which are gray (stored with 3 channels).
+        nb_threads: Number of threads encoding and writing the images (OpenCV releases the GIL).
+    """
+    def write_image(args: tuple[int, Image]) -> None:
+        i, image = args
+        rng = np.random.default_rng([seed, _PIXELS_STREAM, i])
+        img = make_synthetic_image(image["width"], image["height"], rng, gray=rng.uniform() < gray_ratio)
+        img_path = output_dir / image["file_name"]
+        if not cv2.imwrite(str(img_path), img):
+            raise ValueError(f"Could not write the image {img_path}")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, nb_threads)) as executor:
+        list(executor.map(write_image, enumerate(images)))
+
+
+def write_voc_annotations(images: Sequence[Image],
+                          annotations: Sequence[Annotation],
+                          categories: Sequence[Category],
+                          output_dir: Path) -> None:
+    """Save the boxes of a dataset as PascalVOC xml files (one per image, named after the image).
+
+    Args:
+        images: The image entries.
+        annotations: The annotation entries.
+        categories: The category entries.
+        output_dir: The folder in which the xml files are written.
+    """
+    cat_names = {category["id"]: escape(category["name"]) for category in categories}
+    objects_per_img: dict[int, list[str]] = {image["id"]: [] for image in images}
+    for annotation in annotations:
+        x, y, width, height = annotation["bbox"]
+        objects_per_img[annotation["image_id"]].append(
+            f"<object><name>{cat_names[annotation['category_id']]}</name><difficult>0</difficult><bndbox>"
+            f"<xmin>{round(x)}</xmin><ymin>{round(y)}</ymin><xmax>{round(x + width)}</xmax><ymax>{round(y + height)}"
+            "</ymax></bndbox></object>")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for image in images:
+        with open(output_dir / (Path(image["file_name"]).stem + ".xml"), "w", encoding="utf-8") as xml_file:
+            xml_file.write(f"<annotation><filename>{escape(image['file_name'])}</filename><size>"
+                           f"<width>{image['width']}</width><height>{image['height']}</height><depth>3</depth></size>"
+                           + "".join(objects_per_img[image["id"]]) + "</annotation>")
@@ -1,34 +1,180 @@
 import argparse
-import json
+from multiprocessing import Pool
 from pathlib import Path
 from typing import Optional
 
 import cv2
 import numpy as np
+import numpy.typing as npt
 
-from src.types.coco_types import Annotation, Category, Image
+from src.types.coco_types import Annotation, EncodedRLE, Image, RLE, TPolygon_segmentation
+from src.utils.coco_dataset import CocoDataset
 from src.utils.imgs_misc import show_img
-from src.utils.misc import clean_print
-from src.utils.segmentation_conversions import encoded_rle_to_rle, rle_to_mask
+from src.utils.misc import clean_print, get_nb_processes
+from src.utils.prefetch import FramePrefetcher
+from src.utils.profiling import add_profiling_args, count, stage, start_profiling
+from src.utils.segmentation_conversions import encoded_rle_to_rle, rle_to_intervals, rle_to_mask
 
+BBOX_THICKNESS = 2
+# Weight of the mask colors when blending them with the image.
+MASK_ALPHA = 0.3
+# Keys of the interactive viewer.
+NEXT_KEYS = "qnd "
+PREVIOUS_KEYS = "pab"
+QUIT_KEYS = "\x1b"  # Escape
 
-def get_class_from_id(cls_id: int, categories: list[Category]) -> str:
-    """Returns the string representation of the given class id.
+
+def get_colors(nb_colors: int, seed: int = 0) -> npt.NDArray[np.uint8]:
+    """Return random (but reproducible) colors, one per annotation."""
+    return np.random.default_rng(seed).integers(0, 255, size=(nb_colors, 3), dtype=np.uint8)
+
+
+def decode_segmentation(segmentation: TPolygon_segmentation | RLE | EncodedRLE,
+                        height: int,
+                        width: int) -> npt.NDArray[np.bool_]:
+    """Return the mask of a segmentation (in any of the COCO formats)."""
+    if isinstance(segmentation, list):
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(mask, [np.round(np.asarray(polygon).reshape(-1, 1, 2)).astype(np.int32)
+                            for polygon in segmentation], 1)
+        return mask.astype(np.bool_)
+    counts = segmentation["counts"]
+    return rle_to_mask(counts if isinstance(counts, list) else encoded_rle_to_rle(counts), height, width)
+
+
+def get_label_map(annotations: list[Annotation], height: int, width: int) -> npt.NDArray[np.int32]:
+    """Paint the segmentations of the annotations of an image in a single label map.
+
+    The map is filled in the transposed (column-major) layout, so that the runs of the RLEs are contiguous slices of
+    it, and the polygons are filled with their x and y swapped. Later annotations are painted over earlier ones.
 
     Args:
-        cls_id: The id whose class name should be returned.
-        categories: The list of categories from the coco dataset.
+        annotations: The annotations of the image.
+        height: The height of the image.
+        width: The width of the image.
 
     Returns:
-        The string representation for the given class id.
+        (height, width) Map with the index + 1 of the annotation covering each pixel (0 for the background).
 
     Raises:
-        ValueError: If `cls_id` is not in the categories.
+        ValueError: If the size of a RLE does not match the size of the image.
     """
-    for cat in categories:
-        if cat["id"] == cls_id:
-            return cat["name"]
-    raise ValueError(f"There is no class with the id {cls_id}")
+    transposed_map = np.zeros((width, height), dtype=np.int32)
+    flat_map = transposed_map.reshape(-1)
+    for label, annotation in enumerate(annotations, start=1):
+        if (segmentation := annotation.get("segmentation")) is None:
+            continue
+        if isinstance(segmentation, list):
+            if polygons := [np.round(np.asarray(polygon).reshape(-1, 1, 2)[..., ::-1]).astype(np.int32)
+                            for polygon in segmentation if len(polygon) >= 6]:
+                cv2.fillPoly(transposed_map, polygons, label)
+            continue
+        if list(segmentation["size"]) != [height, width]:
+            raise ValueError(f"The RLE of annotation {annotation['id']} has a size of {segmentation['size']}, but its "
+                             f"image is {height}x{width}.")
+        counts = segmentation["counts"]
+        starts, ends = rle_to_intervals(counts if isinstance(counts, list) else encoded_rle_to_rle(counts))
+        lengths = ends - starts
+        flat_map[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(int(lengths.sum()))] = label
+    return transposed_map.T
+
+
+def draw_annotations(img: npt.NDArray[np.uint8],
+                     annotations: list[Annotation],
+                     cat_names: dict[int, str],
+                     show_bbox: bool = False,
+                     seed: int = 0) -> npt.NDArray[np.uint8]:
+    """Draw the masks (and optionally the boxes and class names) of the annotations of an image.
+
+    All the masks are composited in a label map, which is then blended with the image in a single pass.
+
+    Args:
+        img: The image (BGR), it is modified inplace.
+        annotations: The annotations of the image.
+        cat_names: Maps the category ids to their names.
+        show_bbox: If True, draw the bounding boxes and the class names.
+        seed: Seed for the colors of the annotations.
+
+    Returns:
+        The image with the annotations drawn on it.
+    """
+    colors = get_colors(len(annotations), seed)
+    label_map = get_label_map(annotations, *img.shape[:2])
+    if (is_labeled := label_map > 0).any():
+        mask_colors = colors[label_map[is_labeled] - 1].astype(np.float32)
+        img[is_labeled] = (MASK_ALPHA * mask_colors + (1 - MASK_ALPHA) * img[is_labeled]).astype(np.uint8)
+
+    if show_bbox:
+        for annotation, color in zip(annotations, colors.tolist()):
+            top_x, top_y, width, height = (int(coord) for coord in annotation["bbox"])
+            cv2.rectangle(img, (top_x, top_y), (top_x+width, top_y+height), color, BBOX_THICKNESS)
+
+            # Add class
+            class_name = cat_names.get(annotation["category_id"], str(annotation["category_id"]))
+            text_width, text_height = cv2.getTextSize(class_name, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)[0]
+            cv2.rectangle(img,
+                          (top_x+BBOX_THICKNESS, top_y+BBOX_THICKNESS),
+                          (top_x+4*BBOX_THICKNESS+text_width, top_y+4*BBOX_THICKNESS+text_height),
+                          (0, 0, 0), -1)
+            cv2.putText(img, class_name, (top_x+2*BBOX_THICKNESS, top_y+2*BBOX_THICKNESS+text_height),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
+    return img
+
+
+def make_tile(img: npt.NDArray[np.uint8], caption: str, tile_width: int, tile_height: int) -> npt.NDArray[np.uint8]:
+    """Fit an image (keeping its aspect ratio) in a tile of a mosaic, with a caption at the bottom."""
+    tile = np.zeros((tile_height, tile_width, 3), dtype=np.uint8)
+    caption_height = 20
+    scale = min(tile_width / img.shape[1], (tile_height - caption_height) / img.shape[0])
+    new_width, new_height = max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))
+    tile[:new_height, :new_width] = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    cv2.putText(tile, caption[-40:], (2, tile_height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1,
+                cv2.LINE_AA)
+    return tile
+
+
+def make_mosaic(tiles: list[npt.NDArray[np.uint8]], nb_columns: int) -> npt.NDArray[np.uint8]:
+    """Arrange tiles (all of the same size) in a grid."""
+    nb_rows = -(-len(tiles) // nb_columns)
+    tile_height, tile_width = tiles[0].shape[:2]
+    mosaic = np.zeros((nb_rows * tile_height, nb_columns * tile_width, 3), dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        row, column = divmod(i, nb_columns)
+        mosaic[row*tile_height:(row+1)*tile_height, column*tile_width:(column+1)*tile_width] = tile
+    return mosaic
+
+
+def render_image(img_entry: Image,
+                 annotations: list[Annotation],
+                 cat_names: dict[int, str],
+                 data_path: Path,
+                 show_bbox: bool,
+                 seed: int) -> Optional[npt.NDArray[np.uint8]]:
+    """Read an image and draw its annotations on it (see `draw_annotations`), None if the image cannot be read."""
+    if (img := cv2.imread(str(data_path / img_entry["file_name"]))) is None:
+        print(f"\nCould not read image {data_path / img_entry['file_name']}, skipping it.")
+        return None
+    return draw_annotations(img, annotations, cat_names, show_bbox, seed=seed)
+
+
+def render_worker(args: tuple[int, Image, list[Annotation], dict[int, str], Path, Path, bool, Optional[tuple[int, int]]]
+                  ) -> Optional[npt.NDArray[np.uint8]]:
+    """Draw the annotations of an image and save the result.
+
+    Args:
+        args: The index of the image (used as seed for the colors), the image entry, its annotations, the category
+              names, the directory with the images, the output directory, whether to draw the boxes, and the
+              (width, height) of the mosaic tiles (None if no mosaic is made).
+
+    Returns:
+        The tile of the image for the mosaic, if one is made (None otherwise or if the image could not be read).
+    """
+    img_idx, img_entry, annotations, cat_names, data_path, output_dir, show_bbox, tile_size = args
+    if (img := render_image(img_entry, annotations, cat_names, data_path, show_bbox, seed=img_idx)) is None:
+        return None
+    (output_path := output_dir / img_entry["file_name"]).parent.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(output_path), img)
+    return make_tile(img, img_entry["file_name"], *tile_size) if tile_size is not None else None
 
 
 def main():
@@ -41,7 +187,18 @@ def main():
     parser.add_argument("--show_bbox", "-sb", action="store_true", help="Show the bounding boxes.")
     parser.add_argument("--show_individual_masks", "-sm", action="store_true", help="Show the masks one by one.")
     parser.add_argument("--image_name", "-i", type=str, default=None,
-                        help="If given, only that image will be displayed.")
+                        help="If given, start directly with that image.")
+    parser.add_argument("--nb_prefetch", type=int, default=4,
+                        help="Number of images prepared in the background while the current one is shown.")
+    parser.add_argument("--cache_size", type=int, default=1024,
+                        help="Maximum size (in MB) of the already shown images kept in memory to step back instantly.")
+    parser.add_argument("--output_dir", "--output-dir", "-o", type=Path, default=None,
+                        help="If given, render all the images (in parallel) to this directory instead of showing them.")
+    parser.add_argument("--mosaic_size", type=int, default=0,
+                        help="With --output_dir, also save contact sheets of that many images (0 to disable).")
+    parser.add_argument("--tile_size", type=int, nargs=2, default=(320, 260),
+                        help="Width and height of the images in the contact sheets.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     data_path: Path = args.data_path
@@ -49,69 +206,81 @@ def main():
     show_bbox: bool = args.show_bbox
     show_individual_masks: bool = args.show_individual_masks
     img_name: Optional[str] = args.image_name
+    output_dir: Optional[Path] = args.output_dir
+    mosaic_size: int = args.mosaic_size
+    tile_size: tuple[int, int] = tuple(args.tile_size)
+    nb_prefetch: int = args.nb_prefetch
+    cache_size: int = args.cache_size
 
-    with open(json_path, "r", encoding="utf-8") as annotations_file:
-        coco_dataset = json.load(annotations_file)
+    start_profiling(args)
+    dataset = CocoDataset.from_json(json_path)
+    img_entries = dataset.images
+    cat_names = {category["id"]: category["name"] for category in dataset.categories}
+    nb_imgs = len(img_entries)
 
-    img_entries: list[Image] = coco_dataset["images"]
-    annotations: list[Annotation] = coco_dataset["annotations"]
-    categories: list[Category] = coco_dataset["categories"]
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        print(f"Rendering {nb_imgs} images to '{output_dir}'")
+        mosaic_tile_size = tile_size if mosaic_size > 0 else None
+        tiles: list[npt.NDArray[np.uint8]] = []
+        nb_mosaics = 0
 
-    bbox_thickness = 2
-    nb_imgs = len(img_entries)
-    for i, img_entry in enumerate(img_entries, start=1):
-        clean_print(f"Showing image: {img_entry['file_name']} ({i}/{nb_imgs})", end="\r" if i != nb_imgs else "\n")
+        def save_mosaic() -> None:
+            nonlocal tiles, nb_mosaics
+            (mosaic_dir := output_dir / "mosaics").mkdir(exist_ok=True)
+            cv2.imwrite(str(mosaic_dir / f"mosaic_{nb_mosaics:05d}.jpg"),
+                        make_mosaic(tiles, nb_columns=int(np.ceil(np.sqrt(mosaic_size)))))
+            nb_mosaics += 1
+            tiles = []
 
-        if img_name is not None and img_name != img_entry["file_name"]:
-            continue
+        worker_args = ((i, img_entry, dataset.get_img_annotations(img_entry["id"]), cat_names, data_path, output_dir,
+                        show_bbox, mosaic_tile_size) for i, img_entry in enumerate(img_entries))
+        with stage("image_io"), Pool(processes=get_nb_processes()) as pool:
+            for i, tile in enumerate(pool.imap(render_worker, worker_args, chunksize=8), start=1):
+                clean_print(f"Rendered image ({i}/{nb_imgs})", end="\r" if i != nb_imgs else "\n")
+                if tile is not None:
+                    tiles.append(tile)
+                    if len(tiles) == mosaic_size:
+                        save_mosaic()
+        if tiles:
+            save_mosaic()
+        count("images_rendered", nb_imgs)
+        print(f"Finished rendering the images{f' ({nb_mosaics} contact sheets)' if nb_mosaics else ''}.")
+        return
+
+    img_idx = 0
+    if img_name is not None:
+        img_idx_by_name = {img_entry["file_name"]: i for i, img_entry in enumerate(img_entries)}
+        if (img_idx := img_idx_by_name.get(img_name, -1)) == -1:
+            print(f"No image named {img_name} in the dataset.")
+            return
+
+    def render(idx: int) -> Optional[npt.NDArray[np.uint8]]:
+        img_entry = img_entries[idx]
+        return render_image(img_entry, dataset.get_img_annotations(img_entry["id"]), cat_names, data_path, show_bbox,
+                            seed=idx)
+
+    print(f"Controls: next image: {NEXT_KEYS!r}, previous image: {PREVIOUS_KEYS!r}, quit: Escape.")
+    with FramePrefetcher(render, nb_imgs, nb_prefetch=nb_prefetch, max_cache_bytes=cache_size * 2**20) as prefetcher:
+        while 0 <= img_idx < nb_imgs:
+            img_entry = img_entries[img_idx]
+            clean_print(f"Showing image: {img_entry['file_name']} ({img_idx + 1}/{nb_imgs})",
+                        end="\r" if img_idx + 1 != nb_imgs else "\n")
+            if (img := prefetcher.get(img_idx)) is None:
+                img_idx += 1
+                continue
 
-        img = cv2.imread(str(data_path / img_entry["file_name"]))
-
-        img_annotations = [annotation for annotation in annotations
-                           if annotation["image_id"] == img_entry["id"]]
-        for annotation in img_annotations:
-            color = np.random.randint(0, high=255, size=3, dtype=np.uint8)
-            # Add the segmentation masks
-            if "segmentation" in annotation:
-                segmentation = annotation["segmentation"]
-                if isinstance(segmentation, list):
-                    # Polygon
-                    # Old code snipet.
-                    # points: list[dict[str, float]] = region["points"]
-                    # pts = np.asarray([[point["x"], point["y"]] for point in points], dtype=np.int32)
-                    # pts = pts.reshape((-1, 1, 2))
-                    # img = cv2.fillPoly(img, [pts], color)
-                    raise NotImplementedError("Polygon segmentation is not implemented yet.")
-                else:
-                    if isinstance(segmentation["counts"], list):
-                        mask = rle_to_mask(segmentation["counts"], *segmentation["size"])
-                    else:
-                        rle = encoded_rle_to_rle(segmentation["counts"])
-                        mask = rle_to_mask(rle, *segmentation["size"])
-                mask = color * np.expand_dims(mask, -1)
-                if show_individual_masks:
-                    show_img(mask, get_class_from_id(annotation["category_id"], categories))
-                img = np.where(mask, 0.3*mask + 0.7*img, img).astype(np.uint8)
-
-            # Add the bounding boxes to the image
-            if show_bbox:
-                top_x, top_y, width, height = annotation["bbox"]
-                top_x, top_y, width, height = int(top_x), int(top_y), int(width), int(height)
-                cv2.rectangle(img,
-                              (top_x, top_y),
-                              (top_x+width, top_y+height),
-                              tuple(int(c) for c in color), bbox_thickness)
-
-                # Add class
-                class_name = get_class_from_id(annotation["category_id"], categories)
-                text_width, text_height = cv2.getTextSize(class_name, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)[0]
-                cv2.rectangle(img,
-                              (top_x+bbox_thickness, top_y+bbox_thickness),
-                              (top_x+4*bbox_thickness+text_width, top_y+4*bbox_thickness+text_height),
-                              (0, 0, 0), -1)
-                cv2.putText(img, class_name, (top_x+2*bbox_thickness, top_y+2*bbox_thickness+text_height),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
-        show_img(img, img_entry["file_name"])
+            if show_individual_masks:
+                annotations = dataset.get_img_annotations(img_entry["id"])
+                for annotation, color in zip(annotations, get_colors(len(annotations), seed=img_idx)):
+                    if "segmentation" in annotation:
+                        mask = decode_segmentation(annotation["segmentation"], *img.shape[:2])
+                        show_img(color * np.expand_dims(mask, -1).astype(np.uint8),
+                                 cat_names.get(annotation["category_id"], str(annotation["category_id"])))
+            key = show_img(img, img_entry["file_name"], exit_keys=NEXT_KEYS + PREVIOUS_KEYS + QUIT_KEYS)
+            if key in QUIT_KEYS:
+                break
+            img_idx = max(img_idx - 1, 0) if key in PREVIOUS_KEYS else img_idx + 1
 
 
 if __name__ == "__main__":
@@ -8,6 +8,8 @@ import cv2
 import matplotlib.pyplot as plt
 from pycocotools.coco import COCO
 
+from src.utils.profiling import add_profiling_args, start_profiling
+
 
 def main():
     parser = argparse.ArgumentParser(description="Tool to visualize coco labels.",
@@ -17,6 +19,7 @@ def main():
     parser.add_argument("--show_bbox", "-sb", action="store_true", help="Show the bounding boxes.")
     parser.add_argument("--image_name", "-i", type=str, default=None,
                         help="If given, only that image will be displayed.")
+    add_profiling_args(parser)
     args = parser.parse_args()
 
     data_path: Path = args.data_path
@@ -24,6 +27,7 @@ def main():
     show_bbox: bool = args.show_bbox
     img_name: Optional[str] = args.image_name
 
+    start_profiling(args)
     coco = COCO(json_path)
 
     # Get all the image ids.
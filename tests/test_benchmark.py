@@ -0,0 +1,74 @@
+"""Tests for the benchmark suite."""
+import sys
+from pathlib import Path
+
+import pytest
+
+from src.benchmark import (
+    append_to_history,
+    ENTRY_POINT_CASES,
+    EntryPointCase,
+    format_results,
+    FUNCTION_CASES,
+    generate_dataset,
+    get_previous_results,
+    load_history,
+    run_command,
+    run_entry_point_case,
+    run_function_benchmark,
+)
+from src.utils.synthetic_coco import SyntheticConfig
+
+TINY_CONFIG = SyntheticConfig(nb_images=8, nb_annotations=40, nb_categories=3, img_sizes=((48, 32), (32, 48)),
+                              segmentation_mix=(0.6, 0.2, 0.2))
+
+
+@pytest.fixture(scope="module")
+def dataset_path(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    dataset_path = tmp_path_factory.mktemp("benchmark") / "dataset"
+    generate_dataset(TINY_CONFIG, dataset_path, inputs=("images", "voc"))
+    return dataset_path
+
+
+def test_run_command(tmp_path: Path):
+    wall_time, max_rss, exit_code = run_command([sys.executable, "-c", "x = bytearray(200 * 2**20); print('done')"],
+                                                tmp_path / "log.txt")
+    assert exit_code == 0 and wall_time > 0
+    assert 200 < max_rss < 400
+    assert (tmp_path / "log.txt").read_text().strip() == "done"
+
+    _, _, exit_code = run_command([sys.executable, "-c", "raise SystemExit(3)"], tmp_path / "log.txt")
+    assert exit_code == 3
+
+
+@pytest.mark.parametrize("case", ENTRY_POINT_CASES, ids=[case.name for case in ENTRY_POINT_CASES])
+def test_run_entry_point_case(case: EntryPointCase, dataset_path: Path, tmp_path: Path):
+    result = run_entry_point_case(case, TINY_CONFIG, dataset_path, tmp_path / "case")
+    assert result["exit_code"] == 0, (tmp_path / "case" / "log.txt").read_text()
+    assert (dataset_path / "annotations.json").exists()
+
+
+@pytest.mark.parametrize("function_name", list(FUNCTION_CASES))
+def test_run_function_benchmark(function_name: str, dataset_path: Path):
+    result = run_function_benchmark(function_name, dataset_path / "annotations.json")
+    assert result["wall_time"] > 0 and result["setup_max_rss_mb"] > 0
+
+
+def test_history(tmp_path: Path):
+    history_path = tmp_path / "history.json"
+    assert load_history(history_path) == []
+    first_results = [{"benchmark": "coco_stats", "scale": "small", "wall_time": 1., "max_rss_mb": 100., "exit_code": 0},
+                     {"benchmark": "resize_coco", "scale": "small", "wall_time": 2., "max_rss_mb": 90., "exit_code": 0}]
+    append_to_history(history_path, {"commit": "a", "results": first_results})
+    failed_results = [{"benchmark": "resize_coco", "scale": "small", "wall_time": 0., "max_rss_mb": 0., "exit_code": 1}]
+    append_to_history(history_path, {"commit": "b", "results": failed_results})
+    assert [run["commit"] for run in load_history(history_path)] == ["a", "b"]
+
+    previous_results = get_previous_results(load_history(history_path))
+    assert previous_results["resize_coco", "small"]["commit"] == "a"  # The failed run is ignored.
+
+    new_results = [{"benchmark": "coco_stats", "scale": "small", "wall_time": 1.1, "max_rss_mb": 50., "exit_code": 0},
+                   {"benchmark": "coco_stats", "scale": "medium", "wall_time": 3., "max_rss_mb": 50., "exit_code": 0}]
+    table = format_results(new_results, previous_results).splitlines()
+    assert "+10.0%" in table[1] and "-50.0%" in table[1]
+    assert "%" not in table[2]
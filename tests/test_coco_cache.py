@@ -0,0 +1,36 @@
+"""Tests for the columnar cache of COCO annotations files."""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from src.utils.coco_cache import is_cache_valid, load_coco_columns
+
+
+def test_load_coco_columns(tmp_path: Path):
+    json_path = tmp_path / "annotations.json"
+    images = [{"id": 7, "width": 40, "height": 30, "file_name": "a.png"},
+              {"id": 2, "width": 50, "height": 20, "file_name": "b.png"}]
+    annotations = [{"id": i, "image_id": image_id, "category_id": i % 2, "segmentation": [], "area": float(i),
+                    "bbox": [i, 0.0, 1.0, 2.0], "iscrowd": 0}
+                   for i, image_id in enumerate([2, 7, 2, 99])]
+    json_path.write_text(json.dumps({"images": images, "annotations": annotations, "categories": []}))
+
+    columns = load_coco_columns(json_path)
+    assert is_cache_valid(json_path)
+    np.testing.assert_array_equal(columns.img_ids, [7, 2])
+    np.testing.assert_array_equal(columns.img_heights, [30, 20])
+    # Annotations are grouped by image, the one with an unknown image id is last.
+    np.testing.assert_array_equal(columns.img_ann_offsets, [0, 1, 3])
+    np.testing.assert_array_equal(columns.ann_ids, [1, 0, 2, 3])
+    np.testing.assert_array_equal(columns.ann_ids[columns.get_img_slice(1)], [0, 2])
+    np.testing.assert_array_equal(columns.ann_bboxes[:, 0], [1, 0, 2, 3])
+    np.testing.assert_array_equal(columns.ann_positions, [1, 0, 2, 3])
+
+    # Modifying the json file invalidates the cache.
+    stat = json_path.stat()
+    os.utime(json_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert not is_cache_valid(json_path)
+    load_coco_columns(json_path)
+    assert is_cache_valid(json_path)
@@ -0,0 +1,29 @@
+"""Tests for the indexed COCO dataset."""
+import pytest
+
+from src.utils.coco_dataset import CocoDataset
+
+
+@pytest.fixture
+def dataset() -> CocoDataset:
+    images = [{"id": 3, "width": 40, "height": 30, "file_name": "a.png"},
+              {"id": 5, "width": 40, "height": 30, "file_name": "b.png"}]
+    annotations = [{"id": i, "image_id": 5, "category_id": 1, "segmentation": [], "area": 1.0,
+                    "bbox": [0.0, 0.0, 1.0, 1.0], "iscrowd": 0} for i in range(3)]
+    categories = [{"id": 1, "name": "square", "supercategory": "shape"}]
+    return CocoDataset(images, annotations, categories)  # type: ignore
+
+
+def test_indexes(dataset: CocoDataset):
+    assert dataset.get_img(5)["file_name"] == "b.png"
+    assert dataset.get_img_by_name("a.png")["id"] == 3
+    assert [ann["id"] for ann in dataset.get_img_annotations(5)] == [0, 1, 2]
+    assert dataset.get_img_annotations(3) == []
+    assert dataset.get_category(1)["name"] == "square"
+
+
+def test_missing_entries(dataset: CocoDataset):
+    with pytest.raises(ValueError):
+        dataset.get_img(4)
+    with pytest.raises(ValueError):
+        dataset.get_category(0)
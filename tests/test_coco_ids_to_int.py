@@ -0,0 +1,39 @@
+"""Tests for the id normalization and deduplication of the images and annotations."""
+from pathlib import Path
+
+from src.coco_ids_to_int import hash_images, normalize_ids
+from src.types.coco_types import Annotation, Image
+
+
+def get_entries() -> tuple[list[Image], list[Annotation]]:
+    images = [{"id": "a", "file_name": "a.jpg"}, {"id": "b", "file_name": "b.jpg"}, {"id": "a", "file_name": "x.jpg"},
+              {"id": "c", "file_name": "a.jpg"}]
+    annotations = [{"id": "0", "image_id": "a"}, {"id": "1", "image_id": "c"}, {"id": "0", "image_id": "b"},
+                   {"id": "2", "image_id": "missing"}, {"id": "3", "image_id": "b"}]
+    return images, annotations  # type: ignore
+
+
+def test_normalize_ids():
+    images, annotations = get_entries()
+    normalized = normalize_ids(images, annotations)
+    assert normalized.images == [{"id": 0, "file_name": "a.jpg"}, {"id": 1, "file_name": "b.jpg"},
+                                 {"id": 2, "file_name": "a.jpg"}]
+    assert normalized.annotations == [{"id": 0, "image_id": 0}, {"id": 1, "image_id": 2}, {"id": 2, "image_id": 1}]
+    assert normalized.image_id_map == {"a": 0, "b": 1, "c": 2}
+    assert normalized.annotation_id_map == {"0": 0, "1": 1, "3": 2}
+    assert normalized.nb_orphan_annotations == 1
+
+    images, annotations = get_entries()
+    merged = normalize_ids(images, annotations, [image["file_name"] for image in images])
+    assert merged.images == [{"id": 0, "file_name": "a.jpg"}, {"id": 1, "file_name": "b.jpg"}]
+    assert merged.annotations == [{"id": 0, "image_id": 0}, {"id": 1, "image_id": 0}, {"id": 2, "image_id": 1}]
+    assert merged.image_id_map == {"a": 0, "b": 1, "c": 0}
+
+
+def test_hash_images(tmp_path: Path):
+    (tmp_path / "a.jpg").write_bytes(b"same")
+    (tmp_path / "b.jpg").write_bytes(b"same")
+    (tmp_path / "c.jpg").write_bytes(b"other")
+    hashes = hash_images([{"file_name": name} for name in ("a.jpg", "b.jpg", "c.jpg", "d.jpg")],  # type: ignore
+                         tmp_path, nb_threads=2)
+    assert hashes[0] == hashes[1] and hashes[0] != hashes[2] and hashes[3] is None
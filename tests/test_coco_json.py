@@ -0,0 +1,62 @@
+"""Tests for the incremental reading and writing of COCO annotations files."""
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.utils.coco_json import CocoJsonWriter, iter_coco_entries, save_coco_json
+
+COCO_DATASET = {
+    "info": {"description": "test [dataset]", "version": 1.0},
+    "images": [{"id": 0, "width": 40, "height": 30, "file_name": "a.png"},
+               {"id": 123456789, "width": 40, "height": 30, "file_name": "b\"}, ]"}],
+    "annotations": [{"id": 0, "image_id": 0, "category_id": 1, "segmentation": {"size": [30, 40], "counts": "PT2"},
+                     "area": 1.5, "bbox": [0.0, 0.0, 1.0, 1.0], "iscrowd": 0}],
+    "categories": [{"id": 1, "name": "square", "supercategory": "shape"}],
+}
+
+
+@pytest.mark.parametrize("indent", [None, 4])
+@pytest.mark.parametrize("chunk_size", [1, 5, 2**20])
+def test_iter_coco_entries(tmp_path: Path, indent: int | None, chunk_size: int):
+    json_path = tmp_path / "annotations.json"
+    json_path.write_text(json.dumps(COCO_DATASET, indent=indent), encoding="utf-8")
+
+    entries = list(iter_coco_entries(json_path, chunk_size=chunk_size))
+    assert entries == [(section, entry) for section in ("images", "annotations", "categories")
+                       for entry in COCO_DATASET[section]]
+
+    categories = list(iter_coco_entries(json_path, sections=("categories",), chunk_size=chunk_size))
+    assert categories == [("categories", COCO_DATASET["categories"][0])]
+
+
+def test_writer_in_place(tmp_path: Path):
+    json_path = tmp_path / "annotations.json"
+    json_path.write_text(json.dumps(COCO_DATASET), encoding="utf-8")
+
+    with CocoJsonWriter(json_path) as writer:
+        for section, entry in iter_coco_entries(json_path, sections=("images", "categories")):
+            writer.write_entry(section, entry)
+
+    assert json.loads(json_path.read_text(encoding="utf-8")) == {
+        "images": COCO_DATASET["images"], "annotations": [], "categories": COCO_DATASET["categories"]}
+    assert list(tmp_path.iterdir()) == [json_path]
+
+
+def test_save_pretty_matches_json_dump(tmp_path: Path):
+    json_path = tmp_path / "annotations.json"
+    coco_dataset = {section: COCO_DATASET[section] for section in ("images", "annotations", "categories")}
+    save_coco_json(json_path, coco_dataset)
+    assert json_path.read_text(encoding="utf-8") == json.dumps(coco_dataset, indent=4)
+
+
+def test_save_compact_numpy(tmp_path: Path):
+    json_path = tmp_path / "annotations.json"
+    annotation = {"id": np.int64(3), "area": np.float32(2.5), "iscrowd": np.bool_(False),
+                  "segmentation": {"size": [2, 3], "counts": np.asarray([1, 2, 3], dtype=np.uint32)}}
+    save_coco_json(json_path, {"annotations": [annotation]}, compact=True)
+    expected_annotation = {"id": 3, "area": 2.5, "iscrowd": False,
+                           "segmentation": {"size": [2, 3], "counts": [1, 2, 3]}}
+    assert json.loads(json_path.read_text(encoding="utf-8")) == {
+        "annotations": [expected_annotation], "images": [], "categories": []}
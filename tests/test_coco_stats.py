@@ -0,0 +1,50 @@
+"""Tests for the dataset statistics."""
+from pathlib import Path
+
+import pytest
+
+from src.coco_stats import compute_stats, format_stats
+from src.utils.coco_json import save_coco_json
+
+
+@pytest.mark.parametrize("chunk_size", [2, 2**16])
+def test_compute_stats(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, chunk_size: int):
+    monkeypatch.setattr("src.coco_stats.CHUNK_SIZE", chunk_size)
+    dataset = {
+        "images": [{"id": 0, "file_name": "a.jpg", "width": 640, "height": 480},
+                   {"id": 1, "file_name": "b.jpg", "width": 640, "height": 480},
+                   {"id": 2, "file_name": "c.jpg", "width": 1920, "height": 1080}],
+        "annotations": [
+            {"id": 0, "image_id": 0, "category_id": 1, "segmentation": [[0., 0., 10., 0., 10., 10.]], "area": 50.,
+             "bbox": [0., 0., 10., 10.], "iscrowd": 0},
+            {"id": 1, "image_id": 0, "category_id": 2, "segmentation": {"size": [480, 640], "counts": [10, 5, 10]},
+             "area": 5000., "bbox": [0., 0., 100., 50.], "iscrowd": 1},
+            {"id": 2, "image_id": 2, "category_id": 1, "segmentation": {"size": [1080, 1920], "counts": "abc"},
+             "area": 20000., "bbox": [10., 10., 200., 100.], "iscrowd": 0},
+            {"id": 3, "image_id": 5, "category_id": 1, "segmentation": [], "area": 0., "bbox": [0., 0., 0., 5.],
+             "iscrowd": 0},
+        ],
+        "categories": [{"id": 1, "name": "cat", "supercategory": "animal"},
+                       {"id": 2, "name": "dog", "supercategory": "animal"}],
+    }
+    save_coco_json(json_path := tmp_path / "annotations.json", dataset)
+    stats = compute_stats(json_path)
+
+    assert (stats["nb_images"], stats["nb_annotations"], stats["nb_categories"]) == (3, 4, 2)
+    assert stats["nb_images_without_annotations"] == 1
+    assert stats["nb_annotations_without_image"] == 1
+    assert stats["iscrowd_ratio"] == 0.25
+    assert stats["segmentation_formats"] == {"polygon": 1, "rle": 1, "encoded_rle": 1, "none": 1}
+    assert [(category["name"], category["nb_instances"], category["nb_crowd"]) for category in stats["categories"]] \
+        == [("cat", 3, 0), ("dog", 1, 1)]
+    assert stats["instances_per_image"]["max"] == 2
+    assert list(stats["instances_per_image"]["histogram"].values())[:3] == [1, 1, 1]
+    assert stats["bboxes"]["nb_degenerate"] == 1
+    assert stats["bboxes"]["size_histogram"]["[8, 16)"] == 1
+    assert stats["bboxes"]["size_histogram"]["[64, 96)"] == 1
+    assert stats["bboxes"]["size_histogram"]["[128, 256)"] == 1
+    assert stats["bboxes"]["aspect_ratio_histogram"]["[1, 1.5)"] == 1
+    assert stats["bboxes"]["aspect_ratio_histogram"]["[2, 3)"] == 2
+    assert stats["coco_area_ranges"] == {"small": 2, "medium": 1, "large": 1}
+    assert stats["image_resolutions"]["most_common"][0] == {"width": 640, "height": 480, "nb_images": 2}
+    assert "Annotations: 4" in format_stats(stats)
@@ -0,0 +1,42 @@
+"""Tests for the PascalVOC to COCO conversion."""
+from pathlib import Path
+
+from src.convert_VOC_to_coco import get_categories, iter_coco_annotations, iter_coco_images, parse_voc_chunk
+
+
+def write_xml(path: Path, file_name: str, objects: list[tuple[str, tuple[float, float, float, float], int]]) -> None:
+    objects_xml = "".join(f"<object><name>{name}</name><difficult>{difficult}</difficult><bndbox><xmin>{bbox[0]}</xmin>"
+                          f"<ymin>{bbox[1]}</ymin><xmax>{bbox[2]}</xmax><ymax>{bbox[3]}</ymax></bndbox></object>"
+                          for name, bbox, difficult in objects)
+    path.write_text(f"<annotation><filename>{file_name}</filename><size><width>60</width><height>40</height>"
+                    f"<depth>3</depth></size>{objects_xml}</annotation>")
+
+
+def test_convert_voc(tmp_path: Path):
+    write_xml(tmp_path / "a.xml", "a.jpg", [("dog", (1, 2, 11, 22), 0), ("cat", (5, 5, 10, 10), 1)])
+    write_xml(tmp_path / "b.xml", "b.jpg", [])
+    write_xml(tmp_path / "c.xml", "c.jpg", [("bird", (0, 0, 4, 4), 0)])
+    chunks = [parse_voc_chunk([tmp_path / "a.xml", tmp_path / "b.xml"]), parse_voc_chunk([tmp_path / "c.xml"])]
+
+    categories = get_categories(chunks)
+    assert [(category["id"], category["name"]) for category in categories] == [(0, "bird"), (1, "cat"), (2, "dog")]
+    assert [(image["id"], image["file_name"], image["width"]) for image in iter_coco_images(chunks)] == [
+        (0, "a.jpg", 60), (1, "b.jpg", 60), (2, "c.jpg", 60)]
+
+    annotations = list(iter_coco_annotations(chunks, categories, "crowd"))
+    assert annotations == [
+        {"id": 0, "image_id": 0, "category_id": 2, "segmentation": [], "area": 200, "bbox": [1, 2, 10, 20],
+         "iscrowd": 0},
+        {"id": 1, "image_id": 0, "category_id": 1, "segmentation": [], "area": 25, "bbox": [5, 5, 5, 5],
+         "iscrowd": 1},
+        {"id": 2, "image_id": 2, "category_id": 0, "segmentation": [], "area": 16, "bbox": [0, 0, 4, 4],
+         "iscrowd": 0},
+    ]
+    assert [(annotation["id"], annotation["image_id"])
+            for annotation in iter_coco_annotations(chunks, categories, "skip")] == [(0, 0), (1, 2)]
+    assert [(annotation["iscrowd"], annotation["difficult"])  # type: ignore
+            for annotation in iter_coco_annotations(chunks, categories, "attribute")] == [(0, 0), (0, 1), (0, 0)]
+
+    write_xml(tmp_path / "d.xml", "d.jpg", [("dog", (1.5, 2, 11, 22), 0)])
+    annotation, = iter_coco_annotations([parse_voc_chunk([tmp_path / "d.xml"])], categories)
+    assert annotation["bbox"] == [1.5, 2., 9.5, 20.] and annotation["area"] == 190.
@@ -0,0 +1,54 @@
+"""Tests for the conversion of the segmentation formats."""
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from src.convert_segmentation_type import convert_annotations, convert_entries
+from src.types.coco_types import Annotation
+from src.utils.segmentation_conversions import polygon_to_rle, rle_to_encoded_rle
+
+
+def get_annotations() -> list[Annotation]:
+    polygon = [[0.5, 0.5, 2.5, 0.5, 2.5, 2.5, 0.5, 2.5]]
+    rle = polygon_to_rle(polygon, 4, 5).tolist()
+    return [
+        {"id": 0, "image_id": 0, "category_id": 0, "segmentation": polygon, "area": 4., "bbox": [1., 1., 2., 2.],
+         "iscrowd": 0},
+        {"id": 1, "image_id": 0, "category_id": 0, "segmentation": {"size": [4, 5], "counts": rle}, "area": 4.,
+         "bbox": [1., 1., 2., 2.], "iscrowd": 0},
+        {"id": 2, "image_id": 0, "category_id": 0,
+         "segmentation": {"size": [4, 5], "counts": rle_to_encoded_rle(rle)}, "area": 4., "bbox": [1., 1., 2., 2.],
+         "iscrowd": 0},
+    ]
+
+
+def test_convert_annotations():
+    rle = polygon_to_rle([[0.5, 0.5, 2.5, 0.5, 2.5, 2.5, 0.5, 2.5]], 4, 5).tolist()
+
+    converted = convert_annotations(get_annotations(), [(4, 5)] * 3, "rle")
+    assert [annotation["segmentation"]["size"] for annotation in converted] == [[4, 5]] * 3  # type: ignore
+    assert [list(annotation["segmentation"]["counts"]) for annotation in converted] == [rle] * 3  # type: ignore
+
+    converted = convert_annotations(get_annotations(), [(4, 5)] * 3, "encoded_rle")
+    encoded_counts = [annotation["segmentation"]["counts"] for annotation in converted]  # type: ignore
+    assert encoded_counts == [rle_to_encoded_rle(rle)] * 3
+
+
+def test_convert_annotations_to_polygons():
+    converted = convert_annotations(get_annotations(), [None] * 3, "polygon")
+    square = [[1., 1., 1., 3., 3., 3., 3., 1.]]
+    assert converted[0]["segmentation"] == [[0.5, 0.5, 2.5, 0.5, 2.5, 2.5, 0.5, 2.5]]
+    assert [annotation["segmentation"] for annotation in converted[1:]] == [square] * 2
+
+
+def test_convert_entries_keeps_order(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr("src.convert_segmentation_type.BATCH_SIZE", 64)
+    entries = [("images", {"id": 0, "width": 5, "height": 4, "file_name": "a.jpg"}),
+               *[("annotations", {**annotation, "id": i}) for i in range(700) for annotation in get_annotations()[:1]],
+               ("categories", {"id": 0, "name": "a", "supercategory": "a"})]
+    with ThreadPool(2) as pool:
+        converted = list(convert_entries(entries, {0: (4, 5)}, "encoded_rle", pool, max_pending_batches=1))
+    assert [section for section, _ in converted] == [section for section, _ in entries]
+    assert [entry["id"] for section, entry in converted if section == "annotations"] == list(range(700))
+    assert all(isinstance(entry["segmentation"]["counts"], str) for section, entry in converted
+               if section == "annotations")
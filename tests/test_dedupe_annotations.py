@@ -0,0 +1,46 @@
+"""Tests for the detection of duplicate annotations."""
+import numpy as np
+import pytest
+
+from src.dedupe_annotations import boxes_iou, find_duplicates
+from src.types.coco_types import Annotation
+
+
+def random_annotations(nb_annotations: int, seed: int = 0) -> list[Annotation]:
+    rng = np.random.default_rng(seed)
+    annotations: list[Annotation] = []
+    for i in range(nb_annotations):
+        if annotations and rng.random() < 0.3:
+            # Slightly moved copy of a previous annotation.
+            bbox = (np.asarray(annotations[rng.integers(len(annotations))]["bbox"]) + rng.normal(0, 1, 4)).tolist()
+            image_id, category_id = annotations[-1]["image_id"], annotations[-1]["category_id"]
+        else:
+            bbox = [*rng.uniform(0, 100, 2), *rng.uniform(1, 30, 2)]
+            image_id, category_id = int(rng.integers(5)), int(rng.integers(2))
+        annotations.append({"id": i, "image_id": image_id, "category_id": category_id, "segmentation": [],
+                            "area": bbox[2] * bbox[3], "bbox": bbox, "iscrowd": 0})
+    return annotations
+
+
+@pytest.mark.parametrize("max_candidates", [1, 2**22])
+def test_find_duplicates(monkeypatch: pytest.MonkeyPatch, max_candidates: int):
+    monkeypatch.setattr("src.dedupe_annotations.MAX_CANDIDATES_PER_CHUNK", max_candidates)
+    annotations = random_annotations(300)
+    first_idx, second_idx, ious = find_duplicates(annotations, 0.7)
+
+    boxes = np.asarray([annotation["bbox"] for annotation in annotations])
+    boxes[:, 2:] += boxes[:, :2]
+    all_first, all_second = np.triu_indices(len(annotations), k=1)
+    all_ious = boxes_iou(boxes[all_first], boxes[all_second])
+    same_group = np.asarray([annotations[i]["image_id"] == annotations[j]["image_id"]
+                             and annotations[i]["category_id"] == annotations[j]["category_id"]
+                             for i, j in zip(all_first, all_second)])
+    expected = same_group & (all_ious >= 0.7)
+    assert len(ious) > 0
+    np.testing.assert_array_equal(first_idx, all_first[expected])
+    np.testing.assert_array_equal(second_idx, all_second[expected])
+    np.testing.assert_allclose(ious, all_ious[expected])
+
+
+def test_find_duplicates_empty():
+    assert all(len(array) == 0 for array in find_duplicates([], 0.5))
@@ -0,0 +1,51 @@
+"""Tests for the copy/link/reflink materialization of files."""
+import os
+from pathlib import Path
+
+import pytest
+
+from src.utils.file_transfer import is_up_to_date, LINK_MODES, materialize_file, materialize_files
+
+
+@pytest.fixture
+def src_files(tmp_path: Path) -> list[Path]:
+    (src_dir := tmp_path / "src").mkdir()
+    paths = []
+    for i in range(5):
+        (path := src_dir / f"img_{i}.jpg").write_bytes(bytes(range(i, i + 100)) * (i + 1))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("mode", LINK_MODES)
+def test_materialize_files(tmp_path: Path, src_files: list[Path], mode: str):
+    path_pairs = [(path, tmp_path / "out" / "images" / path.name) for path in src_files]
+    assert materialize_files(path_pairs, mode=mode, nb_workers=2) == (len(src_files), 0)  # type: ignore
+    for src_path, dst_path in path_pairs:
+        assert dst_path.read_bytes() == src_path.read_bytes()
+        assert is_up_to_date(src_path, dst_path)
+    if mode == "symlink":
+        assert all(dst_path.is_symlink() for _, dst_path in path_pairs)
+    elif mode == "hardlink":
+        assert all(os.path.samefile(src_path, dst_path) for src_path, dst_path in path_pairs)
+
+    # Second run, everything is already there.
+    assert materialize_files(path_pairs, mode=mode, nb_workers=2) == (0, len(src_files))  # type: ignore
+
+
+def test_materialize_file_replaces_outdated(tmp_path: Path, src_files: list[Path]):
+    dst_path = tmp_path / src_files[0].name
+    dst_path.write_bytes(b"old content")
+    assert materialize_file(src_files[0], dst_path, mode="reflink")
+    assert dst_path.read_bytes() == src_files[0].read_bytes()
+
+    dst_path.write_bytes(b"old content")
+    assert materialize_file(src_files[0], dst_path, mode="hardlink")
+    assert os.path.samefile(src_files[0], dst_path)
+
+
+def test_materialize_move(tmp_path: Path, src_files: list[Path]):
+    content = src_files[0].read_bytes()
+    assert materialize_file(src_files[0], dst_path := tmp_path / "moved.jpg", mode="move")
+    assert not src_files[0].exists()
+    assert dst_path.read_bytes() == content
@@ -0,0 +1,37 @@
+"""Tests for the near duplicate images search."""
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.find_near_duplicates import compute_hashes, get_duplicate_clusters
+from src.split_train_val_coco import get_split_units
+
+
+def test_find_near_duplicates(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(4):
+        img = cv2.resize((rng.random((12, 16, 3)) * 255).astype(np.uint8), (320, 240), interpolation=cv2.INTER_CUBIC)
+        cv2.imwrite(str(tmp_path / f"{i}.jpg"), img)
+        images.append({"id": i, "file_name": f"{i}.jpg", "width": 320, "height": 240})
+        if i == 0:
+            cv2.imwrite(str(tmp_path / "0_bis.jpg"), cv2.add(img, 2))
+            images.append({"id": 10, "file_name": "0_bis.jpg", "width": 320, "height": 240})
+    images.append({"id": 11, "file_name": "missing.jpg", "width": 320, "height": 240})
+
+    cache_path = tmp_path / "cache.json"
+    hashes = compute_hashes(images, tmp_path, cache_path)  # type: ignore
+    assert hashes[-1] is None and all(img_hashes is not None for img_hashes in hashes[:-1])
+    assert len(json.loads(cache_path.read_text())["entries"]) == 5
+    assert compute_hashes(images, tmp_path, cache_path) == hashes  # type: ignore
+
+    for hash_type in ("dhash", "phash"):
+        assert get_duplicate_clusters(images, hashes, hash_type, 4) == [["0.jpg", "0_bis.jpg"]]  # type: ignore
+
+
+def test_get_split_units():
+    images = [{"file_name": name} for name in ("a", "b", "c", "d")]
+    assert get_split_units(images) == [[0], [1], [2], [3]]  # type: ignore
+    assert get_split_units(images, [["d", "b"], ["x", "c"]]) == [[0], [1, 3], [2]]  # type: ignore
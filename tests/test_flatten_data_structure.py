@@ -0,0 +1,83 @@
+"""Tests for the flattening of a dataset."""
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+from src.flatten_data_structure import (
+    find_xml,
+    get_existing_outputs,
+    get_output_names,
+    rename_coco_images,
+    scan_dataset,
+)
+from src.utils.coco_json import save_coco_json
+
+
+def test_scan_dataset(tmp_path: Path):
+    for rel_path in ("b/img.jpg", "a/imgs/img.png", "a/labels/img.xml", "a/imgs/other.jpg", "a/imgs/other.xml",
+                     "a/imgs/notes.txt"):
+        (tmp_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel_path).touch()
+    img_paths, xml_paths = scan_dataset(tmp_path)
+    assert [path.relative_to(tmp_path).as_posix() for path in img_paths] == ["a/imgs/img.png", "a/imgs/other.jpg",
+                                                                             "b/img.jpg"]
+    assert find_xml(img_paths[0], xml_paths) == tmp_path / "a/labels/img.xml"
+    assert find_xml(img_paths[1], xml_paths) == tmp_path / "a/imgs/other.xml"
+    assert find_xml(img_paths[2], xml_paths) is None
+
+
+def test_get_output_names():
+    img_paths = [Path("a/img.jpg"), Path("b/img.jpg"), Path("c/img.jpg"), Path("d/img_1.jpg"), Path("e/img.png")]
+    assert get_output_names(img_paths, {"img_2.jpg"}) == ["img.jpg", "img_1.jpg", "img_3.jpg", "img_1_1.jpg",
+                                                          "img.png"]
+    assert get_output_names(img_paths, set(), by_stem=True) == ["img.jpg", "img_1.jpg", "img_2.jpg", "img_1_1.jpg",
+                                                                "img_3.png"]
+
+
+def test_get_existing_outputs(tmp_path: Path):
+    data_path, output_dir = tmp_path / "data", tmp_path / "out"
+    img_paths = [data_path / "a/img.jpg", data_path / "b/img.jpg", data_path / "c/new.jpg", data_path / "d/old.jpg"]
+    for i, img_path in enumerate(img_paths):
+        img_path.parent.mkdir(parents=True)
+        img_path.write_bytes(bytes(i + 1))
+    output_dir.mkdir()
+    shutil.copy2(img_paths[0], output_dir / "img.jpg")
+    shutil.copy2(img_paths[1], output_dir / "img_1.jpg")
+    (output_dir / "old.jpg").write_bytes(b"modified")
+    existing_names = get_existing_outputs(img_paths, data_path, output_dir, {"b/img.jpg": "img_1.jpg"})
+    assert existing_names == ["img.jpg", "img_1.jpg", None, None]
+
+
+def test_flatten_rerun(tmp_path: Path):
+    for rel_path in ("a/x.jpg", "b/x.jpg", "b/y.png"):
+        (tmp_path / "data" / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "data" / rel_path).write_text(rel_path)
+    command = [sys.executable, "-m", "src.flatten_data_structure", str(tmp_path / "data"), "-o", str(tmp_path / "out")]
+    subprocess.run(command, check=True, capture_output=True)
+    first_rename_map = json.loads((tmp_path / "out/rename_map.json").read_text())
+    assert first_rename_map == {"a/x.jpg": "x.jpg", "b/x.jpg": "x_1.jpg", "b/y.png": "y.png"}
+
+    # Running again does not copy the images a second time.
+    (tmp_path / "data/c").mkdir()
+    (tmp_path / "data/c/x.jpg").write_text("c/x.jpg")
+    subprocess.run(command, check=True, capture_output=True)
+    assert sorted(path.name for path in (tmp_path / "out").iterdir()) == ["rename_map.json", "x.jpg", "x_1.jpg",
+                                                                          "x_2.jpg", "y.png"]
+    assert json.loads((tmp_path / "out/rename_map.json").read_text()) == {**first_rename_map, "c/x.jpg": "x_2.jpg"}
+    assert (tmp_path / "out/x_2.jpg").read_text() == "c/x.jpg"
+
+
+def test_rename_coco_images(tmp_path: Path):
+    save_coco_json(tmp_path / "annotations.json", {
+        "images": [{"id": 0, "file_name": "a/img.jpg"}, {"id": 1, "file_name": "b/img.jpg"},
+                   {"id": 2, "file_name": "missing.jpg"}],
+        "annotations": [{"id": 0, "image_id": 1}],
+        "categories": [{"id": 0, "name": "cat"}]})
+    nb_unmapped = rename_coco_images(tmp_path / "annotations.json", tmp_path / "renamed.json",
+                                     {"a/img.jpg": "img.jpg", "b/img.jpg": "img_1.jpg"})
+    assert nb_unmapped == 1
+    renamed = json.loads((tmp_path / "renamed.json").read_text())
+    assert [image["file_name"] for image in renamed["images"]] == ["img.jpg", "img_1.jpg", "missing.jpg"]
+    assert renamed["annotations"] == [{"id": 0, "image_id": 1}]
@@ -0,0 +1,33 @@
+"""Tests for the parsing of the image headers."""
+import cv2
+import numpy as np
+import pytest
+
+from src.utils.image_headers import parse_image_header
+
+
+@pytest.fixture
+def img() -> np.ndarray:
+    return (np.random.default_rng(0).random((32, 48, 3)) * 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("quality", [5, 30, 50, 75, 95, 100])
+def test_parse_jpeg_header(img: np.ndarray, quality: int):
+    info = parse_image_header(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    assert info is not None and info.format == "jpeg" and info.nb_color_channels == 3
+    assert info.jpeg_quality == quality
+
+    info = parse_image_header(cv2.imencode(".jpg", img[..., 0], [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    assert info is not None and info.nb_color_channels == 1
+
+
+@pytest.mark.parametrize(("compression", "expected_compression"), [(1, 1), (6, 6), (9, 9)])
+def test_parse_png_header(img: np.ndarray, compression: int, expected_compression: int):
+    info = parse_image_header(cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, compression])[1].tobytes())
+    assert info is not None and info.format == "png" and info.nb_color_channels == 3 and info.bit_depth == 8
+    assert info.png_compression == expected_compression
+
+    info = parse_image_header(cv2.imencode(".png", img[..., 0].astype(np.uint16))[1].tobytes())
+    assert info is not None and info.nb_color_channels == 1 and info.bit_depth == 16
+
+    assert parse_image_header(b"not an image") is None
@@ -0,0 +1,36 @@
+"""Tests for the grayscale conversion worker."""
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.imgs_to_grayscale import ALREADY_GRAY, CONVERTED, SINGLE_CHANNEL, UNREADABLE, worker
+from src.utils.image_headers import parse_image_header
+
+
+def test_worker(tmp_path: Path):
+    img = (np.random.default_rng(0).random((32, 48, 3)) * 255).astype(np.uint8)
+    cv2.imwrite(str(color_path := tmp_path / "color.jpg"), img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    cv2.imwrite(str(single_channel_path := tmp_path / "single_channel.png"), img[..., 0])
+    cv2.imwrite(str(gray_path := tmp_path / "gray.png"), cv2.cvtColor(img[..., 0], cv2.COLOR_GRAY2BGR))
+    (unreadable_path := tmp_path / "unreadable.jpg").write_bytes(b"not an image")
+    color_data = color_path.read_bytes()
+
+    assert worker((color_path, "{}", 2, False, True)) == (CONVERTED, None)
+    assert color_path.read_bytes() == color_data
+
+    status, record = worker((color_path, "{}", 2, False, False))
+    assert status == CONVERTED and record is not None and record.output_path == str(color_path)
+    converted_img = cv2.imread(str(color_path))
+    assert np.array_equal(converted_img[..., 0], converted_img[..., 1])
+    assert parse_image_header(color_path.read_bytes()).jpeg_quality == 80  # type: ignore
+    assert worker((color_path, "{}", 2, False, False))[0] == ALREADY_GRAY
+    assert worker((color_path, "{}", 2, True, False))[0] == ALREADY_GRAY
+
+    single_channel_data = single_channel_path.read_bytes()
+    assert worker((single_channel_path, "{}", 2, False, False))[0] == SINGLE_CHANNEL
+    assert single_channel_path.read_bytes() == single_channel_data
+    assert worker((gray_path, "{}", 2, False, False))[0] == ALREADY_GRAY
+    assert worker((unreadable_path, "{}", 2, False, False)) == (UNREADABLE, None)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["color.jpg", "gray.png", "single_channel.png",
+                                                                "unreadable.jpg"]
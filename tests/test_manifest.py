@@ -0,0 +1,60 @@
+"""Tests for the manifest of processed files."""
+import os
+from pathlib import Path
+
+import pytest
+
+from src.utils.file_transfer import atomic_output_path
+from src.utils.manifest import encode_params, file_hash, make_record, Manifest
+
+
+def process(input_path: Path, output_path: Path, params: str, manifest: Manifest) -> None:
+    input_stat = input_path.stat()
+    with atomic_output_path(output_path) as tmp_path:
+        tmp_path.write_bytes(input_path.read_bytes()[::-1])
+    manifest.add(make_record(input_path, output_path, params, input_stat))
+
+
+def test_manifest(tmp_path: Path):
+    inputs = [tmp_path / f"in_{i}.jpg" for i in range(4)]
+    outputs = [tmp_path / "out" / f"out_{i}.jpg" for i in range(4)]
+    (tmp_path / "out").mkdir()
+    for i, path in enumerate(inputs):
+        path.write_bytes(bytes([i]) * 100)
+    params = encode_params({"width": 10, "height": 20})
+    pairs = list(zip(inputs, outputs))
+
+    with Manifest(tmp_path / "manifest.sqlite", batch_size=3) as manifest:
+        assert manifest.filter_up_to_date(pairs, params) == [False] * 4
+        for input_path, output_path in pairs[:3]:
+            process(input_path, output_path, params, manifest)
+
+    with Manifest(tmp_path / "manifest.sqlite") as manifest:
+        assert manifest.filter_up_to_date(pairs, params) == [True, True, True, False]
+        assert manifest.filter_up_to_date(pairs, encode_params({"height": 20, "width": 11})) == [False] * 4
+        assert manifest.get_records(inputs)[os.path.abspath(inputs[0])].input_hash == file_hash(inputs[0])
+
+        # Touched input with the same content: still up to date. Modified input or output: to be processed again.
+        os.utime(inputs[0], ns=(0, 0))
+        inputs[1].write_bytes(b"\x05" * 100)
+        outputs[2].write_bytes(b"")
+        assert manifest.filter_up_to_date(pairs, params) == [True, False, False, False]
+        # Resuming trusts the manifest.
+        assert manifest.filter_up_to_date(pairs, params, check_files=False) == [True, True, True, False]
+
+        # Inplace processing.
+        process(inputs[3], inputs[3], params, manifest)
+        assert manifest.filter_up_to_date([(inputs[3], inputs[3])], params) == [True]
+
+
+def test_atomic_output_path(tmp_path: Path):
+    (path := tmp_path / "img.png").write_bytes(b"old")
+    with pytest.raises(RuntimeError), atomic_output_path(path) as tmp_file_path:
+        tmp_file_path.write_bytes(b"partial")
+        raise RuntimeError
+    assert path.read_bytes() == b"old" and list(tmp_path.iterdir()) == [path]
+
+    with atomic_output_path(path) as tmp_file_path:
+        assert tmp_file_path.suffix == ".png" and tmp_file_path.parent == tmp_path
+        tmp_file_path.write_bytes(b"new")
+    assert path.read_bytes() == b"new" and list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,31 @@
+"""Tests for the merging of COCO datasets."""
+from src.merge_coco import merge_annotations, reconcile_categories
+from src.types.coco_types import Category
+
+
+def test_reconcile_categories():
+    merged_categories: list[Category] = []
+    cat_ids_by_name: dict[str, int] = {}
+    first_categories: list[Category] = [{"id": 0, "name": "cat", "supercategory": "animal"},
+                                        {"id": 1, "name": "dog", "supercategory": "animal"}]
+    assert reconcile_categories(merged_categories, cat_ids_by_name, first_categories) == {0: 0, 1: 1}
+    assert merged_categories == first_categories
+
+    second_categories: list[Category] = [{"id": 0, "name": "dog", "supercategory": "animal"},
+                                         {"id": 1, "name": "bird", "supercategory": "animal"},
+                                         {"id": 5, "name": "fish", "supercategory": "animal"}]
+    assert reconcile_categories(merged_categories, cat_ids_by_name, second_categories) == {0: 1, 1: 2, 5: 5}
+    assert [(cat["id"], cat["name"]) for cat in merged_categories] == [(0, "cat"), (1, "dog"), (2, "bird"),
+                                                                       (5, "fish")]
+
+
+def test_merge_annotations():
+    merged_annotations = [{"id": 0, "image_id": 0, "category_id": 0}]
+    annotations = [{"id": 7, "image_id": 1, "category_id": 0},
+                   {"id": 8, "image_id": 3, "category_id": 0},
+                   {"id": 9, "image_id": 2, "category_id": 4},
+                   {"id": 10, "image_id": 2, "category_id": 1}]
+    assert merge_annotations(merged_annotations, annotations, {1: 5, 2: 6}, {0: 1, 1: 2}) == (1, 1)
+    assert merged_annotations == [{"id": 0, "image_id": 0, "category_id": 0},
+                                  {"id": 1, "image_id": 5, "category_id": 1},
+                                  {"id": 2, "image_id": 6, "category_id": 2}]
@@ -0,0 +1,42 @@
+"""Tests for the perceptual hashes and the near duplicates search."""
+import cv2
+import numpy as np
+import pytest
+
+from src.utils.perceptual_hash import dhash, find_close_pairs, find_near_duplicates, phash, popcount
+
+
+@pytest.mark.parametrize("hash_fn", [dhash, phash])
+def test_hashes(hash_fn):
+    rng = np.random.default_rng(0)
+    img = cv2.resize((rng.random((12, 16)) * 255).astype(np.uint8), (320, 240), interpolation=cv2.INTER_CUBIC)
+    other_img = cv2.resize((rng.random((12, 16)) * 255).astype(np.uint8), (320, 240), interpolation=cv2.INTER_CUBIC)
+    img_hash = hash_fn(img)
+    assert 0 <= img_hash < 2**64
+    # Robust to resizing and small changes, but different for a different image.
+    assert bin(img_hash ^ hash_fn(cv2.resize(img, (160, 120), interpolation=cv2.INTER_AREA))).count("1") <= 4
+    assert bin(img_hash ^ hash_fn(cv2.add(img, 3))).count("1") <= 4
+    assert bin(img_hash ^ hash_fn(other_img)).count("1") > 10
+
+
+def test_find_near_duplicates():
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2**63, 500, dtype=np.uint64) * np.uint64(2)
+    flips = np.uint64(1) << rng.integers(0, 64, (100, 3)).astype(np.uint64)
+    near_hashes = hashes[:100] ^ flips[:, 0] ^ flips[:, 1] ^ flips[:, 2]
+    all_hashes = np.concatenate((hashes, near_hashes, hashes[:3]))
+
+    # Compare with all the pairs.
+    distances = popcount((all_hashes[:, None] ^ all_hashes[None]).ravel()).reshape(len(all_hashes), -1)
+    expected_pairs = {(i, j) for i, j in zip(*np.nonzero(np.triu(distances <= 3, 1)))}
+    unique_hashes = np.unique(all_hashes)
+    unique_distances = popcount((unique_hashes[:, None] ^ unique_hashes[None]).ravel()).reshape(len(unique_hashes), -1)
+    found_pairs = {(min(i, j), max(i, j)) for i, j in find_close_pairs(unique_hashes, 3, max_candidates=50).tolist()}
+    assert found_pairs == {(i, j) for i, j in zip(*np.nonzero(np.triu((unique_distances <= 3), 1)))}
+
+    clusters = find_near_duplicates(all_hashes, 3)
+    assert all(len(cluster) >= 2 for cluster in clusters)
+    clustered = {(i, j) for cluster in clusters for i in cluster for j in cluster if i < j}
+    assert expected_pairs <= clustered
+    assert [500, 600] in clusters or [0, 500, 600] in clusters
+    assert find_near_duplicates(np.asarray([1, 1, 2], dtype=np.uint64), 0) == [[0, 1]]
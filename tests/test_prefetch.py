@@ -0,0 +1,41 @@
+"""Tests for the frame prefetcher and its cache."""
+import threading
+
+import numpy as np
+
+from src.utils.prefetch import FrameCache, FramePrefetcher
+
+
+def test_frame_cache_evicts_by_size():
+    cache = FrameCache(max_bytes=250)
+    for idx in range(3):
+        cache.put(idx, np.zeros(100, dtype=np.uint8))
+    assert 0 not in cache and len(cache) == 2 and cache.nb_bytes == 200
+
+    assert cache.get(1) is not None  # 1 becomes the most recently used frame.
+    cache.put(3, np.zeros(100, dtype=np.uint8))
+    assert 2 not in cache and 1 in cache and 3 in cache
+
+    cache.put(4, np.zeros(1000, dtype=np.uint8))  # Too big, but the last frame is always kept.
+    assert len(cache) == 1 and 4 in cache
+
+
+def test_frame_prefetcher():
+    rendered: list[int] = []
+    lock = threading.Lock()
+
+    def render(idx: int):
+        with lock:
+            rendered.append(idx)
+        return None if idx == 3 else np.full(10, idx, dtype=np.uint8)
+
+    with FramePrefetcher(render, nb_frames=6, nb_prefetch=2, max_cache_bytes=1000) as prefetcher:
+        assert prefetcher.get(0)[0] == 0  # type: ignore
+        assert prefetcher.get(1)[0] == 1  # type: ignore
+        assert prefetcher.get(2)[0] == 2  # type: ignore
+        assert prefetcher.get(3) is None
+        # Stepping back uses the cache.
+        assert prefetcher.get(1)[0] == 1  # type: ignore
+    # The frames that were prefetched or cached were only rendered once.
+    assert sorted(rendered[:3]) == [0, 1, 2]
+    assert rendered.count(1) == 1 and rendered.count(2) == 1
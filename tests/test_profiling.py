@@ -0,0 +1,83 @@
+"""Tests for the profiling of the scripts."""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from src.utils.coco_json import save_coco_json
+from src.utils.profiling import Profiler
+from src.utils.synthetic_coco import generate_synthetic_coco, SyntheticConfig
+
+
+def test_disabled_profiler():
+    profiler = Profiler()
+    with profiler.stage("load_json"):
+        profiler.count("annotations", 10)
+    assert profiler.stages == {} and profiler.counters == {}
+    assert profiler.stage("load_json") is profiler.stage("transform")  # No allocation when disabled.
+
+
+def test_stages_and_counters():
+    profiler = Profiler()
+    profiler.start()
+    for _ in range(2):
+        with profiler.stage("outer"):
+            with profiler.stage("inner"):
+                profiler.count("entries", 5)
+    profiler.count("entries")
+    profiler.stop()
+    with profiler.stage("after_stop"):
+        profiler.count("entries")
+
+    report = profiler.get_report()
+    assert set(report["stages"]) == {"outer", "inner"}
+    assert report["stages"]["outer"]["calls"] == report["stages"]["inner"]["calls"] == 2
+    assert report["stages"]["outer"]["time"] >= report["stages"]["inner"]["time"] > 0
+    assert report["counters"] == {"entries": 11}
+    assert report["wall_time"] > 0 and "traced_peak_mb" not in report
+
+
+def test_trace_memory():
+    profiler = Profiler()
+    profiler.start(trace_memory=True)
+    with profiler.stage("outer"):
+        with profiler.stage("big"):
+            data = bytearray(8 * 2**20)
+            del data
+        with profiler.stage("small"):
+            data = bytearray(2**20)
+            del data
+    profiler.stop()
+
+    stages = profiler.get_report()["stages"]
+    assert 8 <= stages["big"]["traced_peak_mb"] < 9
+    assert 1 <= stages["small"]["traced_peak_mb"] < 2
+    # The peak of an inner stage is also the peak of the outer one, even if tracemalloc was reset since.
+    assert stages["outer"]["traced_peak_mb"] >= stages["big"]["traced_peak_mb"]
+    assert profiler.get_report()["traced_peak_mb"] >= 8
+
+
+def test_script_report(tmp_path: Path):
+    json_path = tmp_path / "annotations.json"
+    save_coco_json(json_path, generate_synthetic_coco(SyntheticConfig(nb_images=5, nb_annotations=20)))
+    metrics_path = tmp_path / "metrics" / "dedupe.json"
+    subprocess.run([sys.executable, "-m", "src.dedupe_annotations", str(json_path), "--dry_run",
+                    "--metrics_out", str(metrics_path), "--profile", "--trace_memory"], check=True, capture_output=True)
+
+    with open(metrics_path, "r", encoding="utf-8") as metrics_file:
+        report = json.load(metrics_file)
+    assert report["script"] == "dedupe_annotations"
+    assert {"load_json", "transform"} <= set(report["stages"])
+    assert report["counters"]["annotations_loaded"] == report["counters"]["annotations_processed"] == 20
+    assert report["max_rss_mb"] > 0 and report["traced_peak_mb"] > 0
+    cprofile_path = metrics_path.with_suffix(".prof")
+    assert Path(report["cprofile_path"]) == cprofile_path and cprofile_path.exists()
+
+
+def test_script_without_profiling(tmp_path: Path):
+    json_path = tmp_path / "annotations.json"
+    save_coco_json(json_path, generate_synthetic_coco(SyntheticConfig(nb_images=2, nb_annotations=4)))
+    result = subprocess.run([sys.executable, "-m", "src.coco_stats", str(json_path)],
+                            check=True, capture_output=True, text=True, cwd=Path(__file__).parents[1])
+    assert "wall_time" not in result.stderr
+    assert not list(Path(__file__).parents[1].glob("*.prof"))
@@ -0,0 +1,105 @@
+"""Tests for the resizing of the images and the rescaling of the annotations."""
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src.resize_coco import get_imread_flag, resize_annotations, resize_rles, worker
+from src.types.coco_types import Annotation
+from src.utils.polygons import annotations_areas, flatten_polygons, polygons_areas, unflatten_polygons
+from src.utils.segmentation_conversions import (
+    encoded_rle_to_rle,
+    mask_to_rle,
+    masks_to_rles,
+    rle_to_encoded_rle,
+    rle_to_mask,
+)
+
+
+def test_flat_polygons_round_trip():
+    segmentations = [[[0., 0., 4., 0., 4., 2., 0., 2.], [10., 10., 12., 10., 10., 12.]], [], [[1., 1., 3., 1., 1., 5.]]]
+    flat_polygons = flatten_polygons(segmentations)
+    assert unflatten_polygons(flat_polygons) == segmentations
+    np.testing.assert_allclose(polygons_areas(flat_polygons), [8, 2, 4])
+    np.testing.assert_allclose(annotations_areas(flat_polygons), [10, 0, 4])
+
+    with pytest.raises(ValueError):
+        flatten_polygons([[[0., 0., 1.]]])
+
+
+def test_resize_rles():
+    mask = np.zeros((40, 60), dtype=np.uint8)
+    mask[10:20, 30:50] = 1
+    expected = cv2.resize(mask, (30, 20), interpolation=cv2.INTER_NEAREST)
+    assert resize_rles([mask_to_rle(mask)] * 3, 40, 60, 20, 30) == [mask_to_rle(expected)] * 3
+    # More masks than the number of channels OpenCV could resize at once.
+    assert resize_rles([mask_to_rle(mask)] * 300, 40, 60, 20, 30) == [mask_to_rle(expected)] * 300
+
+
+@pytest.mark.parametrize("new_height, new_width", [(20, 30), (13, 7), (97, 61), (40, 1), (1, 60), (123, 17)])
+def test_resize_rles_like_opencv(new_height: int, new_width: int):
+    masks = np.random.default_rng(0).random((5, 40, 60)) > 0.5
+    expected_masks = [cv2.resize(mask.astype(np.uint8), (new_width, new_height), interpolation=cv2.INTER_NEAREST)
+                      for mask in masks]
+    expected_rles = masks_to_rles(np.stack(expected_masks).reshape(len(masks), new_height, new_width))
+    assert resize_rles([mask_to_rle(mask) for mask in masks], 40, 60, new_height, new_width) == expected_rles
+
+
+def test_resize_annotations():
+    mask = np.zeros((40, 60), dtype=np.uint8)
+    mask[10:20, 30:50] = 1
+    annotations: list[Annotation] = [
+        {"id": 0, "image_id": 0, "category_id": 0, "segmentation": [[0., 0., 4., 0., 4., 2., 0., 2.],
+                                                                    [10., 10., 12., 10., 10., 12.]],
+         "area": 10., "bbox": [0., 0., 12., 12.], "iscrowd": 0},
+        {"id": 1, "image_id": 1, "category_id": 0, "segmentation": {"size": [40, 60], "counts": mask_to_rle(mask)},
+         "area": 200., "bbox": [30., 10., 20., 10.], "iscrowd": 0},
+        {"id": 2, "image_id": 1, "category_id": 0,
+         "segmentation": {"size": [40, 60], "counts": rle_to_encoded_rle(mask_to_rle(mask))},
+         "area": 200., "bbox": [30., 10., 20., 10.], "iscrowd": 0},
+    ]
+    resized = resize_annotations(annotations, np.asarray([[0.5, 2.], [0.5, 0.5], [0.5, 0.5]]), 30, 20)
+
+    assert resized[0]["segmentation"] == [[0., 0., 2., 0., 2., 4., 0., 4.], [5., 20., 6., 20., 5., 24.]]
+    assert resized[0]["area"] == pytest.approx(10)
+    assert resized[0]["bbox"] == [0., 0., 6., 24.]
+    assert resized[1]["area"] == resized[2]["area"] == 50
+    assert resized[1]["bbox"] == [15., 5., 10., 5.]
+    assert resized[1]["segmentation"]["size"] == [20, 30]  # type: ignore
+    resized_mask = rle_to_mask(resized[1]["segmentation"]["counts"], 20, 30)  # type: ignore
+    assert resized_mask.sum() == 50 and resized_mask[5:10, 15:25].all()
+    assert isinstance(resized[2]["segmentation"]["counts"], str)  # type: ignore
+    encoded_counts = resized[2]["segmentation"]["counts"]  # type: ignore
+    assert encoded_rle_to_rle(encoded_counts).tolist() == resized[1]["segmentation"]["counts"]  # type: ignore
+    assert annotations[0]["bbox"] == [0., 0., 12., 12.]
+
+
+def test_get_imread_flag():
+    assert get_imread_flag(Path("a.jpg"), 6000, 4000, 640, 480) == cv2.IMREAD_REDUCED_COLOR_8
+    assert get_imread_flag(Path("a.JPEG"), 6000, 4000, 1000, 1000) == cv2.IMREAD_REDUCED_COLOR_4
+    assert get_imread_flag(Path("a.jpg"), 1000, 1000, 500, 400) == cv2.IMREAD_REDUCED_COLOR_2
+    assert get_imread_flag(Path("a.jpg"), 1000, 1000, 501, 400) == cv2.IMREAD_COLOR
+    assert get_imread_flag(Path("a.png"), 6000, 4000, 640, 480) == cv2.IMREAD_COLOR
+
+
+def test_worker(tmp_path: Path):
+    (data_path := tmp_path / "images").mkdir()
+    img = np.zeros((160, 240, 3), dtype=np.uint8)
+    img[40:120, 60:180] = 255
+    cv2.imwrite(str(data_path / "big.jpg"), img)
+    cv2.imwrite(str(data_path / "small.png"), img[:40, :60])
+    output_path = tmp_path / "output"
+
+    record = worker(({"id": 0, "file_name": "big.jpg", "width": 240, "height": 160}, data_path, output_path, 60, 40,
+                     "copy", 90, 1, "{}"))
+    assert record.output_path == str(output_path / "images" / "big.jpg")
+    assert record.input_size == (data_path / "big.jpg").stat().st_size
+    resized_img = cv2.imread(str(output_path / "images" / "big.jpg"))
+    assert resized_img.shape == (40, 60, 3)
+    assert resized_img[20, 30].min() > 200 and resized_img[2, 2].max() < 50
+
+    worker(({"id": 1, "file_name": "small.png", "width": 60, "height": 40}, data_path, output_path, 60, 40,
+            "hardlink", 90, 1, "{}"))
+    assert os.path.samefile(data_path / "small.png", output_path / "images" / "small.png")
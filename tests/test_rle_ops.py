@@ -0,0 +1,85 @@
+"""Tests for the operations done directly on RLEs."""
+import cv2
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from src.utils.rle_ops import (
+    merge_rles,
+    rle_area,
+    rle_bbox,
+    rle_intersection,
+    rle_union,
+    rles_areas,
+    rles_bboxes,
+    rles_iou,
+)
+from src.utils.segmentation_conversions import mask_to_rle, rle_to_mask
+
+
+def random_masks(nb_masks: int, height: int, width: int, seed: int = 0) -> npt.NDArray[np.uint8]:
+    """Masks made of a few random ellipses (some of them empty or touching the edges of the image)."""
+    rng = np.random.default_rng(seed)
+    masks = np.zeros((nb_masks, height, width), dtype=np.uint8)
+    for mask in masks[1:]:
+        for _ in range(rng.integers(1, 4)):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            axes = (int(rng.integers(1, width // 3)), int(rng.integers(1, height // 3)))
+            cv2.ellipse(mask, center, axes, float(rng.uniform(0, 180)), 0, 360, 1, thickness=-1)
+    return masks
+
+
+def test_area_and_bbox():
+    masks = random_masks(30, 50, 70)
+    rles = [mask_to_rle(mask) for mask in masks]
+    np.testing.assert_array_equal(rles_areas(rles), masks.sum(axis=(1, 2)))
+    assert rle_area(rles[3]) == masks[3].sum()
+
+    bboxes = rles_bboxes(rles, 50)
+    assert bboxes[0].tolist() == [0., 0., 0., 0.]
+    for mask, bbox in zip(masks[1:], bboxes[1:]):
+        ys, xs = np.nonzero(mask)
+        assert bbox.tolist() == [xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1]
+    assert rle_bbox(rles[5], 50) == bboxes[5].tolist()
+
+
+def test_merge_rles():
+    masks = random_masks(4, 50, 70, seed=1).astype(np.bool_)
+    rles = [mask_to_rle(mask) for mask in masks]
+    np.testing.assert_array_equal(rle_to_mask(rle_union(rles[1], rles[2]), 50, 70), masks[1] | masks[2])
+    np.testing.assert_array_equal(rle_to_mask(rle_intersection(rles[1], rles[2]), 50, 70), masks[1] & masks[2])
+    np.testing.assert_array_equal(rle_to_mask(merge_rles(rles[1:]), 50, 70), masks[1:].any(axis=0))
+    np.testing.assert_array_equal(rle_to_mask(merge_rles(rles, intersect=True), 50, 70), masks.all(axis=0))
+    assert merge_rles([[0, 10], [5, 5]]).tolist() == [0, 10]
+
+    with pytest.raises(ValueError):
+        merge_rles([[10], [5, 6]])
+
+
+def test_rles_iou():
+    masks_1, masks_2 = random_masks(25, 40, 60, seed=2), random_masks(20, 40, 60, seed=3)
+    iscrowd = np.arange(20) % 3 == 0
+    ious = rles_iou([mask_to_rle(mask) for mask in masks_1], [mask_to_rle(mask) for mask in masks_2], 40, iscrowd)
+
+    flat_1, flat_2 = masks_1.reshape(25, -1).astype(np.int64), masks_2.reshape(20, -1).astype(np.int64)
+    intersections = flat_1 @ flat_2.T
+    areas_1, areas_2 = flat_1.sum(axis=1)[:, None], flat_2.sum(axis=1)[None]
+    unions = np.where(iscrowd[None], areas_1, areas_1 + areas_2 - intersections)
+    expected = np.divide(intersections, unions, out=np.zeros(unions.shape), where=unions > 0)
+    np.testing.assert_allclose(ious, expected)
+    assert rles_iou([], [[2400]], 40).shape == (0, 1)
+
+    # Empty masks at the end of the first set.
+    assert rles_iou([[0, 4], [4]], [[0, 4]], 2).tolist() == [[1.], [0.]]
+    ious = rles_iou([mask_to_rle(mask) for mask in masks_1[::-1]], [mask_to_rle(mask) for mask in masks_2], 40, iscrowd)
+    np.testing.assert_allclose(ious, expected[::-1])
+
+
+@pytest.mark.pycocotools
+def test_rles_iou_matches_pycocotools():
+    mask_api = pytest.importorskip("pycocotools.mask")
+    masks = random_masks(40, 64, 48, seed=4)
+    rles = [mask_to_rle(mask) for mask in masks]
+    encoded_rles = mask_api.encode(np.asfortranarray(masks.transpose(1, 2, 0)))
+    iscrowd = [i % 2 for i in range(40)]
+    np.testing.assert_allclose(rles_iou(rles, rles, 64, iscrowd), mask_api.iou(encoded_rles, encoded_rles, iscrowd))
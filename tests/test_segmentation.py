@@ -1,15 +1,192 @@
 """Tests for the segmentation conversion functions."""
-# import pytest
+import time
+
+import cv2
 import numpy as np
+import pytest
 
-from src.utils.segmentation_conversions import mask_to_rle
+from src.utils.segmentation_conversions import (
+    encoded_rle_to_rle,
+    encoded_rles_to_rles,
+    mask_to_rle,
+    masks_to_rles,
+    polygon_to_rle,
+    polygons_to_rles,
+    rle_to_encoded_rle,
+    rle_to_mask,
+    rle_to_polygon,
+    rles_to_encoded_rles,
+    rles_to_masks,
+    rles_to_polygons,
+)
 
 
-# @pytest.mark.parametrize("width, height, etc...",
-#                          [(),
-#                           (),
-#                           ])
 def test_mask_to_rle():
     square_img = np.zeros((40, 40), dtype=np.uint8)
     square_img[5:10, 6:11] = 255
     assert mask_to_rle(square_img) == [245, 5, 35, 5, 35, 5, 35, 5, 35, 5, 1190]
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.bool_])
+def test_masks_rles_round_trip(dtype: type):
+    masks = np.zeros((3, 40, 40), dtype=dtype)
+    masks[0, 5:10, 6:11] = 1
+    masks[1, :, :3] = 1
+    masks[2, -1, -1] = 1
+    rles = masks_to_rles(masks)
+    assert rles[0] == [245, 5, 35, 5, 35, 5, 35, 5, 35, 5, 1190]
+    assert rles == [mask_to_rle(mask) for mask in masks]
+    assert rles[1] == [0, 120, 1480]
+
+    decoded_masks = rles_to_masks(rles, 40, 40)
+    assert decoded_masks.shape == (3, 40, 40)
+    np.testing.assert_array_equal(decoded_masks, masks.astype(np.bool_))
+    np.testing.assert_array_equal(rle_to_mask(rles[2], 40, 40), masks[2].astype(np.bool_))
+
+
+@pytest.mark.parametrize("shape", [(50, 7, 9), (5, 1, 6), (5, 6, 1), (3, 1, 1)])
+@pytest.mark.parametrize("chunk_pixels", [1, 2**20])
+def test_masks_to_rles_random(monkeypatch: pytest.MonkeyPatch, shape: tuple[int, int, int], chunk_pixels: int):
+    monkeypatch.setattr("src.utils.segmentation_conversions._MASKS_CHUNK_PIXELS", chunk_pixels)
+    masks = (np.random.default_rng(0).random(shape) < 0.5).astype(np.uint8) * 255
+    expected_rles = []
+    for mask in masks:
+        # Runs of the column-major pixels, the first one being a run of 0s.
+        flat_mask = mask.ravel(order="F") != 0
+        run_ends = np.flatnonzero(np.append(flat_mask[1:] != flat_mask[:-1], True)) + 1
+        rle = np.diff(run_ends, prepend=0).tolist()
+        expected_rles.append([0, *rle] if flat_mask[0] else rle)
+    assert masks_to_rles(masks) == expected_rles
+    column_major_masks = np.ascontiguousarray(masks.transpose(0, 2, 1)).transpose(0, 2, 1)
+    assert masks_to_rles(column_major_masks) == expected_rles
+
+
+def test_masks_to_rles_not_slower_than_loop():
+    row_major_masks = np.zeros((128, 240, 320), dtype=np.uint8)
+    for i, mask in enumerate(row_major_masks):
+        mask[i:i + 80, 2 * i:2 * i + 100] = 1
+    # Both row-major masks and column-major ones (from rles_to_masks).
+    for masks in (row_major_masks, rles_to_masks(masks_to_rles(row_major_masks), 240, 320)):
+        batch_times, loop_times = [], []
+        for _ in range(3):
+            start_time = time.perf_counter()
+            rles = masks_to_rles(masks)
+            batch_times.append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            looped_rles = [mask_to_rle(mask) for mask in masks]
+            loop_times.append(time.perf_counter() - start_time)
+        assert rles == looped_rles
+        assert min(batch_times) <= 1.2 * min(loop_times)
+
+
+def test_rle_to_mask_wrong_size():
+    with pytest.raises(ValueError):
+        rle_to_mask([245, 5, 35], 40, 40)
+
+
+@pytest.mark.parametrize("rle", [[245, 5, 35, 5, 35, 5, 35, 5, 35, 5, 1190],
+                                 [0, 1600],
+                                 [3, 4_000_000, 2, 7, 1],
+                                 [0, 2**31 - 5, 5, 2**31 - 5],
+                                 []])
+def test_encoded_rle_round_trip(rle: list[int]):
+    assert encoded_rle_to_rle(rle_to_encoded_rle(rle)).tolist() == rle
+
+
+def test_encoded_rles_batch():
+    rles = [[245, 5, 35, 5, 35, 5, 35, 5, 35, 5, 1190], [], [12, 3, 1585], [1600]]
+    encoded_rles = rles_to_encoded_rles(rles)
+    assert encoded_rles == [rle_to_encoded_rle(rle) for rle in rles]
+    assert [rle.tolist() for rle in encoded_rles_to_rles(encoded_rles)] == rles
+
+
+@pytest.mark.pycocotools
+def test_encoded_rle_matches_pycocotools():
+    mask_api = pytest.importorskip("pycocotools.mask")
+    rng = np.random.default_rng(42)
+    masks = [np.asfortranarray(rng.random((37, 53)) < density, dtype=np.uint8) for density in (0.02, 0.5, 0.98)]
+    disk = np.zeros((300, 200), dtype=np.uint8, order="F")
+    disk[np.hypot(*np.mgrid[:300, :200] - np.asarray([[[150]], [[90]]])) < 70] = 1
+    masks.append(disk)
+
+    for mask in masks:
+        encoded_rle = mask_api.encode(mask)["counts"]
+        rle = mask_to_rle(mask)
+        assert encoded_rle_to_rle(encoded_rle).tolist() == rle
+        assert rle_to_encoded_rle(rle) == encoded_rle.decode("ascii")
+
+
+def test_polygon_to_rle():
+    # Square covering the pixels (1, 1) to (2, 2) of a 4x4 image, with pixel centers at integer coordinates.
+    rle = polygon_to_rle([[0.5, 0.5, 2.5, 0.5, 2.5, 2.5, 0.5, 2.5]], 4, 4)
+    expected_mask = np.zeros((4, 4), dtype=np.bool_)
+    expected_mask[1:3, 1:3] = True
+    np.testing.assert_array_equal(rle_to_mask(rle, 4, 4), expected_mask)
+
+    # Overlapping parts are merged, and polygons outside of the image are clipped.
+    rle = polygon_to_rle([[0.5, 0.5, 2.5, 0.5, 2.5, 2.5, 0.5, 2.5], [1.5, 1.5, 9, 1.5, 9, 9, 1.5, 9]], 4, 4)
+    expected_mask[2:, 2:] = True
+    np.testing.assert_array_equal(rle_to_mask(rle, 4, 4), expected_mask)
+    assert polygon_to_rle([], 4, 4).tolist() == [16]
+
+
+@pytest.mark.pycocotools
+def test_polygons_to_rles_matches_pycocotools():
+    mask_api = pytest.importorskip("pycocotools.mask")
+    rng = np.random.default_rng(0)
+    segmentations, heights, widths = [], [], []
+    for i in range(300):
+        height, width = rng.integers(1, 60, size=2)
+        polygons = [rng.uniform(-10, max(height, width) + 10, size=2 * rng.integers(3, 9))
+                    for _ in range(rng.integers(1, 4))]
+        # Also test coordinates that fall exactly on the pixel boundaries.
+        segmentations.append([(np.round(polygon * 2) / 2 if i % 2 else polygon).tolist() for polygon in polygons])
+        heights.append(int(height))
+        widths.append(int(width))
+
+    rles = polygons_to_rles(segmentations, heights, widths)
+    for segmentation, height, width, rle in zip(segmentations, heights, widths, rles):
+        expected = mask_api.merge(mask_api.frPyObjects(segmentation, height, width))["counts"].decode("ascii")
+        assert rle_to_encoded_rle(rle) == expected
+
+
+def test_rle_to_polygon():
+    mask = np.zeros((40, 30), dtype=np.uint8)
+    mask[5:10, 6:11] = 1
+    mask[30:, 25:] = 1
+    mask[0, 0] = 1
+    polygons = rle_to_polygon(mask_to_rle(mask), 40, 30)
+    assert sorted(polygons) == [[0., 0., 0., 1., 1., 1., 1., 0.],
+                                [6., 5., 6., 10., 11., 10., 11., 5.],
+                                [25., 30., 25., 40., 30., 40., 30., 30.]]
+    assert (rle_to_mask(polygon_to_rle(polygons, 40, 30), 40, 30) == mask).all()
+
+
+def test_rles_to_polygons_simplification():
+    disk = np.zeros((60, 80), dtype=np.uint8)
+    disk_rle = mask_to_rle(cv2.circle(disk, (40, 30), 20, 1, thickness=-1))
+    exact, empty = rles_to_polygons([disk_rle, [4800]], 60, 80)
+    simplified = rle_to_polygon(disk_rle, 60, 80, epsilon=2.)
+    assert empty == []
+    assert len(simplified[0]) < len(exact[0])
+    assert (rle_to_mask(polygon_to_rle(exact, 60, 80), 60, 80) == disk).all()
+    round_trip = rle_to_mask(polygon_to_rle(simplified, 60, 80), 60, 80)
+    assert (round_trip != disk).sum() < 0.1 * disk.sum()
+
+
+def test_rle_to_polygon_round_trip():
+    masks = [cv2.circle(np.zeros((30, 40), dtype=np.uint8), (20, 15), 9, 1, thickness=-1),
+             np.eye(15, 20, k=3, dtype=np.uint8),
+             cv2.ellipse(np.zeros((40, 30), dtype=np.uint8), (15, 20), (12, 5), 30., 0, 360, 1, thickness=-1)]
+    rng = np.random.default_rng(0)
+    masks += [(rng.random((20, 25)) < 0.5).astype(np.uint8) for _ in range(5)]
+    for mask in masks:
+        height, width = mask.shape
+        polygons = rle_to_polygon(mask_to_rle(mask), height, width)
+        # The holes of the mask (the background not connected to the outside) are filled.
+        _, background = cv2.connectedComponents(np.pad(1 - mask, 1, constant_values=1), connectivity=8)
+        filled_mask = background[1:-1, 1:-1] != background[0, 0]
+        assert (rle_to_mask(polygon_to_rle(polygons, height, width), height, width) == filled_mask).all()
+
+    # Pixels touching by a corner are in separate polygons.
+    assert len(rle_to_polygon(mask_to_rle(np.eye(15, 20, k=3, dtype=np.uint8)), 15, 20)) == 15
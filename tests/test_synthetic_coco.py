@@ -0,0 +1,101 @@
+"""Tests for the synthetic dataset generation."""
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src.convert_VOC_to_coco import parse_voc2007_annotation
+from src.utils.segmentation_conversions import encoded_rle_to_rle, polygon_to_rle
+from src.utils.synthetic_coco import (
+    check_config,
+    generate_synthetic_coco,
+    get_synthetic_images,
+    SyntheticConfig,
+    write_synthetic_images,
+    write_voc_annotations,
+)
+
+
+def test_generate_synthetic_coco():
+    config = SyntheticConfig(nb_images=20, nb_annotations=300, nb_categories=5, img_sizes=((64, 48), (40, 80)),
+                             segmentation_mix=(0.5, 0.25, 0.25), nb_vertices=6)
+    dataset = generate_synthetic_coco(config)
+    assert dataset == generate_synthetic_coco(config)
+    assert dataset != generate_synthetic_coco(config._replace(seed=1))
+
+    images, annotations = dataset["images"], dataset["annotations"]
+    assert [image["id"] for image in images] == list(range(20))
+    assert {(image["width"], image["height"]) for image in images} == {(64, 48), (40, 80)}
+    assert [annotation["id"] for annotation in annotations] == list(range(300))
+    image_ids = [annotation["image_id"] for annotation in annotations]
+    assert image_ids == sorted(image_ids)
+    assert {annotation["category_id"] for annotation in annotations} == {1, 2, 3, 4, 5}
+    assert [category["id"] for category in dataset["categories"]] == [1, 2, 3, 4, 5]
+
+    nb_polygons = nb_rles = nb_encoded_rles = 0
+    for annotation in annotations:
+        image = images[annotation["image_id"]]
+        x, y, width, height = annotation["bbox"]
+        assert 0 <= x and x + width <= image["width"] + 0.01 and 0 <= y and y + height <= image["height"] + 0.01
+        segmentation = annotation["segmentation"]
+        if isinstance(segmentation, list):
+            nb_polygons += 1
+            assert len(segmentation) == 1 and len(segmentation[0]) == 12
+            continue
+        assert segmentation["size"] == [image["height"], image["width"]]
+        if isinstance(segmentation["counts"], str):
+            nb_encoded_rles += 1
+            rle = encoded_rle_to_rle(segmentation["counts"])
+        else:
+            nb_rles += 1
+            rle = segmentation["counts"]
+        assert sum(rle) == image["width"] * image["height"]
+        assert annotation["area"] == sum(rle[1::2])
+    assert nb_polygons > 100 and nb_rles > 40 and nb_encoded_rles > 40
+
+
+def test_generate_synthetic_coco_segmentation_types():
+    config = SyntheticConfig(nb_images=5, nb_annotations=50, segmentation_mix=(0., 1., 0.))
+    polygon_config = config._replace(segmentation_mix=(1., 0., 0.))
+    for annotation, polygon_annotation in zip(generate_synthetic_coco(config)["annotations"],
+                                              generate_synthetic_coco(polygon_config)["annotations"]):
+        # The RLEs are the rasterized polygons.
+        assert annotation["segmentation"]["counts"] == polygon_to_rle(polygon_annotation["segmentation"],
+                                                                      480, 640).tolist()
+        assert annotation["bbox"] == polygon_annotation["bbox"]
+
+
+@pytest.mark.parametrize("config", [SyntheticConfig(nb_images=0), SyntheticConfig(nb_categories=0),
+                                    SyntheticConfig(img_sizes=()), SyntheticConfig(img_sizes=((0, 10),)),
+                                    SyntheticConfig(segmentation_mix=(0., 0., 0.)),
+                                    SyntheticConfig(segmentation_mix=(1., -1., 1.)), SyntheticConfig(nb_vertices=2)])
+def test_check_config(config: SyntheticConfig):
+    with pytest.raises(ValueError):
+        check_config(config)
+
+
+def test_write_synthetic_images(tmp_path: Path):
+    images = get_synthetic_images(SyntheticConfig(nb_images=6, img_sizes=((32, 24), (16, 40)), image_extension=".png"))
+    write_synthetic_images(images, tmp_path / "a", seed=3, gray_ratio=0.5)
+    write_synthetic_images(images, tmp_path / "b", seed=3, gray_ratio=0.5, nb_threads=1)
+    nb_gray = 0
+    for image in images:
+        img = cv2.imread(str(tmp_path / "a" / image["file_name"]))
+        assert img.shape == (image["height"], image["width"], 3)
+        np.testing.assert_array_equal(img, cv2.imread(str(tmp_path / "b" / image["file_name"])))
+        nb_gray += bool((img == img[..., :1]).all())
+    assert 0 < nb_gray < len(images)
+
+
+def test_write_voc_annotations(tmp_path: Path):
+    dataset = generate_synthetic_coco(SyntheticConfig(nb_images=3, nb_annotations=10, nb_categories=2))
+    write_voc_annotations(dataset["images"], dataset["annotations"], dataset["categories"], tmp_path)
+
+    nb_objects = 0
+    for image in dataset["images"]:
+        img_name, width, height, objects = parse_voc2007_annotation(tmp_path / (Path(image["file_name"]).stem + ".xml"))
+        assert (img_name, width, height) == (image["file_name"], image["width"], image["height"])
+        assert {name for name, _, _ in objects} <= {"category_1", "category_2"}
+        nb_objects += len(objects)
+    assert nb_objects == 10
@@ -0,0 +1,62 @@
+"""Tests for the rendering of the annotations."""
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src.types.coco_types import Annotation
+from src.utils.segmentation_conversions import mask_to_rle, rle_to_encoded_rle
+from src.visualize_coco_data import draw_annotations, get_colors, get_label_map, make_mosaic, render_worker
+
+
+def get_annotations() -> list[Annotation]:
+    rle_mask = np.zeros((40, 60), dtype=np.uint8)
+    rle_mask[10:20, 30:50] = 1
+    encoded_mask = np.zeros((40, 60), dtype=np.uint8)
+    encoded_mask[15:35, 45:55] = 1
+    return [
+        {"id": 0, "image_id": 0, "category_id": 1, "segmentation": [[2., 2., 12., 2., 12., 8., 2., 8.]],
+         "area": 60., "bbox": [2., 2., 10., 6.], "iscrowd": 0},
+        {"id": 1, "image_id": 0, "category_id": 1, "segmentation": {"size": [40, 60], "counts": mask_to_rle(rle_mask)},
+         "area": 200., "bbox": [30., 10., 20., 10.], "iscrowd": 0},
+        {"id": 2, "image_id": 0, "category_id": 2,
+         "segmentation": {"size": [40, 60], "counts": rle_to_encoded_rle(mask_to_rle(encoded_mask))},
+         "area": 200., "bbox": [45., 15., 10., 20.], "iscrowd": 0},
+    ]
+
+
+def test_get_label_map():
+    label_map = get_label_map(get_annotations(), 40, 60)
+    assert label_map.shape == (40, 60)
+    expected = np.zeros((40, 60), dtype=np.int32)
+    expected[2:9, 2:13] = 1
+    expected[10:20, 30:50] = 2
+    expected[15:35, 45:55] = 3
+    np.testing.assert_array_equal(label_map, expected)
+
+    with pytest.raises(ValueError):
+        get_label_map(get_annotations(), 60, 40)
+
+
+def test_draw_annotations():
+    img = np.full((40, 60, 3), 100, dtype=np.uint8)
+    drawn = draw_annotations(img.copy(), get_annotations(), {1: "a", 2: "b"}, seed=3)
+    colors = get_colors(3, seed=3)
+    np.testing.assert_array_equal(drawn[0, 0], [100, 100, 100])
+    np.testing.assert_array_equal(drawn[12, 35], (0.3 * colors[1] + 0.7 * 100).astype(np.uint8))
+    np.testing.assert_array_equal(drawn[17, 47], (0.3 * colors[2] + 0.7 * 100).astype(np.uint8))
+
+
+def test_render_worker(tmp_path: Path):
+    (data_path := tmp_path / "images" / "sub").mkdir(parents=True)
+    cv2.imwrite(str(data_path / "img.png"), np.full((40, 60, 3), 100, dtype=np.uint8))
+    output_dir = tmp_path / "output"
+    tile = render_worker((0, {"id": 0, "file_name": "sub/img.png", "width": 60, "height": 40}, get_annotations(),
+                          {1: "a", 2: "b"}, tmp_path / "images", output_dir, True, (32, 48)))
+    assert cv2.imread(str(output_dir / "sub" / "img.png")).shape == (40, 60, 3)
+    assert tile is not None and tile.shape == (48, 32, 3)
+    assert make_mosaic([tile] * 5, nb_columns=3).shape == (96, 96, 3)
+
+    assert render_worker((1, {"id": 1, "file_name": "missing.png", "width": 60, "height": 40}, [], {},
+                          tmp_path / "images", output_dir, False, None)) is None